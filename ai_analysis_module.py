@@ -1,109 +1,697 @@
 # ai_analysis_module.py
-import google.generativeai as genai
-from PIL import Image
+import itertools
 import json
+import logging
 import os
+import threading
+import time
+import preprocess_module
+import montaje_module
+import almacenamiento_module
+import cache_module
+import database_module
+import motor_analisis_module
+import metricas_module
+from utilidades_json_module import extraer_json # Reexportado: lo usan los llamadores de este módulo
+from config import AI_CACHE_ENABLED, AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL_SECONDS
+from config import (AI_REQUESTS_PER_MINUTE, AI_BURST, AI_CONCURRENCY, AI_MAX_RETRIES, AI_BACKOFF_BASE_SECONDS,
+                    AI_BACKOFF_MAX_SECONDS, AI_REQUEST_TIMEOUT_SECONDS, AI_STREAMING)
+from config import AI_CHUNK_SIZE, AI_CHUNK_RETRIES, AI_REDUCE_FANIN
+from config import (MONTAGE_MAX_WIDTH, MONTAGE_MAX_HEIGHT, MONTAGE_MAX_SHEETS, MONTAGE_MAX_TILES_PER_SHEET, MONTAGE_QUALITY,
+                    PREPROCESS_FORMAT)
+
+logger = logging.getLogger(__name__) # Logger para este módulo
 
 # **IMPORTANTE:** Configura tu API Key de Gemini aquí o como variable de entorno.
 # genai.configure(api_key="YOUR_API_KEY")
 # Considera usar variables de entorno para mayor seguridad:
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    print("Advertencia: No se encontró la API Key de Gemini en variables de entorno (GOOGLE_API_KEY).")
-    print("Por favor, configura tu API Key en config.py o como variable de entorno.")
-    # La aplicación podría no funcionar correctamente sin la API Key configurada.
 
+_genai = None # SDK de Gemini: se importa y configura en la primera solicitud real al modelo
+_genai_lock = threading.Lock()
 
-def analizar_screenshot(ruta_imagen):
+def inicializar_gemini():
     """
-    Analiza una captura de pantalla utilizando el modelo multimodal Gemini Pro Vision.
-    Args:
-        ruta_imagen (str): La ruta completa al archivo de la imagen.
-    Returns:
-        str: Un resumen textual del análisis generado por Gemini,
-             o None si ocurre un error.
+    Importa y configura el SDK de Gemini (una sola vez) y retorna el módulo `genai`.
+    Se llama sola en la primera solicitud al modelo; puede llamarse antes para pagar el costo
+    de importación por adelantado. Importar este módulo no carga el SDK.
     """
-    try:
-        img = Image.open(ruta_imagen)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp', system_instruction="""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            if GOOGLE_API_KEY:
+                genai.configure(api_key=GOOGLE_API_KEY)
+            else:
+                logger.warning("No se encontró la API Key de Gemini en variables de entorno (GOOGLE_API_KEY).")
+                logger.warning("Por favor, configura tu API Key en config.py o como variable de entorno.")
+                # La aplicación podría no funcionar correctamente sin la API Key configurada.
+            _genai = genai
+        return _genai
+
+
+MODELO_GEMINI = 'gemini-2.0-flash-exp'
+MAX_OUTPUT_TOKENS = 300
+
+SYSTEM_INSTRUCTION_SCREENSHOT = """
         Eres un experto en análisis de comportamiento en internet, gestion del tiempo, contenido inapropiado. Proporciona un análisis breve y preciso basado en la imagen mostrada. Vas a ser enfático en revisión de redes sociales, verás contenido, imágenes, miniaturas, lo mismo en aplicaciones como YouTube. Es necesario que siempre que haya una imagen de personas, te concentres en analizarla. En el caso de que veas información acerca de alguna cuenta bancaria o monedero virtual, no vas a hacer nada, simplemente vas a omitir esa información. En caso de que veas mensajes, solamente te vas a concentrar en el mismo si detectas conversaciones sospechosas o insanas.
-        """)
-        prompt = """
+        """
+PROMPT_SCREENSHOT = """
         Vas a usar 250 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
         Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo. Lo debes "proteger" de contenido inapropiado en la web, imágenes sugestivas, sensuales. Concéntrate específicamente en la vida que lleva en la web, YouTube, redes sociales, etc. Siempre que veas una imagen de una persona, analízala y describe lo que ves(haz enfasis en miniaturas de redes sociales o youtube si es que los ves). En el caso de que encuentres que la imagen corresponde a algún monedero virtual, contraseñas, claves o información bancaria, vas a omitir esa información, vas a hacer de cuenta que la imagen nunca existió. Finalmente, quiero que generes un JSON con este esquema:
         "nombre": "nombre_imagen", "analisis_imagen": "descripcion_imagen", "analisis_contexto": "descripcion_contexto", "analisis_comportamiento": "descripcion_comportamiento".
         """
-        response = model.generate_content(
-            contents=[prompt, img],
-            generation_config=genai.GenerationConfig(max_output_tokens=300)
+
+SYSTEM_INSTRUCTION_CONJUNTO = """
+        Eres un experto en análisis de comportamiento en internet, gestion del tiempo, contenido inapropiado. Proporciona un análisis breve y preciso basado en el CONJUNTO de imágenes mostradas. Vas a ser enfático en revisión de redes sociales, contenido, imágenes, miniaturas en todas las pantallas. Es necesario que siempre que haya una imagen de personas, te concentres en analizarla en el contexto global de todas las pantallas. En el caso de que veas información acerca de alguna cuenta bancaria o monedero virtual, no vas a hacer nada, simplemente vas a omitir esa información. En caso de que veas mensajes, solamente te vas a concentrar en los mismos si detectas conversaciones sospechosas o insanas, considerando el contexto de todas las pantallas.
+        """
+PROMPT_CONJUNTO = """
+        No quiero que me respondas aun, limitate a leer todo el prompt y a ajustar tu respuesta a mi solicitud.
+        Vas a usar 300 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
+        Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo, analizando el CONJUNTO de pantallas mostradas. Lo debes "proteger" de contenido inapropiado en la web, imágenes sugestivas, sensuales, en todas las pantallas. Concéntrate específicamente en la vida que lleva en la web, YouTube, redes sociales, etc., en el contexto de TODAS las pantallas. Siempre que veas una imagen de una persona en CUALQUIER pantalla, analízala y describe lo que ves, considerando el contexto de las otras pantallas (haz énfasis en miniaturas de redes sociales o youtube si es que los ves). En el caso de que encuentres que la imagen corresponde a algún monedero virtual, contraseñas, claves o información bancaria en CUALQUIER pantalla, vas a omitir esa información. Finalmente, quiero que generes un resumen con este esquema:
+
+        ```json
+        {
+            "analisis_conjunto": "descripcion_global_conjunto_imagenes",
+            "comportamiento_global": "descripcion_comportamiento_global",
+            "uso_tiempo_global": "descripcion_uso_tiempo_global"
+        }
+        ```
+
+        Por favor, asegúrate de que tu respuesta sea FORMATEADA COMO JSON, pero NO valides el formato JSON estrictamente. Solo necesito que la respuesta se vea como un JSON para poder mostrarla en el email.
+        """
+
+INSTRUCCION_MOSAICO = """
+        Las imágenes son hojas de contacto: cada una reúne varias capturas reducidas (mosaicos) en una grilla. Cada mosaico lleva debajo una franja negra con su número, la hora de la captura y el tiempo que permaneció en pantalla. Los mosaicos están en orden cronológico, de izquierda a derecha y de arriba abajo, continuando de una hoja a la siguiente. Si un mosaico contiene varias pantallas una al lado de la otra, son los distintos monitores del usuario en el mismo instante. Analiza el contenido de los mosaicos, no la grilla.
+        """
+
+PROMPT_AGREGACION = """
+        Vas a usar 300 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
+        A continuación tienes el análisis individual de cada pantalla que el usuario vio durante el intervalo, en orden cronológico y con el tiempo que cada una permaneció en pantalla. Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo, combinando esos análisis en un resumen global del CONJUNTO. Las pantallas que permanecieron más tiempo pesan más en el resumen. Omite cualquier información bancaria, contraseñas o claves. Genera un resumen con este esquema:
+
+        ```json
+        {
+            "analisis_conjunto": "descripcion_global_conjunto_imagenes",
+            "comportamiento_global": "descripcion_comportamiento_global",
+            "uso_tiempo_global": "descripcion_uso_tiempo_global"
+        }
+        ```
+
+        Análisis individuales:
+        """
+
+PROMPT_BLOQUE = """
+        Vas a usar 200 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
+        Las imágenes son un tramo de un intervalo más largo de actividad del usuario; tu resumen se combinará después con el de los otros tramos. Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo. Describe qué hizo el usuario en este tramo, con énfasis en redes sociales, YouTube, imágenes de personas y contenido inapropiado. Omite cualquier información bancaria, contraseñas o claves. Responde SOLO con un JSON compacto con este esquema:
+
+        {"analisis_conjunto": "...", "comportamiento_global": "...", "uso_tiempo_global": "..."}
+        """
+
+PROMPT_REDUCCION = """
+        Vas a usar 300 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
+        A continuación tienes los resúmenes de tramos consecutivos de la actividad del usuario, en orden cronológico, cada uno con su período y el tiempo que abarca. Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo, combinando esos resúmenes en un único resumen del período completo. Los tramos más largos pesan más. Si un tramo no pudo analizarse, menciónalo como período sin datos. Omite cualquier información bancaria, contraseñas o claves. Genera un resumen con este esquema:
+
+        ```json
+        {
+            "analisis_conjunto": "descripcion_global_conjunto_imagenes",
+            "comportamiento_global": "descripcion_comportamiento_global",
+            "uso_tiempo_global": "descripcion_uso_tiempo_global"
+        }
+        ```
+
+        Resúmenes de los tramos:
+        """
+
+_cache = None # Caché de resultados, creada en el primer uso
+
+def obtener_cache():
+    """Retorna la caché persistente de resultados de la IA, o None si está desactivada."""
+    global _cache
+    if _cache is None and AI_CACHE_ENABLED:
+        _cache = cache_module.CacheResultados(database_module.obtener_escritor(), AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL_SECONDS)
+    return _cache
+
+class BackendGemini:
+    """
+    Backend real del motor de análisis: llama a la API de Gemini.
+    Construye cada par modelo/instrucción de sistema una sola vez y lo reutiliza entre llamadas.
+    """
+
+    def __init__(self):
+        self._modelos = {}
+        self._lock = threading.Lock()
+
+    def _modelo(self, nombre, system_instruction):
+        with self._lock:
+            modelo = self._modelos.get((nombre, system_instruction))
+            if modelo is None:
+                modelo = inicializar_gemini().GenerativeModel(nombre, system_instruction=system_instruction)
+                self._modelos[(nombre, system_instruction)] = modelo
+            return modelo
+
+    def generar(self, modelo, system_instruction, contenidos, max_output_tokens, timeout=None):
+        response = self._modelo(modelo, system_instruction).generate_content(
+            contents=contenidos,
+            generation_config=inicializar_gemini().GenerationConfig(max_output_tokens=max_output_tokens),
+            request_options={"timeout": timeout} if timeout else None,
         )
         if hasattr(response, 'text') and response.text:
+            return response.text
+        return None
+
+    def generar_stream(self, modelo, system_instruction, contenidos, max_output_tokens, timeout=None):
+        response = self._modelo(modelo, system_instruction).generate_content(
+            contents=contenidos,
+            generation_config=inicializar_gemini().GenerationConfig(max_output_tokens=max_output_tokens),
+            request_options={"timeout": timeout} if timeout else None,
+            stream=True,
+        )
+        for fragmento in response:
             try:
-                json_response = json.loads(response.text)  # Intentamos parsear la respuesta como JSON
+                texto = fragmento.text
+            except ValueError: # Fragmento sin partes de texto (ej: solo metadatos o bloqueado por seguridad)
+                continue
+            if texto:
+                yield texto
+
+_motor = None # Motor de análisis compartido, creado en el primer uso
+
+def configurar_backend(backend):
+    """
+    Reemplaza el backend del motor de análisis (por ejemplo, por motor_analisis_module.BackendFalso
+    en pruebas y benchmarks). Retorna el motor resultante.
+    """
+    global _motor
+    if _motor is not None:
+        _motor.cerrar()
+    limitador = None
+    if AI_REQUESTS_PER_MINUTE > 0: # 0 = sin límite de tasa
+        limitador = motor_analisis_module.LimitadorTasa(AI_REQUESTS_PER_MINUTE, AI_BURST)
+    _motor = motor_analisis_module.MotorAnalisis(
+        backend,
+        limitador=limitador,
+        hilos=AI_CONCURRENCY,
+        reintentos=AI_MAX_RETRIES,
+        espera_base=AI_BACKOFF_BASE_SECONDS,
+        espera_maxima=AI_BACKOFF_MAX_SECONDS,
+        timeout=AI_REQUEST_TIMEOUT_SECONDS,
+    )
+    return _motor
+
+def obtener_motor():
+    """Retorna el motor de análisis compartido (con el backend de Gemini por defecto)."""
+    if _motor is None:
+        configurar_backend(BackendGemini())
+    return _motor
+
+def cargar_imagen(fuente):
+    """
+    Retorna una PIL.Image a partir de una ruta, de un frame en memoria (screenshot_module.Frame)
+    o de una imagen ya cargada. Los frames preprocesados (preprocess_module) se retornan como
+    blob codificado, listo para enviar al modelo.
+    """
+    if isinstance(fuente, str):
+        return almacenamiento_module.abrir_imagen(fuente) # Suelta en disco o dentro del paquete de su día
+    if isinstance(fuente, dict) and "datos" in fuente:
+        return preprocess_module.parte_para_modelo(fuente)
+    if hasattr(fuente, "a_imagen"):
+        return fuente.a_imagen()
+    return fuente
+
+def describir_fuente(fuente):
+    """Nombre legible de una imagen para los mensajes de log (sin volcar sus bytes)."""
+    if isinstance(fuente, str):
+        return fuente
+    if isinstance(fuente, dict):
+        return fuente.get("ruta") or f"imagen preprocesada {fuente.get('ancho')}x{fuente.get('alto')}"
+    return getattr(fuente, "ruta", None) or repr(fuente)
+
+def tamano_solicitud(prompt, fuentes):
+    """Bytes aproximados de una solicitud: el prompt más cada imagen (codificada, archivo o buffer crudo)."""
+    total = len(prompt.encode("utf-8"))
+    for fuente in fuentes:
+        if isinstance(fuente, dict) and "datos" in fuente:
+            total += len(fuente["datos"])
+        elif isinstance(fuente, str):
+            total += almacenamiento_module.tamano_captura(fuente)
+        elif hasattr(fuente, "tamano_bytes"):
+            total += fuente.tamano_bytes
+    return total
+
+def generar_respuesta(system_instruction, prompt, fuentes, parser=None):
+    """
+    Envía el prompt y las imágenes al modelo a través del motor de análisis, usando la caché si está activa.
+    Args:
+        system_instruction (str): Instrucción de sistema del modelo.
+        prompt (str): Texto que precede a las imágenes.
+        fuentes (list): Imágenes (rutas, frames o frames preprocesados), en orden.
+        parser (ParserJSONIncremental): Opcional. Recibe la respuesta a medida que llega (con AI_STREAMING)
+                                        o completa, y publica cada campo apenas termina.
+    Returns:
+        str: Texto de la respuesta, o None si el modelo no devolvió texto.
+    """
+    cache = obtener_cache()
+    clave = None
+    if cache:
+        # La clave usa los hashes de todas las imágenes en orden: el mismo conjunto de pantallas reutiliza el resultado
+        clave = cache_module.generar_clave(MODELO_GEMINI, system_instruction, prompt,
+                                           [cache_module.hash_contenido(f) for f in fuentes], MAX_OUTPUT_TOKENS)
+        resultado_cache = cache.obtener(clave)
+        if resultado_cache is not None:
+            metricas_module.incrementar("cache_ia_aciertos_total")
+            if parser:
+                parser.alimentar(resultado_cache)
+            return resultado_cache # Acierto: no se llama a la API
+        metricas_module.incrementar("cache_ia_fallos_total")
+
+    contenidos = [prompt] + [cargar_imagen(fuente) for fuente in fuentes]
+    metricas_module.incrementar("bytes_enviados_total", tamano_solicitud(prompt, fuentes), destino="ia")
+    try:
+        with metricas_module.medir("solicitud_ia_segundos"):
+            if parser and AI_STREAMING:
+                parser.inicio_stream = time.perf_counter()
+                texto_respuesta = obtener_motor().generar_stream(MODELO_GEMINI, system_instruction, contenidos,
+                                                                 MAX_OUTPUT_TOKENS, parser.alimentar)
+            else:
+                texto_respuesta = obtener_motor().generar(MODELO_GEMINI, system_instruction, contenidos, MAX_OUTPUT_TOKENS)
+                if parser and texto_respuesta:
+                    parser.alimentar(texto_respuesta)
+    except Exception:
+        metricas_module.incrementar("errores_total", etapa="ia")
+        raise
+    if texto_respuesta and cache:
+        cache.guardar(clave, texto_respuesta)
+    return texto_respuesta
+
+def analizar_screenshot(ruta_imagen, al_campo=None):
+    """
+    Analiza una captura de pantalla utilizando el modelo multimodal Gemini Pro Vision.
+    Args:
+        ruta_imagen (str | Frame | PIL.Image.Image): La ruta completa al archivo de la imagen, o la imagen en memoria.
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del JSON apenas se completa.
+    Returns:
+        str: Un resumen textual del análisis generado por Gemini,
+             o None si ocurre un error.
+    """
+    try:
+        parser = ParserJSONIncremental(al_campo)
+        texto_respuesta = generar_respuesta(SYSTEM_INSTRUCTION_SCREENSHOT, PROMPT_SCREENSHOT, [ruta_imagen], parser)
+        if texto_respuesta:
+            json_response = parser.resultado() # Parseado mientras llegaba la respuesta (tolera ```json)
+            if json_response is not None:
                 # Formateamos el resumen para que sea un texto legible
                 summary_text = f"Análisis de imagen '{json_response.get('nombre', 'N/A')}' con Gemini Pro Vision:\n"
                 summary_text += f"- Análisis de la imagen: {json_response.get('analisis_imagen', 'N/A')}\n"
                 summary_text += f"- Análisis del contexto: {json_response.get('analisis_contexto', 'N/A')}\n"
                 summary_text += f"- Análisis del comportamiento: {json_response.get('analisis_comportamiento', 'N/A')}\n"
                 return summary_text
-            except json.JSONDecodeError:
-                print(f"Advertencia: La respuesta de Gemini no fue un JSON válido para la imagen: {ruta_imagen}. Devolviendo respuesta textual sin formatear.")
-                return response.text # Devolvemos el texto sin formatear si no es un JSON válido
+            else:
+                logger.warning(f"La respuesta de Gemini no fue un JSON válido para la imagen: {describir_fuente(ruta_imagen)}. Devolviendo respuesta textual sin formatear.")
+                return texto_respuesta # Devolvemos el texto sin formatear si no es un JSON válido
         else:
-            print(f"Error: No se recibió texto de respuesta para la imagen: {ruta_imagen}")
+            logger.error(f"No se recibió texto de respuesta para la imagen: {describir_fuente(ruta_imagen)}")
             return None
     except Exception as e:
-        print(f"Error al analizar la imagen {ruta_imagen} con Gemini Pro Vision: {e}")
+        logger.error(f"Error al analizar la imagen {describir_fuente(ruta_imagen)} con Gemini Pro Vision: {e}")
         return "Error en el análisis de IA." # Retornar un mensaje de error en caso de fallo
 
-def analizar_conjunto_screenshots(lista_rutas_imagenes):
+def describir_duraciones(duraciones, etiqueta="Imagen"):
+    """
+    Genera el texto que informa al modelo cuánto tiempo estuvo cada imagen en pantalla.
+    Args:
+        duraciones (list): Segundos en pantalla de cada imagen (None si se desconoce).
+        etiqueta (str): Cómo se nombra cada imagen en el texto ('Imagen', 'Mosaico').
+    Returns:
+        str: Texto para agregar al prompt, o cadena vacía si no hay duraciones.
+    """
+    if not duraciones or all(d is None for d in duraciones):
+        return ""
+    lineas = [f"Tiempo que cada {etiqueta.lower()} permaneció en pantalla (en el mismo orden en que se envían):"]
+    for indice, duracion in enumerate(duraciones, start=1):
+        if duracion is not None:
+            lineas.append(f"- {etiqueta} {indice}: {duracion:.0f} segundos")
+    lineas.append("Usa estos tiempos para estimar el uso del tiempo: una pantalla que permaneció más tiempo pesa más en el resumen.")
+    return "\n".join(lineas)
+
+def analizar_conjunto_screenshots(lista_rutas_imagenes, duraciones=None, al_campo=None):
     """
     Analiza un conjunto de capturas de pantalla con Gemini Pro Vision para generar un resumen global.
     (Versión modificada para retornar texto plano, sin parsear JSON)
     Args:
-        lista_rutas_imagenes (list): Lista de rutas completas a los archivos de imagen de las capturas.
+        lista_rutas_imagenes (list): Lista de rutas completas a los archivos de imagen de las capturas,
+                                     o de frames en memoria (screenshot_module.Frame).
+        duraciones (list): Opcional. Segundos que cada imagen permaneció en pantalla (tras deduplicar).
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del resumen apenas se completa.
     Returns:
         str: Un resumen textual global del análisis generado por Gemini para el conjunto de imágenes,
              o None si ocurre un error.
     """
     try:
-        imagenes = [Image.open(ruta_imagen) for ruta_imagen in lista_rutas_imagenes] # Carga TODAS las imágenes
+        prompt = PROMPT_CONJUNTO
+        texto_duraciones = describir_duraciones(duraciones)
+        if texto_duraciones:
+            prompt += "\n" + texto_duraciones + "\n"
 
-        model = genai.GenerativeModel('gemini-2.0-flash-exp', system_instruction="""
-        Eres un experto en análisis de comportamiento en internet, gestion del tiempo, contenido inapropiado. Proporciona un análisis breve y preciso basado en el CONJUNTO de imágenes mostradas. Vas a ser enfático en revisión de redes sociales, contenido, imágenes, miniaturas en todas las pantallas. Es necesario que siempre que haya una imagen de personas, te concentres en analizarla en el contexto global de todas las pantallas. En el caso de que veas información acerca de alguna cuenta bancaria o monedero virtual, no vas a hacer nada, simplemente vas a omitir esa información. En caso de que veas mensajes, solamente te vas a concentrar en los mismos si detectas conversaciones sospechosas o insanas, considerando el contexto de todas las pantallas.
-        """)
-        prompt = """
-        No quiero que me respondas aun, limitate a leer todo el prompt y a ajustar tu respuesta a mi solicitud.
-        Vas a usar 300 tokens para comlir tu tarea, tendras que ser claro, pero resumido.
-        Tu tarea principal es ayudar al usuario a usar bien su tiempo y que sea productivo, analizando el CONJUNTO de pantallas mostradas. Lo debes "proteger" de contenido inapropiado en la web, imágenes sugestivas, sensuales, en todas las pantallas. Concéntrate específicamente en la vida que lleva en la web, YouTube, redes sociales, etc., en el contexto de TODAS las pantallas. Siempre que veas una imagen de una persona en CUALQUIER pantalla, analízala y describe lo que ves, considerando el contexto de las otras pantallas (haz énfasis en miniaturas de redes sociales o youtube si es que los ves). En el caso de que encuentres que la imagen corresponde a algún monedero virtual, contraseñas, claves o información bancaria en CUALQUIER pantalla, vas a omitir esa información. Finalmente, quiero que generes un resumen con este esquema:
+        summary_text = generar_respuesta(SYSTEM_INSTRUCTION_CONJUNTO, prompt, lista_rutas_imagenes,
+                                         ParserJSONIncremental(al_campo) if al_campo else None) # Importante: PROMPT PRIMERO, seguido de las IMAGENES
+        if summary_text:
+            # ---  MODIFICADO: Retornar el texto directamente, SIN parsear JSON ---
+            return summary_text
+        else:
+            logger.error(f"No se recibió texto de respuesta para el análisis del conjunto de imágenes.")
+            return None
+    except Exception as e:
+        logger.error(f"Error DETALLADO al analizar el conjunto de imágenes con Gemini Pro Vision: {e}")
+        return "Error en el análisis de IA del conjunto de imágenes."
 
-        ```json
-        {
-            "analisis_conjunto": "descripcion_global_conjunto_imagenes",
-            "comportamiento_global": "descripcion_comportamiento_global",
-            "uso_tiempo_global": "descripcion_uso_tiempo_global"
-        }
-        ```
+def analizar_hojas_contacto(lista_rutas_imagenes, duraciones=None, timestamps=None, al_campo=None):
+    """
+    Analiza un conjunto de capturas enviándolas como pocas hojas de contacto (montaje_module) en lugar
+    de una imagen por captura: reduce el tamaño de la solicitud y el costo fijo por imagen del modelo.
+    Args:
+        lista_rutas_imagenes (list): Rutas, frames en memoria o listas de ellos (varios monitores en el mismo instante).
+        duraciones (list): Opcional. Segundos que cada captura permaneció en pantalla.
+        timestamps (list): Opcional. datetime de cada captura, para las etiquetas de los mosaicos.
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del resumen apenas se completa.
+    Returns:
+        str: Resumen global con el esquema de analizar_conjunto_screenshots, o un mensaje de error.
+    """
+    try:
+        etiquetas = [f"({d:.0f}s)" if d is not None else "" for d in duraciones] if duraciones else None
+        with metricas_module.medir("codificacion_segundos", tipo="mosaico"):
+            hojas = [
+                montaje_module.codificar_hoja(hoja, PREPROCESS_FORMAT, MONTAGE_QUALITY)
+                for hoja in montaje_module.crear_hojas_contacto(
+                    lista_rutas_imagenes, timestamps, etiquetas, MONTAGE_MAX_WIDTH, MONTAGE_MAX_HEIGHT,
+                    MONTAGE_MAX_SHEETS, MONTAGE_MAX_TILES_PER_SHEET)
+            ]
+        logger.info(f"Modo mosaico: {len(lista_rutas_imagenes)} capturas en {len(hojas)} hojas, {sum(h['bytes_finales'] for h in hojas)} bytes.")
 
-        Por favor, asegúrate de que tu respuesta sea FORMATEADA COMO JSON, pero NO valides el formato JSON estrictamente. Solo necesito que la respuesta se vea como un JSON para poder mostrarla en el email.
-        """
-        response = model.generate_content(
-            contents=[prompt] + imagenes, # Importante: Pasa el PROMPT PRIMERO, seguido de la LISTA DE IMAGENES
-            generation_config=genai.GenerationConfig(max_output_tokens=300)
-        )
-        if hasattr(response, 'text') and response.text:
-            # ---  MODIFICADO: Retornar response.text directamente, SIN parsear JSON ---
-            summary_text = response.text
+        prompt = PROMPT_CONJUNTO + "\n" + INSTRUCCION_MOSAICO
+        texto_duraciones = describir_duraciones(duraciones, "Mosaico")
+        if texto_duraciones:
+            prompt += "\n" + texto_duraciones + "\n"
+
+        summary_text = generar_respuesta(SYSTEM_INSTRUCTION_CONJUNTO, prompt, hojas,
+                                         ParserJSONIncremental(al_campo) if al_campo else None)
+        if summary_text:
             return summary_text
+        logger.error("No se recibió texto de respuesta para el análisis de las hojas de contacto.")
+        return None
+    except Exception as e:
+        logger.error(f"Error DETALLADO al analizar las hojas de contacto con Gemini Pro Vision: {e}")
+        return "Error en el análisis de IA del conjunto de imágenes."
+
+class ParserJSONIncremental:
+    """
+    Parser incremental del objeto JSON de una respuesta del modelo: recibe el texto a medida que llega
+    y publica cada campo de primer nivel apenas su valor se completa, sin esperar el resto de la respuesta.
+    Como extraer_json, tolera bloques de código markdown y texto antes del objeto.
+    """
+
+    def __init__(self, al_campo=None):
+        """
+        Args:
+            al_campo (callable): Opcional. Se llama con (clave, valor) por cada campo completo, en orden de llegada,
+                                 y con (None, None) si la respuesta empieza de nuevo y los campos publicados se descartan.
+        """
+        self.al_campo = al_campo
+        self.campos = {}
+        self.texto = ""
+        self.terminado = False # True al cerrarse el objeto de primer nivel
+        self.inicio_stream = None # perf_counter del inicio del streaming (para medir el primer campo); None si no se mide
+        self._reiniciar_estado()
+
+    def _reiniciar_estado(self):
+        self._pos = 0 # Próximo carácter a examinar
+        self._profundidad = 0 # 0 = todavía fuera del objeto
+        self._en_cadena = False
+        self._escape = False
+        self._inicio_cadena = None
+        self._clave = None
+        self._inicio_valor = None # Posición donde empieza el valor del campo actual (después de ':')
+
+    def alimentar(self, fragmento):
+        """
+        Procesa un fragmento de la respuesta. None indica que la respuesta empieza de nuevo (reintento):
+        se descartan el texto y los campos recibidos, se avisa a al_campo con (None, None) y los campos
+        se vuelven a publicar a medida que lleguen.
+        Returns:
+            list: (clave, valor) de los campos completados con este fragmento.
+        """
+        if fragmento is None:
+            self.texto = ""
+            self.terminado = False
+            self.campos = {}
+            self._reiniciar_estado()
+            self._publicar(None, None)
+            return []
+        self.texto += fragmento
+        texto, nuevos = self.texto, []
+        while self._pos < len(texto) and not self.terminado:
+            caracter = texto[self._pos]
+            if self._profundidad == 0:
+                if caracter == "{": # Lo anterior (```json, texto suelto) se ignora
+                    self._profundidad = 1
+            elif self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif caracter == "\\":
+                    self._escape = True
+                elif caracter == '"':
+                    self._en_cadena = False
+                    if self._profundidad == 1 and self._inicio_valor is None:
+                        self._clave = self._decodificar(self._inicio_cadena, self._pos + 1)
+                    elif self._profundidad == 1:
+                        nuevos.append(self._cerrar_campo(self._pos + 1))
+            elif caracter == '"':
+                self._en_cadena = True
+                self._inicio_cadena = self._pos
+            elif caracter in "{[":
+                self._profundidad += 1
+            elif caracter in "}]":
+                self._profundidad -= 1
+                if self._profundidad == 1 and self._inicio_valor is not None: # Objeto o lista anidada completa
+                    nuevos.append(self._cerrar_campo(self._pos + 1))
+                elif self._profundidad == 0:
+                    if self._inicio_valor is not None: # Número o literal en el último campo
+                        nuevos.append(self._cerrar_campo(self._pos))
+                    self.terminado = True
+            elif self._profundidad == 1:
+                if caracter == ":" and self._clave is not None and self._inicio_valor is None:
+                    self._inicio_valor = self._pos + 1
+                elif caracter == "," and self._inicio_valor is not None:
+                    nuevos.append(self._cerrar_campo(self._pos))
+            self._pos += 1
+        return [campo for campo in nuevos if campo]
+
+    def _decodificar(self, inicio, fin):
+        crudo = self.texto[inicio:fin].strip()
+        try:
+            return json.loads(crudo)
+        except json.JSONDecodeError:
+            return crudo.strip('"') # Valor mal formado: se conserva el texto
+
+    def _cerrar_campo(self, fin):
+        clave, valor = self._clave, self._decodificar(self._inicio_valor, fin)
+        self._clave = self._inicio_valor = None
+        if not isinstance(clave, str) or valor == "":
+            return None
+        if self.inicio_stream is not None: # Solo el primer campo de la respuesta (un reintento no vuelve a medir)
+            metricas_module.observar("primer_campo_ia_segundos", time.perf_counter() - self.inicio_stream)
+            self.inicio_stream = None
+        self.campos[clave] = valor
+        self._publicar(clave, valor)
+        return clave, valor
+
+    def _publicar(self, clave, valor):
+        if self.al_campo:
+            try:
+                self.al_campo(clave, valor)
+            except Exception as e:
+                logger.warning(f"Error al publicar el campo '{clave}' de la respuesta: {e}")
+
+    def resultado(self):
+        """Campos recibidos (dict), o None si la respuesta no trajo ninguno (ej: no era un JSON)."""
+        return dict(self.campos) or None
+
+def es_resumen_error(resumen):
+    """True si el análisis no produjo un resumen (None o uno de los mensajes de error de este módulo)."""
+    return not resumen or resumen.startswith("Error en el análisis de IA")
+
+def _periodo(intermedio):
+    desde, hasta = intermedio.get("desde"), intermedio.get("hasta")
+    if desde and hasta:
+        return f"{desde} a {hasta}"
+    return "período desconocido"
+
+def resumir_bloque(indice, elementos, preparar=None, reintentos=AI_CHUNK_RETRIES):
+    """
+    Resume un bloque de frames en un resumen intermedio compacto (dict).
+    Si el bloque falla, se reintenta solo ese bloque; tras agotar los reintentos se registra
+    el error en el intermedio y el resto del intervalo sigue su curso.
+    Args:
+        indice (int): Número de bloque (para logs).
+        elementos (list): Dicts con 'fuente' y, opcionalmente, 'inicio' y 'duracion_segundos'.
+        preparar (callable): Opcional. Transforma la lista de fuentes antes de enviarla (ej: preprocesado).
+        reintentos (int): Reintentos del bloque completo, además de los reintentos del motor por llamada.
+    Returns:
+        dict: 'desde', 'hasta', 'capturas', 'segundos' y 'resumen' (o 'error').
+    """
+    momentos = [e["inicio"] for e in elementos if e.get("inicio")]
+    duraciones = [e.get("duracion_segundos") for e in elementos]
+    intermedio = {
+        "desde": min(momentos).strftime("%Y-%m-%d %H:%M:%S") if momentos else None,
+        "hasta": max(momentos).strftime("%Y-%m-%d %H:%M:%S") if momentos else None,
+        "capturas": len(elementos),
+        "segundos": round(sum(d for d in duraciones if d is not None)),
+    }
+    prompt = PROMPT_BLOQUE
+    texto_duraciones = describir_duraciones(duraciones)
+    if texto_duraciones:
+        prompt += "\n" + texto_duraciones + "\n"
+
+    error = None
+    for intento in range(reintentos + 1):
+        try:
+            fuentes = [e["fuente"] for e in elementos]
+            if preparar:
+                fuentes = preparar(fuentes)
+            texto = generar_respuesta(SYSTEM_INSTRUCTION_CONJUNTO, prompt, fuentes)
+            del fuentes # Liberar los píxeles del bloque antes de esperar al siguiente
+            if texto:
+                intermedio["resumen"] = extraer_json(texto) or {"analisis_conjunto": texto.strip()}
+                return intermedio
+            error = "respuesta vacía"
+        except Exception as e:
+            error = str(e)
+        logger.warning(f"El bloque {indice} falló (intento {intento + 1}/{reintentos + 1}): {error}")
+    intermedio["error"] = error
+    return intermedio
+
+def reducir_intermedios(intermedios, al_campo=None):
+    """
+    Combina resúmenes intermedios consecutivos en uno solo con una llamada de solo texto.
+    Args:
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del resumen apenas se completa.
+    Returns:
+        dict: Intermedio que abarca el período completo de los recibidos.
+    """
+    lineas = []
+    for intermedio in intermedios:
+        encabezado = f"Tramo {_periodo(intermedio)} ({intermedio['capturas']} capturas, {intermedio['segundos']} segundos)"
+        if "error" in intermedio:
+            lineas.append(f"{encabezado}: sin datos (no pudo analizarse).")
         else:
-            print(f"Error: No se recibió texto de respuesta para el análisis del conjunto de imágenes.")
+            lineas.append(f"{encabezado}: {json.dumps(intermedio['resumen'], ensure_ascii=False)}")
+    combinado = {
+        "desde": next((i["desde"] for i in intermedios if i.get("desde")), None),
+        "hasta": next((i["hasta"] for i in reversed(intermedios) if i.get("hasta")), None),
+        "capturas": sum(i["capturas"] for i in intermedios),
+        "segundos": sum(i["segundos"] for i in intermedios),
+    }
+    parser = ParserJSONIncremental(al_campo)
+    texto = generar_respuesta(SYSTEM_INSTRUCTION_CONJUNTO, PROMPT_REDUCCION + "\n".join(lineas), [], parser)
+    if not texto:
+        raise RuntimeError("No se recibió texto de respuesta para la reducción de resúmenes intermedios.")
+    combinado["resumen"] = parser.resultado() or {"analisis_conjunto": texto.strip()}
+    return combinado
+
+def analizar_por_bloques(elementos, tamano_bloque=AI_CHUNK_SIZE, preparar=None, max_intermedios=AI_REDUCE_FANIN,
+                         al_campo=None):
+    """
+    Resumen jerárquico (map-reduce) de un intervalo largo con memoria acotada.
+    Consume los frames de un iterador en bloques de `tamano_bloque`: cada bloque se resume en un
+    intermedio JSON compacto y sus píxeles se liberan antes de leer el siguiente. Cada vez que se
+    juntan `max_intermedios` intermedios de un mismo nivel, se reducen a uno del nivel superior,
+    de modo que también la cantidad de intermedios en memoria es logarítmica en la duración.
+    Args:
+        elementos (iterable): Dicts con 'fuente' (ruta, Frame o frame preprocesado) y, opcionalmente,
+                              'inicio' (datetime) y 'duracion_segundos'; o directamente las fuentes.
+        tamano_bloque (int): Frames por bloque.
+        preparar (callable): Opcional. Transforma las fuentes de cada bloque antes de enviarlas.
+        max_intermedios (int): Intermedios que se combinan en cada paso de reducción (mínimo 2).
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del resumen final apenas se completa.
+    Returns:
+        str: Resumen global en JSON con el esquema de analizar_conjunto_screenshots, o un mensaje de error.
+    """
+    max_intermedios = max(2, max_intermedios)
+    iterador = ({"fuente": e} if not isinstance(e, dict) or "datos" in e else e for e in elementos)
+    niveles = [] # niveles[k]: intermedios pendientes de reducir en el nivel k, en orden cronológico
+    try:
+        for indice in itertools.count(1):
+            bloque = list(itertools.islice(iterador, tamano_bloque))
+            if not bloque:
+                break
+            intermedio = resumir_bloque(indice, bloque, preparar)
+            del bloque
+            nivel = 0
+            while True:
+                if nivel == len(niveles):
+                    niveles.append([])
+                niveles[nivel].append(intermedio)
+                if len(niveles[nivel]) < max_intermedios:
+                    break
+                intermedio = reducir_intermedios(niveles[nivel])
+                niveles[nivel] = []
+                nivel += 1
+
+        pendientes = [i for nivel in reversed(niveles) for i in nivel] # Los niveles altos cubren los tramos más antiguos
+        if not pendientes:
+            logger.error("No se recibieron frames para el análisis por bloques.")
             return None
+        if all("error" in i for i in pendientes):
+            logger.error("Ningún bloque del intervalo pudo analizarse.")
+            return "Error en el análisis de IA del conjunto de imágenes."
+        if len(pendientes) == 1 and "error" not in pendientes[0]:
+            final = pendientes[0]
+            if al_campo: # Un único bloque: su resumen es el final y ya está completo
+                for clave, valor in final["resumen"].items():
+                    al_campo(clave, valor)
+        else:
+            final = reducir_intermedios(pendientes, al_campo)
+        logger.info(f"Análisis por bloques: {final['capturas']} capturas entre {_periodo(final)}.")
+        return json.dumps(final["resumen"], ensure_ascii=False, indent=4)
     except Exception as e:
-        print(f"Error DETALLADO al analizar el conjunto de imágenes con Gemini Pro Vision: {e}") # Imprimir excepción completa
+        logger.error(f"Error DETALLADO al analizar el intervalo por bloques con Gemini Pro Vision: {e}")
         return "Error en el análisis de IA del conjunto de imágenes."
-    
+
+def analizar_por_frame_y_agregar(lista_rutas_imagenes, duraciones=None, al_campo=None):
+    """
+    Analiza cada captura por separado y en paralelo (analizar_screenshot) y luego combina los
+    análisis individuales en un resumen global con una llamada final de solo texto.
+    La latencia del ciclo queda acotada por el frame más lento, no por la suma de todos.
+    Args:
+        lista_rutas_imagenes (list): Rutas, frames en memoria o frames preprocesados.
+        duraciones (list): Opcional. Segundos que cada imagen permaneció en pantalla.
+        al_campo (callable): Opcional. Recibe (clave, valor) de cada campo del resumen global apenas se completa.
+    Returns:
+        str: Resumen global con el esquema de analizar_conjunto_screenshots, o un mensaje de error.
+    """
+    try:
+        analisis_individuales = obtener_motor().mapear(analizar_screenshot, lista_rutas_imagenes)
+        duraciones = duraciones or [None] * len(analisis_individuales)
+        lineas = []
+        for indice, (analisis, duracion) in enumerate(zip(analisis_individuales, duraciones), start=1):
+            if es_resumen_error(analisis):
+                continue
+            tiempo = f" (en pantalla {duracion:.0f} segundos)" if duracion is not None else ""
+            lineas.append(f"Pantalla {indice}{tiempo}:\n{analisis}")
+        if not lineas:
+            logger.error("Ningún frame del conjunto pudo analizarse individualmente.")
+            return "Error en el análisis de IA del conjunto de imágenes."
+
+        prompt = PROMPT_AGREGACION + "\n\n".join(lineas)
+        summary_text = generar_respuesta(SYSTEM_INSTRUCTION_CONJUNTO, prompt, [],
+                                         ParserJSONIncremental(al_campo) if al_campo else None)
+        if summary_text:
+            return summary_text
+        logger.error("No se recibió texto de respuesta para la agregación de los análisis individuales.")
+        return None
+    except Exception as e:
+        logger.error(f"Error DETALLADO al agregar los análisis individuales con Gemini Pro Vision: {e}")
+        return "Error en el análisis de IA del conjunto de imágenes."
+
 if __name__ == '__main__':
     analizar_screenshot()
     analizar_conjunto_screenshots()
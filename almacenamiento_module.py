@@ -0,0 +1,350 @@
+# almacenamiento_module.py
+import io
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database_module
+import metricas_module
+import screenshot_module
+from config import SCREENSHOTS_DIR, STORAGE_CHECK_INTERVAL_SECONDS, STORAGE_PACK_AFTER_HOURS, STORAGE_PACK_FORMAT
+from config import STORAGE_PACK_QUALITY, STORAGE_RETENTION_DAYS, STORAGE_MAX_GB, STORAGE_MIN_FREE_GB
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+DIRECTORIO_PAQUETES = os.path.join(SCREENSHOTS_DIR, "archivo") # Un .tar por día: capturas_YYYYMMDD.tar
+EXTENSIONES_FORMATO = {"WEBP": ".webp", "JPEG": ".jpg", "PNG": ".png"}
+GB = 1024 ** 3
+
+
+# --- Lectura de capturas (sueltas o empaquetadas) ---
+def _ubicacion(ruta):
+    return database_module.ubicacion_archivada(ruta)
+
+def leer_captura(ruta):
+    """
+    Retorna los bytes de una captura, esté suelta en disco o dentro del paquete de su día.
+    `ruta` es la ruta original (la de screenshots.filepath).
+    Raises:
+        FileNotFoundError: Si la captura no existe o se eliminó por retención o cuota.
+    """
+    if os.path.exists(ruta):
+        with open(ruta, "rb") as archivo:
+            return archivo.read()
+    for _ in range(2): # Un reintento: el paquete pudo compactarse entre la consulta y la lectura
+        ubicacion = _ubicacion(ruta)
+        if ubicacion is None:
+            break
+        if ubicacion["paquete"] is None:
+            raise FileNotFoundError(f"La captura {ruta} se eliminó por la política de retención o cuota.")
+        try:
+            with open(ubicacion["paquete"], "rb") as paquete:
+                paquete.seek(ubicacion["desplazamiento"])
+                return paquete.read(ubicacion["longitud"])
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"No existe la captura {ruta}.")
+
+def abrir_imagen(ruta):
+    """Abre una captura como PIL.Image (perezosa si está suelta en disco)."""
+    from PIL import Image
+    if os.path.exists(ruta):
+        return Image.open(ruta)
+    return Image.open(io.BytesIO(leer_captura(ruta)))
+
+def tamano_captura(ruta):
+    """Bytes que ocupa una captura en disco (o dentro de su paquete)."""
+    if os.path.exists(ruta):
+        return os.path.getsize(ruta)
+    ubicacion = _ubicacion(ruta)
+    if not ubicacion or ubicacion["paquete"] is None:
+        raise FileNotFoundError(f"No existe la captura {ruta}.")
+    return ubicacion["longitud"]
+
+
+# --- Gestor de almacenamiento ---
+def _agregar_al_tar(paquete, nombre, datos, mtime=None):
+    """Agrega `datos` como el miembro `nombre` y retorna el byte del paquete donde empiezan los datos."""
+    info = tarfile.TarInfo(nombre)
+    info.size = len(datos)
+    if mtime is not None:
+        info.mtime = mtime
+    paquete.addfile(info, io.BytesIO(datos))
+    relleno = -len(datos) % tarfile.BLOCKSIZE # Los datos ocupan bloques completos de 512 bytes
+    return paquete.offset - relleno - len(datos)
+
+def _dia_de_paquete(nombre):
+    """'capturas_20250301.tar' o 'capturas_20250301_c1712345678.tar' -> date, o None."""
+    if not (nombre.startswith("capturas_") and nombre.endswith(".tar")):
+        return None
+    try:
+        return datetime.strptime(nombre[len("capturas_"):len("capturas_") + 8], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+class GestorAlmacenamiento:
+    """
+    Mantiene acotado el disco que ocupan las capturas, desde un hilo en segundo plano:
+    1. Empaqueta las capturas sueltas ya analizadas más antiguas que `empaquetar_horas` en un .tar
+       por día (sin recodificar, salvo que `formato` pida uno más compacto), con su ubicación en la
+       tabla 'screenshot_archivo' para que screenshots.filepath siga resolviéndose (ver `leer_captura`).
+    2. Retención: elimina los frames más antiguos que `retencion_dias`.
+    3. Cuota: si las capturas superan `cuota_bytes` o el disco baja de `libre_minimo_bytes`,
+       elimina desde los días más antiguos hasta volver al límite.
+    Solo se empaquetan y eliminan frames ya analizados (con un resumen válido); los demás quedan
+    sueltos en el directorio, donde los encuentra el reprocesamiento (main.py --reprocesar).
+    """
+
+    def __init__(self, directorio=SCREENSHOTS_DIR, directorio_paquetes=DIRECTORIO_PAQUETES,
+                 empaquetar_horas=STORAGE_PACK_AFTER_HOURS, formato=STORAGE_PACK_FORMAT, calidad=STORAGE_PACK_QUALITY,
+                 retencion_dias=STORAGE_RETENTION_DAYS, cuota_bytes=STORAGE_MAX_GB * GB,
+                 libre_minimo_bytes=STORAGE_MIN_FREE_GB * GB, intervalo_segundos=STORAGE_CHECK_INTERVAL_SECONDS):
+        self.directorio = directorio
+        self.directorio_paquetes = directorio_paquetes
+        self.empaquetar_horas = empaquetar_horas
+        self.formato = formato.upper()
+        if self.formato != "ORIGINAL" and self.formato not in EXTENSIONES_FORMATO:
+            raise ValueError(f"Formato de empaquetado no soportado: {formato}. Opciones: {list(EXTENSIONES_FORMATO)} u 'original'")
+        self.calidad = calidad
+        self.retencion_dias = retencion_dias
+        self.cuota_bytes = cuota_bytes
+        self.libre_minimo_bytes = libre_minimo_bytes
+        self.intervalo_segundos = intervalo_segundos
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="gestor_almacenamiento", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.ejecutar_una_vez()
+            except Exception as e:
+                metricas_module.incrementar("errores_total", etapa="almacenamiento")
+                logger.error(f"Error en el gestor de almacenamiento: {e}", exc_info=True)
+            self._detener.wait(self.intervalo_segundos)
+
+    def ejecutar_una_vez(self, ahora=None):
+        """
+        Una pasada completa: empaquetado, retención y cuota.
+        Returns:
+            dict: Frames 'empaquetados' y 'eliminados', y bytes 'liberados'.
+        """
+        ahora = ahora or datetime.now()
+        resultado = {"empaquetados": 0, "eliminados": 0, "liberados": 0}
+        if self.empaquetar_horas:
+            limite = ahora - timedelta(hours=self.empaquetar_horas)
+            resultado["empaquetados"] = self.empaquetar([c for c in self._capturas_sueltas() if c[0] < limite])
+        if self.retencion_dias:
+            limite = ahora - timedelta(days=self.retencion_dias)
+            self._liberar(resultado, lambda momento: momento < limite, "retencion")
+        exceso = self._exceso()
+        if exceso > 0:
+            logger.warning(f"Capturas por encima del límite de disco en {exceso / GB:.2f} GB: eliminando frames analizados.")
+            self._liberar(resultado, lambda momento: True, "cuota", exceso)
+        self._registrar_uso()
+        if resultado["empaquetados"] or resultado["eliminados"]:
+            logger.info(f"Almacenamiento: {resultado['empaquetados']} frames empaquetados, {resultado['eliminados']} eliminados, "
+                        f"{resultado['liberados'] / (1024 ** 2):.1f} MB liberados.")
+        return resultado
+
+    # --- Inventario ---
+    def _capturas_sueltas(self):
+        """(datetime, ruta, bytes) de las capturas sueltas en el directorio, de la más antigua a la más nueva."""
+        capturas = []
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except FileNotFoundError:
+            return capturas
+        for entrada in entradas:
+            if not entrada.is_file():
+                continue
+            datos = screenshot_module.parsear_nombre_captura(entrada.name)
+            if datos is None:
+                continue
+            capturas.append((datos["timestamp"], os.path.join(self.directorio, entrada.name), entrada.stat().st_size))
+        capturas.sort()
+        return capturas
+
+    def _paquetes(self):
+        """(date, ruta, bytes) de los paquetes, del día más antiguo al más nuevo."""
+        paquetes = []
+        try:
+            entradas = list(os.scandir(self.directorio_paquetes))
+        except FileNotFoundError:
+            return paquetes
+        for entrada in entradas:
+            dia = _dia_de_paquete(entrada.name)
+            if dia is not None:
+                paquetes.append((dia, entrada.path, entrada.stat().st_size))
+        paquetes.sort()
+        return paquetes
+
+    def _exceso(self):
+        """Bytes que hay que liberar para respetar la cuota y el espacio libre mínimo (0 si ninguno se excede)."""
+        exceso = 0
+        if self.cuota_bytes:
+            uso = sum(c[2] for c in self._capturas_sueltas()) + sum(p[2] for p in self._paquetes())
+            exceso = uso - self.cuota_bytes
+        if self.libre_minimo_bytes and os.path.isdir(self.directorio):
+            exceso = max(exceso, self.libre_minimo_bytes - shutil.disk_usage(self.directorio).free)
+        return max(0, int(exceso))
+
+    def _registrar_uso(self):
+        metricas_module.fijar("almacenamiento_bytes", sum(c[2] for c in self._capturas_sueltas()), tipo="sueltas")
+        metricas_module.fijar("almacenamiento_bytes", sum(p[2] for p in self._paquetes()), tipo="paquetes")
+
+    # --- Empaquetado ---
+    def _recodificar(self, ruta):
+        """Bytes y extensión con que se guarda una captura en el paquete."""
+        if self.formato == "ORIGINAL":
+            with open(ruta, "rb") as archivo:
+                return archivo.read(), os.path.splitext(ruta)[1]
+        from PIL import Image
+        buffer = io.BytesIO()
+        with Image.open(ruta) as imagen:
+            if self.formato == "PNG":
+                imagen.save(buffer, "PNG", optimize=True)
+            else:
+                imagen.convert("RGB").save(buffer, self.formato, quality=self.calidad)
+        return buffer.getvalue(), EXTENSIONES_FORMATO[self.formato]
+
+    def empaquetar(self, capturas):
+        """
+        Mueve capturas sueltas al paquete de su día. Las que no están analizadas se dejan sueltas:
+        replay_module solo recorre archivos sueltos. El índice se confirma antes de borrar cada archivo
+        suelto, de modo que una interrupción nunca deja una captura sin resolver.
+        Args:
+            capturas (list): (datetime, ruta, bytes) de las capturas a empaquetar.
+        Returns:
+            int: Capturas empaquetadas.
+        """
+        analizadas = database_module.rutas_analizadas([ruta for _, ruta, _ in capturas])
+        por_dia = {}
+        for momento, ruta, _ in capturas:
+            if ruta in analizadas:
+                por_dia.setdefault(momento.date(), []).append((momento, ruta))
+        if not por_dia:
+            return 0
+        os.makedirs(self.directorio_paquetes, exist_ok=True)
+
+        total = 0
+        for dia, grupo in sorted(por_dia.items()):
+            ruta_paquete = os.path.join(self.directorio_paquetes, f"capturas_{dia.strftime('%Y%m%d')}.tar")
+            filas = []
+            with metricas_module.medir("empaquetado_segundos"):
+                with tarfile.open(ruta_paquete, "a") as paquete:
+                    for momento, ruta in grupo:
+                        try:
+                            datos, extension = self._recodificar(ruta)
+                        except Exception as e:
+                            logger.warning(f"No se pudo empaquetar {ruta}: {e}")
+                            continue
+                        nombre = os.path.splitext(os.path.basename(ruta))[0] + extension
+                        desplazamiento = _agregar_al_tar(paquete, nombre, datos, momento.timestamp())
+                        filas.append((ruta, ruta_paquete, desplazamiento, len(datos)))
+                with open(ruta_paquete, "rb+") as archivo:
+                    os.fsync(archivo.fileno()) # El paquete debe estar en disco antes de borrar las capturas sueltas
+            database_module.registrar_archivadas(filas)
+            for ruta, *_ in filas:
+                try:
+                    os.remove(ruta)
+                except OSError as e:
+                    logger.warning(f"No se pudo borrar la captura empaquetada {ruta}: {e}")
+            metricas_module.incrementar("frames_empaquetados_total", len(filas))
+            total += len(filas)
+        return total
+
+    # --- Retención y cuota ---
+    def _liberar(self, resultado, elegible, motivo, objetivo=None):
+        """
+        Elimina frames analizados, del día más antiguo al más nuevo, mientras `elegible(momento)` lo permita
+        y hasta liberar `objetivo` bytes (sin tope si es None). Actualiza `resultado` en el lugar.
+        """
+        liberados_inicio = resultado["liberados"]
+
+        def alcanzado():
+            return objetivo is not None and resultado["liberados"] - liberados_inicio >= objetivo
+
+        sueltas = self._capturas_sueltas()
+        dias = sorted({dia for dia, _, _ in self._paquetes()} | {momento.date() for momento, _, _ in sueltas})
+        for dia in dias:
+            if alcanzado():
+                return
+            fin_del_dia = datetime.combine(dia, datetime.max.time())
+            for _, ruta_paquete, _ in [p for p in self._paquetes() if p[0] == dia]:
+                if elegible(fin_del_dia):
+                    self._purgar_paquete(ruta_paquete, resultado, motivo)
+            del_dia = [(m, r, t) for m, r, t in sueltas if m.date() == dia and elegible(m)]
+            analizadas = database_module.rutas_analizadas([r for _, r, _ in del_dia])
+            eliminadas = []
+            for _, ruta, tamano in del_dia:
+                if alcanzado():
+                    break
+                if ruta in analizadas:
+                    try:
+                        os.remove(ruta)
+                    except OSError as e:
+                        logger.warning(f"No se pudo eliminar {ruta}: {e}")
+                        continue
+                    eliminadas.append((ruta, None, None, None))
+                    resultado["liberados"] += tamano
+            if eliminadas:
+                database_module.registrar_archivadas(eliminadas)
+                resultado["eliminados"] += len(eliminadas)
+                metricas_module.incrementar("frames_eliminados_total", len(eliminadas), motivo=motivo)
+
+    def _purgar_paquete(self, ruta_paquete, resultado, motivo):
+        """
+        Quita de un paquete los frames analizados. Si no queda ninguno se borra el paquete; si quedan
+        frames sin analizar, se reescribe un paquete compactado solo con ellos.
+        """
+        entradas = database_module.capturas_de_paquete(ruta_paquete)
+        analizadas = database_module.rutas_analizadas([e[0] for e in entradas])
+        if entradas and not analizadas:
+            return
+        tamano_anterior = os.path.getsize(ruta_paquete)
+        conservar = [e for e in entradas if e[0] not in analizadas]
+        filas = []
+        if conservar:
+            dia = _dia_de_paquete(os.path.basename(ruta_paquete))
+            ruta_nueva = os.path.join(self.directorio_paquetes, f"capturas_{dia.strftime('%Y%m%d')}_c{int(time.time())}.tar")
+            with open(ruta_paquete, "rb") as origen, tarfile.open(ruta_nueva, "w") as destino:
+                for filepath, desplazamiento, longitud in conservar:
+                    origen.seek(desplazamiento)
+                    nuevo = _agregar_al_tar(destino, os.path.basename(filepath), origen.read(longitud))
+                    filas.append((filepath, ruta_nueva, nuevo, longitud))
+            with open(ruta_nueva, "rb+") as archivo:
+                os.fsync(archivo.fileno())
+        filas += [(e[0], None, None, None) for e in entradas if e[0] in analizadas]
+        database_module.registrar_archivadas(filas) # El índice apunta al paquete nuevo antes de borrar el anterior
+        os.remove(ruta_paquete)
+        liberados = tamano_anterior - (os.path.getsize(filas[0][1]) if conservar else 0)
+        resultado["liberados"] += liberados
+        resultado["eliminados"] += len(analizadas)
+        metricas_module.incrementar("frames_eliminados_total", len(analizadas), motivo=motivo)
+        logger.info(f"Paquete {os.path.basename(ruta_paquete)}: {len(analizadas)} frames analizados eliminados, "
+                    f"{len(conservar)} sin analizar conservados.")
+
+
+_gestor = None
+
+def iniciar_gestor():
+    """Arranca (una vez) el GestorAlmacenamiento en segundo plano con la configuración de config."""
+    global _gestor
+    if _gestor is None:
+        _gestor = GestorAlmacenamiento()
+        _gestor.iniciar()
+    return _gestor
@@ -0,0 +1,470 @@
+# benchmark_module.py
+"""
+Benchmark offline del ciclo de análisis, sin pantalla, sin API de Gemini, sin Firebase y sin servidor SMTP.
+
+Reemplaza cada dependencia externa por un sustituto determinista:
+- FuenteFramesSintetica en lugar de mss (screenshot_module.obtener_capturador).
+- motor_analisis_module.BackendFalso (latencia y tasa de error configurables) en lugar de Gemini.
+- ReferenciaFirebaseMemoria en lugar de la referencia raíz de Firebase.
+- SumideroSMTP: servidor SMTP local que acepta y descarta los correos.
+
+Ejecuta ejecutar_analisis_completo y cada etapa por separado y escribe un reporte JSON con throughput,
+latencias p50/p99 por etapa y memoria pico, comparable entre commits:
+
+    python benchmark_module.py --frames 30 --resoluciones 1920x1080 --modos conjunto,mosaico --salida bench.json
+    python benchmark_module.py --comparar bench_anterior.json bench.json
+    python benchmark_module.py --arranque --arranque-max-ms 300
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+# El benchmark usa su propia base de datos y servicios locales: valores por defecto antes de importar config
+_DIRECTORIO_TRABAJO = tempfile.mkdtemp(prefix="benchmark_analizador_")
+os.environ.setdefault("DATABASE_NAME", os.path.join(_DIRECTORIO_TRABAJO, "benchmark.db"))
+os.environ.setdefault("ANALYSIS_INTERVAL_SECONDS", "3600") # La captura termina por cantidad de frames, no por tiempo
+os.environ.setdefault("AI_REQUESTS_PER_MINUTE", "1000000")
+os.environ.setdefault("AI_BURST", "1000")
+os.environ.setdefault("AI_CACHE_ENABLED", "false") # Con caché, las repeticiones no llamarían al backend
+os.environ.setdefault("METRICS_LOG_JSON", "false")
+os.environ.setdefault("FIREBASE_FLUSH_INTERVAL_SECONDS", "0.2")
+os.environ.setdefault("EMAIL_FROM", "agente@benchmark.local")
+os.environ.setdefault("EMAIL_TO", "destino@benchmark.local")
+os.environ.setdefault("SMTP_STARTTLS", "false")
+
+import ai_analysis_module
+import database_module
+import email_module
+import main
+import metricas_module
+import motor_analisis_module
+import screenshot_module
+
+
+class FuenteFramesSintetica:
+    """
+    Sustituto de CapturadorPantalla: genera frames BGRA deterministas.
+    Cada frame cambia respecto del anterior con probabilidad `tasa_cambio` (se pinta una "ventana"
+    nueva), de modo que la deduplicación se comporta como con una pantalla real.
+    Tras `max_frames` capturas activa `detener`, lo que cierra el lote en curso.
+    """
+
+    def __init__(self, ancho=1920, alto=1080, tasa_cambio=0.5, semilla=0):
+        self.ancho = ancho
+        self.alto = alto
+        self.tasa_cambio = tasa_cambio
+        self.semilla = semilla
+        self.detener = threading.Event()
+        self.max_frames = 0
+        self.capturados = 0
+        self._aleatorio = random.Random(semilla)
+        self._pixeles = np.full((alto, ancho, 4), 235, dtype=np.uint8)
+
+    def reiniciar(self, max_frames):
+        """Prepara la fuente para un nuevo lote de `max_frames` capturas."""
+        self.max_frames = max_frames
+        self.capturados = 0
+        self.detener.clear()
+
+    def _pintar_ventana(self):
+        ancho = self._aleatorio.randint(self.ancho // 8, self.ancho // 2)
+        alto = self._aleatorio.randint(self.alto // 8, self.alto // 2)
+        x = self._aleatorio.randint(0, self.ancho - ancho)
+        y = self._aleatorio.randint(0, self.alto - alto)
+        color = [self._aleatorio.randint(0, 255) for _ in range(3)] + [255]
+        self._pixeles[y:y + alto, x:x + ancho] = color
+        self._pixeles[y:y + alto:16, x:x + ancho] = 0 # Líneas de "texto" para que el hash perceptual tenga estructura
+
+    def capturar(self, monitor=1):
+        if self.capturados == 0 or self._aleatorio.random() < self.tasa_cambio:
+            self._pintar_ventana()
+        self.capturados += 1
+        if self.capturados >= self.max_frames:
+            self.detener.set()
+        return screenshot_module.Frame(bytearray(self._pixeles.tobytes()), self.ancho, self.alto, datetime.now(), monitor)
+
+    def capturar_todos(self):
+        return [self.capturar()]
+
+    def monitores(self):
+        return [{"left": 0, "top": 0, "width": self.ancho, "height": self.alto}]
+
+    def cerrar(self):
+        pass
+
+
+class ReferenciaFirebaseMemoria:
+    """Sustituto de la referencia raíz de Firebase: guarda cada update() multi-ruta en un dict."""
+
+    def __init__(self, latencia_segundos=0.0):
+        self.latencia_segundos = latencia_segundos
+        self.datos = {}
+        self.updates = 0
+        self._lock = threading.Lock()
+
+    def update(self, valores):
+        if self.latencia_segundos:
+            time.sleep(self.latencia_segundos)
+        with self._lock:
+            self.datos.update(valores)
+            self.updates += 1
+
+
+class _ManejadorSMTP(socketserver.StreamRequestHandler):
+    def _responder(self, linea):
+        self.wfile.write(linea.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self._responder("220 benchmark SMTP")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode("utf-8", "replace").strip().upper()
+            if comando.startswith("EHLO"):
+                self.wfile.write(b"250-benchmark\r\n250 8BITMIME\r\n")
+            elif comando.startswith("DATA"):
+                self._responder("354 Fin con <CRLF>.<CRLF>")
+                tamano = 0
+                for linea_datos in iter(self.rfile.readline, b""):
+                    if linea_datos in (b".\r\n", b".\n"):
+                        break
+                    tamano += len(linea_datos)
+                self.server.registrar(tamano)
+                self._responder("250 OK")
+            elif comando.startswith("QUIT"):
+                self._responder("221 Adios")
+                return
+            else: # HELO, MAIL, RCPT, RSET, NOOP
+                self._responder("250 OK")
+
+
+class SumideroSMTP(socketserver.ThreadingTCPServer):
+    """Servidor SMTP local mínimo: acepta los correos, cuenta mensajes y bytes, y los descarta."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", puerto=0):
+        super().__init__((host, puerto), _ManejadorSMTP)
+        self.puerto = self.server_address[1]
+        self.mensajes = 0
+        self.bytes_recibidos = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, name="sumidero_smtp", daemon=True).start()
+
+    def registrar(self, tamano):
+        with self._lock:
+            self.mensajes += 1
+            self.bytes_recibidos += tamano
+
+    def cerrar(self):
+        self.shutdown()
+        self.server_close()
+
+
+def estadisticas(muestras):
+    """p50, p99, media y máximo (en segundos) de una lista de duraciones."""
+    if not muestras:
+        return None
+    ordenadas = sorted(muestras)
+    def percentil(p):
+        return ordenadas[min(len(ordenadas) - 1, int(round(p / 100.0 * (len(ordenadas) - 1))))]
+    return {
+        "n": len(ordenadas),
+        "p50": round(percentil(50), 6),
+        "p99": round(percentil(99), 6),
+        "media": round(sum(ordenadas) / len(ordenadas), 6),
+        "max": round(ordenadas[-1], 6),
+    }
+
+
+class EntornoBenchmark:
+    """Instala los sustitutos en los módulos del proyecto y los retira al cerrar."""
+
+    def __init__(self, ancho, alto, tasa_cambio, latencia_ia, tasa_error_ia, latencia_firebase, semilla=0):
+        self.fuente = FuenteFramesSintetica(ancho, alto, tasa_cambio, semilla)
+        self.backend = motor_analisis_module.BackendFalso(latencia_ia, tasa_error_ia, semilla=semilla)
+        self.firebase = ReferenciaFirebaseMemoria(latencia_firebase)
+        self.smtp = SumideroSMTP()
+        self._originales = {}
+
+    def _reemplazar(self, modulo, nombre, valor):
+        self._originales.setdefault((modulo, nombre), getattr(modulo, nombre))
+        setattr(modulo, nombre, valor)
+
+    def instalar(self):
+        directorio = os.path.join(_DIRECTORIO_TRABAJO, "screenshots")
+        os.makedirs(directorio, exist_ok=True)
+        self._reemplazar(screenshot_module, "obtener_capturador", lambda: self.fuente)
+        self._reemplazar(main, "SCREENSHOTS_DIR", directorio)
+        self._reemplazar(main, "CAPTURE_INTERVAL_SECONDS", 1e-6) # Capturas seguidas: el lote termina al llegar a max_frames
+        captura_original = main.capturar_lote
+        self._reemplazar(main, "capturar_lote", lambda fin_monotonico=None, detener=None: captura_original(fin_monotonico, self.fuente.detener))
+        ai_analysis_module.configurar_backend(self.backend)
+        database_module.crear_tablas()
+        database_module.iniciar_subidor_firebase(lambda: self.firebase)
+        email_module._remitente = email_module.RemitenteSMTP(
+            servidor="127.0.0.1", puerto=self.smtp.puerto, usuario=None, starttls=False)
+
+    def fijar_modo(self, modo):
+        self._reemplazar(main, "AI_ANALYSIS_MODE", modo)
+        self._reemplazar(main, "MODO_JERARQUICO", modo == "jerarquico")
+
+    def esperar_envios(self, timeout=30.0):
+        """Espera a que la outbox de Firebase y la cola de correo queden vacías."""
+        limite = time.monotonic() + timeout
+        subidor = database_module.iniciar_subidor_firebase()
+        subidor.despertar()
+        while time.monotonic() < limite and (email_module._remitente.pendientes() or subidor.pendientes()):
+            time.sleep(0.05)
+
+    def cerrar(self):
+        email_module._remitente.detener(timeout=5)
+        email_module._remitente = None
+        self.smtp.cerrar()
+        for (modulo, nombre), valor in self._originales.items():
+            setattr(modulo, nombre, valor)
+
+
+def _histogramas_internos():
+    """p50/p99 (aproximados por bucket) de las métricas internas registradas durante el escenario."""
+    resultado = {}
+    for histograma in metricas_module.registro.instantanea()["histogramas"]:
+        etiquetas = ",".join(f"{k}={v}" for k, v in sorted(histograma["etiquetas"].items()))
+        nombre = f"{histograma['nombre']}{{{etiquetas}}}" if etiquetas else histograma["nombre"]
+        resultado[nombre] = {"n": histograma["cantidad"], "p50": histograma["p50"], "p99": histograma["p99"]}
+    return resultado
+
+def _contador(nombre, **etiquetas):
+    for contador in metricas_module.registro.instantanea()["contadores"]:
+        if contador["nombre"] == nombre and contador["etiquetas"] == etiquetas:
+            return contador["valor"]
+    return 0
+
+
+def ejecutar_escenario(entorno, modo, frames, repeticiones):
+    """
+    Ejecuta un escenario (modo de análisis x resolución): primero cada etapa por separado y luego
+    el ciclo completo (ejecutar_analisis_completo), `repeticiones` veces cada uno.
+    Returns:
+        dict: Latencias por etapa y del ciclo, throughput, bytes enviados y memoria pico.
+    """
+    entorno.fijar_modo(modo)
+    metricas_module.registro.reiniciar()
+    llamadas_iniciales = entorno.backend.llamadas
+    tracemalloc.start()
+
+    etapas = {"captura": []}
+    for _ in range(repeticiones):
+        entorno.fuente.reiniciar(frames)
+        inicio = time.perf_counter()
+        lote = main.capturar_lote()
+        etapas["captura"].append(time.perf_counter() - inicio)
+        for nombre, etapa in main.ETAPAS_PIPELINE:
+            inicio = time.perf_counter()
+            lote = etapa(lote)
+            etapas.setdefault(nombre, []).append(time.perf_counter() - inicio)
+
+    ciclos = []
+    inicio_total = time.perf_counter()
+    for _ in range(repeticiones):
+        entorno.fuente.reiniciar(frames)
+        inicio = time.perf_counter()
+        main.ejecutar_analisis_completo()
+        ciclos.append(time.perf_counter() - inicio)
+    duracion_total = time.perf_counter() - inicio_total
+
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    entorno.esperar_envios()
+
+    return {
+        "modo": modo,
+        "resolucion": f"{entorno.fuente.ancho}x{entorno.fuente.alto}",
+        "frames_por_ciclo": frames,
+        "repeticiones": repeticiones,
+        "ciclo": estadisticas(ciclos),
+        "etapas": {nombre: estadisticas(muestras) for nombre, muestras in etapas.items()},
+        "throughput_frames_por_segundo": round(frames * repeticiones / duracion_total, 3),
+        "frames_conservados": _contador("frames_conservados_total"),
+        "frames_descartados": _contador("frames_descartados_total"),
+        "llamadas_ia": entorno.backend.llamadas - llamadas_iniciales,
+        "bytes_enviados_ia_por_ciclo": _contador("bytes_enviados_total", destino="ia") // (2 * repeticiones),
+        "memoria_pico_python_mb": round(pico / 2 ** 20, 2),
+        "internas": _histogramas_internos(),
+    }
+
+
+MODULOS_PESADOS = ("google.generativeai", "firebase_admin", "PIL", "mss", "numpy") # No deben cargarse al importar main
+
+def medir_arranque(modulo="main", repeticiones=5):
+    """
+    Mide el costo de importar `modulo` en un proceso nuevo con `python -X importtime`.
+    Returns:
+        dict: Tiempo acumulado de importación (mediana, mínimo y máximo en ms), los módulos pesados
+              que se cargaron (debería estar vacío) y los 10 módulos más costosos de la última medición.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    entorno = dict(os.environ, PYTHONPATH=directorio + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    tiempos = []
+    acumulados = {}
+    for _ in range(repeticiones):
+        proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                                 capture_output=True, text=True, cwd=_DIRECTORIO_TRABAJO, env=entorno, timeout=120)
+        if proceso.returncode != 0:
+            raise RuntimeError(f"No se pudo importar {modulo}: {proceso.stderr.strip().splitlines()[-1:]}")
+        acumulados = {}
+        for linea in proceso.stderr.splitlines():
+            if not linea.startswith("import time:") or "cumulative" in linea:
+                continue
+            _, acumulado, nombre = linea[len("import time:"):].split("|")
+            acumulados[nombre.strip()] = int(acumulado) / 1000.0
+        tiempos.append(acumulados[modulo])
+    tiempos.sort()
+    return {
+        "modulo": modulo,
+        "mediana_ms": round(tiempos[len(tiempos) // 2], 2),
+        "min_ms": round(tiempos[0], 2),
+        "max_ms": round(tiempos[-1], 2),
+        "pesados_importados": sorted(n for n in acumulados if n in MODULOS_PESADOS),
+        "mas_lentos": sorted(((n, round(t, 2)) for n, t in acumulados.items() if n != modulo), key=lambda x: -x[1])[:10],
+    }
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def ejecutar_benchmark(frames=30, resoluciones=((1920, 1080),), modos=("conjunto",), repeticiones=5, tasa_cambio=0.5,
+                       latencia_ia=0.2, tasa_error_ia=0.0, latencia_firebase=0.05, semilla=0):
+    """
+    Ejecuta todos los escenarios y retorna el reporte (dict serializable a JSON).
+    """
+    resultados = []
+    for ancho, alto in resoluciones:
+        entorno = EntornoBenchmark(ancho, alto, tasa_cambio, latencia_ia, tasa_error_ia, latencia_firebase, semilla)
+        entorno.instalar()
+        try:
+            for modo in modos:
+                resultados.append(ejecutar_escenario(entorno, modo, frames, repeticiones))
+                print(f"{modo} {ancho}x{alto}: ciclo p50 {resultados[-1]['ciclo']['p50']:.3f}s, "
+                      f"p99 {resultados[-1]['ciclo']['p99']:.3f}s")
+        finally:
+            entorno.cerrar()
+    return {
+        "commit": _commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {
+            "frames": frames, "repeticiones": repeticiones, "tasa_cambio": tasa_cambio, "latencia_ia": latencia_ia,
+            "tasa_error_ia": tasa_error_ia, "latencia_firebase": latencia_firebase, "semilla": semilla,
+        },
+        "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        "arranque": medir_arranque(),
+        "resultados": resultados,
+    }
+
+
+def comparar(anterior, actual):
+    """
+    Compara dos reportes escenario por escenario.
+    Returns:
+        list: Líneas de texto con el cambio relativo del p50/p99 del ciclo y de cada etapa.
+    """
+    previos = {(r["modo"], r["resolucion"]): r for r in anterior["resultados"]}
+    lineas = [f"{anterior.get('commit')} -> {actual.get('commit')}"]
+    if anterior.get("arranque") and actual.get("arranque"):
+        lineas.append(f"[arranque] import main: {anterior['arranque']['mediana_ms']} -> {actual['arranque']['mediana_ms']} ms")
+    for resultado in actual["resultados"]:
+        previo = previos.get((resultado["modo"], resultado["resolucion"]))
+        if previo is None:
+            continue
+        lineas.append(f"[{resultado['modo']} {resultado['resolucion']}]")
+        series = [("ciclo", previo["ciclo"], resultado["ciclo"])]
+        series += [(n, previo["etapas"].get(n), e) for n, e in resultado["etapas"].items()]
+        for nombre, antes, despues in series:
+            if not antes or not despues:
+                continue
+            cambios = []
+            for clave in ("p50", "p99"):
+                delta = (despues[clave] - antes[clave]) / antes[clave] * 100 if antes[clave] else 0.0
+                cambios.append(f"{clave} {antes[clave]:.4f}s -> {despues[clave]:.4f}s ({delta:+.1f}%)")
+            lineas.append(f"  {nombre}: " + ", ".join(cambios))
+        lineas.append(f"  memoria pico: {previo['memoria_pico_python_mb']} -> {resultado['memoria_pico_python_mb']} MB")
+    return lineas
+
+
+def _parsear_resoluciones(texto):
+    return [tuple(int(v) for v in r.lower().split("x")) for r in texto.split(",") if r]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark offline del ciclo de análisis.")
+    parser.add_argument("--frames", type=int, default=30, help="Capturas por ciclo")
+    parser.add_argument("--resoluciones", default="1920x1080", help="Lista separada por comas, ej: 1280x720,1920x1080")
+    parser.add_argument("--modos", default="conjunto", help="Modos de AI_ANALYSIS_MODE separados por comas")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--tasa-cambio", type=float, default=0.5, help="Probabilidad de que cambie la pantalla entre capturas")
+    parser.add_argument("--latencia-ia", type=float, default=0.2, help="Latencia simulada del modelo, en segundos")
+    parser.add_argument("--tasa-error-ia", type=float, default=0.0, help="Fracción de llamadas con error transitorio (429)")
+    parser.add_argument("--latencia-firebase", type=float, default=0.05)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", default="benchmark.json", help="Archivo JSON del reporte")
+    parser.add_argument("--arranque", action="store_true", help="Medir solo el tiempo de importación de main y salir")
+    parser.add_argument("--arranque-max-ms", type=float, help="Falla (código 1) si la mediana supera este valor")
+    parser.add_argument("--detallado", action="store_true", help="Mostrar los logs INFO del ciclo")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTERIOR", "ACTUAL"), help="Comparar dos reportes y salir")
+    argumentos = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if argumentos.detallado else logging.WARNING)
+
+    if argumentos.arranque:
+        arranque = medir_arranque()
+        print(json.dumps(arranque, ensure_ascii=False, indent=2))
+        if arranque["pesados_importados"]:
+            print(f"Regresión: importar main carga {arranque['pesados_importados']}")
+            sys.exit(1)
+        if argumentos.arranque_max_ms and arranque["mediana_ms"] > argumentos.arranque_max_ms:
+            print(f"Regresión: importar main tarda {arranque['mediana_ms']} ms (máximo {argumentos.arranque_max_ms} ms)")
+            sys.exit(1)
+        sys.exit(0)
+
+    if argumentos.comparar:
+        with open(argumentos.comparar[0], encoding="utf-8") as a, open(argumentos.comparar[1], encoding="utf-8") as b:
+            print("\n".join(comparar(json.load(a), json.load(b))))
+        sys.exit(0)
+
+    reporte = ejecutar_benchmark(
+        frames=argumentos.frames,
+        resoluciones=_parsear_resoluciones(argumentos.resoluciones),
+        modos=[m.strip() for m in argumentos.modos.split(",") if m.strip()],
+        repeticiones=argumentos.repeticiones,
+        tasa_cambio=argumentos.tasa_cambio,
+        latencia_ia=argumentos.latencia_ia,
+        tasa_error_ia=argumentos.tasa_error_ia,
+        latencia_firebase=argumentos.latencia_firebase,
+        semilla=argumentos.semilla,
+    )
+    with open(argumentos.salida, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+    print(f"Reporte escrito en {argumentos.salida}")
@@ -0,0 +1,146 @@
+# cache_module.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import almacenamiento_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+
+def hash_contenido(fuente):
+    """
+    Calcula el hash SHA-256 del contenido de una imagen.
+    Args:
+        fuente: Ruta a un archivo, screenshot_module.Frame, frame preprocesado (dict con 'datos')
+                o PIL.Image.Image.
+    Returns:
+        str: Hash hexadecimal.
+    """
+    sha = hashlib.sha256()
+    if isinstance(fuente, str) and not os.path.exists(fuente):
+        sha.update(almacenamiento_module.leer_captura(fuente)) # Captura dentro del paquete de su día
+    elif isinstance(fuente, str):
+        with open(fuente, "rb") as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b""):
+                sha.update(bloque)
+    elif isinstance(fuente, dict) and "datos" in fuente:
+        sha.update(fuente["datos"])
+    elif hasattr(fuente, "datos"):
+        sha.update(f"{fuente.ancho}x{fuente.alto}".encode())
+        sha.update(fuente.datos) # memoryview: sin copiar el buffer
+    else:
+        sha.update(f"{fuente.mode}{fuente.size}".encode())
+        sha.update(fuente.tobytes())
+    return sha.hexdigest()
+
+
+def generar_clave(modelo, system_instruction, prompt, hashes_imagenes, parametros=""):
+    """
+    Genera la clave de caché de una solicitud al modelo.
+    Combina el modelo, la instrucción de sistema, el prompt y los hashes de las imágenes en orden,
+    de modo que cambiar cualquiera de ellos (por ejemplo, una nueva versión del prompt) invalida la entrada.
+    """
+    sha = hashlib.sha256()
+    for parte in (modelo, system_instruction, prompt, str(parametros), *hashes_imagenes):
+        sha.update(parte.encode("utf-8"))
+        sha.update(b"\x00")
+    return sha.hexdigest()
+
+
+class CacheResultados:
+    """
+    Caché persistente de resultados de la IA en una tabla SQLite ('ai_cache').
+    Expulsa entradas por antigüedad (TTL) y, al superar el máximo, por último acceso (LRU).
+    Las escrituras van por el EscritorSQLite de la base (sin esperar el commit, agrupadas con las
+    demás); aquí solo se abren conexiones de lectura.
+    """
+
+    ACTUALIZAR_ACCESO_SEGUNDOS = 60 # Un acierto solo reescribe ultimo_acceso si el anterior es más viejo
+
+    def __init__(self, escritor, max_entradas=5000, ttl_segundos=7 * 24 * 3600):
+        """
+        Args:
+            escritor (database_module.EscritorSQLite): Escritor de la base donde vive la tabla.
+        """
+        self.escritor = escritor
+        self.ruta_db = escritor.ruta_db
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._lectura = threading.local()
+
+        def crear(conexion):
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS ai_cache (
+                    clave TEXT PRIMARY KEY,
+                    resultado TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_acceso REAL NOT NULL
+                )
+            """)
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_ultimo_acceso ON ai_cache (ultimo_acceso)")
+        escritor.ejecutar(crear)
+
+    def _conexion_lectura(self):
+        conexion = getattr(self._lectura, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta_db)
+            self._lectura.conexion = conexion
+        return conexion
+
+    def obtener(self, clave):
+        """Retorna el resultado guardado para la clave, o None si no existe o expiró."""
+        ahora = time.time()
+        fila = self._conexion_lectura().execute(
+            "SELECT resultado, creado, ultimo_acceso FROM ai_cache WHERE clave = ?", (clave,)).fetchone()
+        if fila and ahora - fila[1] <= self.ttl_segundos:
+            if ahora - fila[2] >= self.ACTUALIZAR_ACCESO_SEGUNDOS:
+                self.escritor.enviar(lambda c: c.execute("UPDATE ai_cache SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave)))
+            with self._lock:
+                self.aciertos += 1
+            return fila[0]
+        if fila: # Expirada
+            self.escritor.enviar(lambda c: c.execute("DELETE FROM ai_cache WHERE clave = ?", (clave,)))
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def guardar(self, clave, resultado):
+        """Guarda un resultado y aplica las políticas de expulsión (sin esperar el commit)."""
+        ahora = time.time()
+
+        def operacion(conexion):
+            conexion.execute(
+                "INSERT OR REPLACE INTO ai_cache (clave, resultado, creado, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (clave, resultado, ahora, ahora),
+            )
+            conexion.execute("DELETE FROM ai_cache WHERE creado < ?", (ahora - self.ttl_segundos,))
+            conexion.execute("""
+                DELETE FROM ai_cache WHERE clave IN (
+                    SELECT clave FROM ai_cache ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entradas,))
+        return self.escritor.enviar(operacion)
+
+    def estadisticas(self):
+        """Retorna aciertos, fallos, tasa de aciertos y cantidad de entradas."""
+        entradas = self._conexion_lectura().execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "entradas": entradas,
+        }
+
+    def cerrar(self):
+        """Cierra la conexión de lectura del hilo actual (el escritor es compartido y no se cierra)."""
+        conexion = self._lectura.__dict__.pop("conexion", None)
+        if conexion is not None:
+            conexion.close()
@@ -0,0 +1,535 @@
+# colector_module.py
+import gzip
+import heapq
+import hmac
+import io
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+import database_module
+import metricas_module
+from config import DISPOSITIVO, SQLITE_GROUP_COMMIT_MS, SQLITE_SYNCHRONOUS
+from config import (COLLECTOR_URL, COLLECTOR_TOKEN, COLLECTOR_UPLOAD_INTERVAL_SECONDS, COLLECTOR_MAX_BATCHES,
+                    COLLECTOR_HOST, COLLECTOR_PORT, COLLECTOR_DATA_DIR, COLLECTOR_MAX_BODY_MB)
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+VERSION_PROTOCOLO = 1
+RUTA_LOTES = "/v1/lotes" # POST: envío gzip de un agente
+RUTA_RESUMENES = "/v1/resumenes" # GET: consulta combinada de todos los dispositivos
+RUTA_DISPOSITIVOS = "/v1/dispositivos" # GET: dispositivos conocidos, con su cantidad de lotes y el último recibido
+
+
+# --- Colector: una base SQLite por dispositivo ---
+ESQUEMA_PARTICION = [
+    "CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)",
+    """
+    CREATE TABLE IF NOT EXISTS lotes (
+        lote_id INTEGER PRIMARY KEY,  -- ID del lote en el colector
+        inicio INTEGER NOT NULL,  -- Epoch en segundos: clave de deduplicación (un ciclo por inicio en cada dispositivo)
+        fin INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,  -- Momento del resumen
+        num_screenshots INTEGER NOT NULL DEFAULT 0,
+        resumen TEXT,
+        analisis_conjunto TEXT,
+        comportamiento_global TEXT,
+        uso_tiempo_global TEXT,
+        recibido INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS screenshots (
+        lote_id INTEGER NOT NULL REFERENCES lotes(lote_id),
+        timestamp INTEGER NOT NULL,
+        filepath TEXT NOT NULL,  -- Ruta en el equipo del agente
+        PRIMARY KEY (lote_id, filepath)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS lotes_fts USING fts5 (
+        analisis_conjunto, comportamiento_global, uso_tiempo_global, texto,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_lotes_ts ON lotes (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_lotes_inicio ON lotes (inicio)",
+]
+
+COLUMNAS_LOTE = "lote_id, inicio, fin, timestamp, num_screenshots, resumen, analisis_conjunto, comportamiento_global, uso_tiempo_global"
+
+
+def nombre_particion(dispositivo):
+    """Nombre de archivo seguro para la base de un dispositivo."""
+    return re.sub(r"[^\w.-]", "_", dispositivo)[:100] + ".db"
+
+
+def validar_lote(lote):
+    """
+    Comprueba la estructura de un lote recibido antes de llevarlo al escritor de la partición.
+    Raises:
+        ValueError: Si el lote no tiene el formato que arma `lotes_pendientes`.
+    """
+    if not isinstance(lote, dict) or not all(isinstance(lote.get(c), int) for c in ("inicio", "fin")):
+        raise ValueError("Cada lote debe tener 'inicio' y 'fin' enteros.")
+    for clave, tipos in (("id", int), ("timestamp", int), ("num_screenshots", int), ("resumen", str),
+                         ("campos", dict), ("screenshots", list)):
+        if lote.get(clave) is not None and not isinstance(lote[clave], tipos):
+            raise ValueError(f"'{clave}' del lote {lote['inicio']} tiene un tipo inválido.")
+    if not all(isinstance(clave, str) for clave in (lote.get("campos") or {})):
+        raise ValueError(f"'campos' del lote {lote['inicio']} debe tener claves de texto.")
+    for captura in lote.get("screenshots") or []:
+        if not isinstance(captura, dict) or not isinstance(captura.get("timestamp"), int) \
+                or not isinstance(captura.get("filepath"), str):
+            raise ValueError(f"Cada screenshot del lote {lote['inicio']} debe tener 'timestamp' (entero) y 'filepath' (texto).")
+
+
+class Particion:
+    """Base SQLite de un dispositivo en el colector, con su propio EscritorSQLite (commits agrupados)."""
+
+    def __init__(self, ruta, dispositivo):
+        self.ruta = ruta
+        self.dispositivo = dispositivo
+        self.escritor = database_module.EscritorSQLite(ruta, SQLITE_GROUP_COMMIT_MS, synchronous=SQLITE_SYNCHRONOUS)
+        self._lectura = threading.local()
+
+        def crear(conexion):
+            for sentencia in ESQUEMA_PARTICION:
+                conexion.execute(sentencia)
+            conexion.execute("INSERT OR IGNORE INTO meta (clave, valor) VALUES ('dispositivo', ?)", (dispositivo,))
+        self.escritor.ejecutar(crear)
+
+    def _conexion_lectura(self):
+        conexion = getattr(self._lectura, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta)
+            conexion.row_factory = sqlite3.Row
+            self._lectura.conexion = conexion
+        return conexion
+
+    def insertar(self, lotes):
+        """
+        Inserta los lotes nuevos de un envío en una transacción (executemany). Los lotes se deduplican
+        por su inicio, no por el ID del agente: los reenvíos se ignoran aunque el agente haya recreado
+        su base (y reiniciado sus IDs), y un ciclo nuevo nunca se confunde con uno anterior.
+        Returns:
+            int: Lotes nuevos.
+        """
+        recibido = database_module.a_epoch(datetime.now())
+
+        def operacion(conexion):
+            inicios = [lote["inicio"] for lote in lotes]
+            existentes = set()
+            for inicio in range(0, len(inicios), 500): # Límite de parámetros por consulta
+                bloque = inicios[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(bloque))
+                existentes.update(f[0] for f in conexion.execute(f"SELECT inicio FROM lotes WHERE inicio IN ({marcadores})", bloque))
+            nuevos = {}
+            for lote in lotes:
+                if lote["inicio"] not in existentes:
+                    nuevos.setdefault(lote["inicio"], lote) # Un ciclo repetido en el envío cuenta una vez
+            siguiente = conexion.execute("SELECT COALESCE(MAX(lote_id), 0) FROM lotes").fetchone()[0] # Único escritor: los IDs no chocan
+            filas, filas_fts, capturas = [], [], []
+            for lote_id, lote in enumerate(nuevos.values(), start=siguiente + 1):
+                campos = database_module.campos_resumen(lote.get("resumen"), lote.get("campos")) # Ya separados por el agente
+                filas.append((lote_id, lote["inicio"], lote["fin"], lote.get("timestamp") or lote["fin"],
+                              lote.get("num_screenshots") or 0, lote.get("resumen")) + campos[:3] + (recibido,))
+                if lote.get("resumen"):
+                    filas_fts.append((lote_id,) + campos)
+                capturas.extend((lote_id, s["timestamp"], s["filepath"]) for s in lote.get("screenshots") or [])
+            conexion.executemany(f"INSERT INTO lotes ({COLUMNAS_LOTE}, recibido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+            conexion.executemany("""
+                INSERT INTO lotes_fts (rowid, analisis_conjunto, comportamiento_global, uso_tiempo_global, texto)
+                VALUES (?, ?, ?, ?, ?)
+            """, filas_fts)
+            conexion.executemany("INSERT OR IGNORE INTO screenshots (lote_id, timestamp, filepath) VALUES (?, ?, ?)", capturas)
+            return len(filas)
+
+        return self.escritor.ejecutar(operacion)
+
+    def consultar(self, desde=None, hasta=None, consulta=None, limite=100):
+        """Lotes del dispositivo en [desde, hasta), del más reciente al más antiguo, o los más relevantes para `consulta` (FTS5)."""
+        condiciones, parametros = [], []
+        if desde is not None:
+            condiciones.append("l.timestamp >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("l.timestamp < ?")
+            parametros.append(hasta)
+        columnas = ", ".join(f"l.{c}" for c in COLUMNAS_LOTE.split(", "))
+        if consulta:
+            condiciones.insert(0, "lotes_fts MATCH ?")
+            parametros.insert(0, consulta)
+            sql = f"""
+                SELECT {columnas}, f.rank AS puntaje FROM lotes_fts f JOIN lotes l ON l.lote_id = f.rowid
+                WHERE {' AND '.join(condiciones)} ORDER BY f.rank LIMIT ?
+            """
+        else:
+            where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+            sql = f"SELECT {columnas} FROM lotes l {where} ORDER BY l.timestamp DESC, l.lote_id DESC LIMIT ?"
+        filas = self._conexion_lectura().execute(sql, parametros + [limite]).fetchall()
+        return [dict(fila, dispositivo=self.dispositivo) for fila in filas]
+
+    def estadisticas(self):
+        cantidad, ultimo = self._conexion_lectura().execute("SELECT COUNT(*), MAX(timestamp) FROM lotes").fetchone()
+        return {"dispositivo": self.dispositivo, "lotes": cantidad, "ultimo": ultimo}
+
+    def cerrar(self):
+        self.escritor.cerrar()
+
+
+class AlmacenColector:
+    """
+    Almacén del colector, particionado por dispositivo: cada dispositivo escribe en su propia base
+    (sin contención entre agentes) y las consultas combinan los resultados de todas las particiones.
+    """
+
+    def __init__(self, directorio=COLLECTOR_DATA_DIR):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self._particiones = {}
+        self._lock = threading.Lock()
+        for nombre in sorted(os.listdir(directorio)): # Particiones de ejecuciones anteriores
+            if nombre.endswith(".db"):
+                conexion = sqlite3.connect(os.path.join(directorio, nombre))
+                try:
+                    fila = conexion.execute("SELECT valor FROM meta WHERE clave = 'dispositivo'").fetchone()
+                except sqlite3.Error:
+                    fila = None
+                finally:
+                    conexion.close()
+                if fila:
+                    self.particion(fila[0])
+
+    def particion(self, dispositivo):
+        """Retorna (creándola si hace falta) la partición de un dispositivo."""
+        with self._lock:
+            particion = self._particiones.get(dispositivo)
+            if particion is None:
+                particion = Particion(os.path.join(self.directorio, nombre_particion(dispositivo)), dispositivo)
+                self._particiones[dispositivo] = particion
+            return particion
+
+    def ingerir(self, envio):
+        """
+        Guarda un envío de un agente.
+        Args:
+            envio (dict): {'version', 'dispositivo', 'lotes': [...]} tal como lo arma `armar_envio`.
+        Returns:
+            dict: Lotes 'recibidos', 'nuevos' y 'duplicados'.
+        Raises:
+            ValueError: Si el envío no tiene el formato esperado.
+        """
+        if not isinstance(envio, dict):
+            raise ValueError("El envío debe ser un objeto JSON.")
+        dispositivo = envio.get("dispositivo")
+        lotes = envio.get("lotes")
+        if not isinstance(dispositivo, str) or not dispositivo or not isinstance(lotes, list):
+            raise ValueError("El envío debe tener 'dispositivo' (texto) y 'lotes' (lista).")
+        for lote in lotes:
+            validar_lote(lote)
+        with metricas_module.medir("ingesta_colector_segundos"):
+            nuevos = self.particion(dispositivo).insertar(lotes) if lotes else 0
+        metricas_module.incrementar("lotes_recibidos_total", nuevos, resultado="nuevo")
+        metricas_module.incrementar("lotes_recibidos_total", len(lotes) - nuevos, resultado="duplicado")
+        return {"recibidos": len(lotes), "nuevos": nuevos, "duplicados": len(lotes) - nuevos}
+
+    def consultar(self, dispositivos=None, desde=None, hasta=None, consulta=None, limite=100, sintaxis_fts=False):
+        """
+        Consulta combinada de varios dispositivos (todos por defecto).
+        Args:
+            dispositivos (list): Nombres de dispositivos; None para todos.
+            desde, hasta (int): Rango [desde, hasta) en epoch.
+            consulta (str): Opcional. Palabras a buscar en el texto completo (deben aparecer todas); ordena por relevancia.
+            limite (int): Máximo de resultados en total.
+            sintaxis_fts (bool): Si es True, `consulta` se pasa tal cual a FTS5 (OR, NEAR, prefijos con *, etc.).
+        Returns:
+            list: Lotes con su 'dispositivo', del más reciente al más antiguo (o por relevancia).
+        """
+        if consulta and not sintaxis_fts:
+            consulta = database_module._consulta_fts(consulta) # Igual que buscar_resumenes: 'youtube.com' no es sintaxis
+        with self._lock:
+            particiones = [p for d, p in self._particiones.items() if dispositivos is None or d in dispositivos]
+        resultados = [p.consultar(desde, hasta, consulta, limite) for p in particiones]
+        if consulta:
+            combinados = heapq.merge(*resultados, key=lambda f: f["puntaje"]) # rank de FTS5: menor es más relevante
+        else:
+            combinados = heapq.merge(*resultados, key=lambda f: (f["timestamp"], f["lote_id"]), reverse=True)
+        return list(combinados)[:limite]
+
+    def dispositivos(self):
+        with self._lock:
+            particiones = list(self._particiones.values())
+        return [p.estadisticas() for p in particiones]
+
+    def cerrar(self):
+        with self._lock:
+            for particion in self._particiones.values():
+                particion.cerrar()
+            self._particiones.clear()
+
+
+class ServidorColector:
+    """
+    Servidor HTTP del colector.
+    POST /v1/lotes (cuerpo JSON comprimido con gzip) guarda un envío; GET /v1/resumenes
+    (?dispositivo=&desde=&hasta=&q=&fts=&limite=; con fts=1, `q` usa la sintaxis de FTS5) y GET /v1/dispositivos consultan todos los dispositivos.
+    """
+
+    def __init__(self, almacen, host=COLLECTOR_HOST, puerto=COLLECTOR_PORT, token=COLLECTOR_TOKEN,
+                 max_bytes=int(COLLECTOR_MAX_BODY_MB * 1024 * 1024)):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Manejador(BaseHTTPRequestHandler):
+            def _responder(self, codigo, cuerpo):
+                datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def _autorizado(self):
+                if not token:
+                    return True
+                return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}")
+
+            def do_POST(self):
+                if urlparse(self.path).path != RUTA_LOTES:
+                    return self._responder(404, {"error": "Ruta desconocida"})
+                if not self._autorizado():
+                    return self._responder(401, {"error": "Token inválido"})
+                longitud = int(self.headers.get("Content-Length") or 0)
+                if longitud > max_bytes:
+                    return self._responder(413, {"error": "Envío demasiado grande"})
+                cuerpo = self.rfile.read(longitud)
+                try:
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        with gzip.GzipFile(fileobj=io.BytesIO(cuerpo)) as descomprimido:
+                            cuerpo = descomprimido.read(max_bytes + 1) # Tope: un envío no puede inflarse sin límite
+                        if len(cuerpo) > max_bytes:
+                            return self._responder(413, {"error": "Envío demasiado grande"})
+                    resultado = almacen.ingerir(json.loads(cuerpo))
+                except (ValueError, OSError, EOFError) as e:
+                    return self._responder(400, {"error": f"Envío inválido: {e}"})
+                except sqlite3.Error as e:
+                    logger.error(f"Error al guardar un envío en el colector: {e}")
+                    return self._responder(503, {"error": "Error de almacenamiento, reintentar"})
+                except Exception as e: # Un error inesperado responde en lugar de cortar la conexión
+                    logger.exception(f"Error inesperado al guardar un envío en el colector: {e}")
+                    return self._responder(500, {"error": "Error interno del colector"})
+                self._responder(200, resultado)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parametros = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == "/salud":
+                    return self._responder(200, {"estado": "ok"})
+                if not self._autorizado():
+                    return self._responder(401, {"error": "Token inválido"})
+                if url.path == RUTA_DISPOSITIVOS:
+                    return self._responder(200, {"dispositivos": almacen.dispositivos()})
+                if url.path != RUTA_RESUMENES:
+                    return self._responder(404, {"error": "Ruta desconocida"})
+                try:
+                    filas = almacen.consultar(
+                        dispositivos=parametros["dispositivo"].split(",") if parametros.get("dispositivo") else None,
+                        desde=int(parametros["desde"]) if "desde" in parametros else None,
+                        hasta=int(parametros["hasta"]) if "hasta" in parametros else None,
+                        consulta=parametros.get("q"),
+                        limite=min(int(parametros.get("limite", 100)), 1000),
+                        sintaxis_fts=parametros.get("fts") in ("1", "true"),
+                    )
+                except (ValueError, sqlite3.OperationalError) as e: # Parámetros o sintaxis FTS5 inválidos
+                    return self._responder(400, {"error": str(e)})
+                self._responder(200, {"resumenes": filas})
+
+            def log_message(self, formato, *args):
+                logger.debug(formato % args)
+
+        self._servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        self.puerto = self._servidor.server_address[1]
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="servidor_colector", daemon=True)
+        self._hilo.start()
+        logger.info(f"Colector escuchando en http://{host}:{self.puerto}{RUTA_LOTES}")
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+# --- Agente: subida de lotes al colector ---
+def lotes_pendientes(conexion, ultimo_batch_id, limite, dispositivo=DISPOSITIVO):
+    """
+    Lee de la base del agente los lotes posteriores a `ultimo_batch_id`, con su resumen y sus screenshots.
+    Returns:
+        list: dicts con 'id', 'inicio', 'fin', 'timestamp', 'num_screenshots', 'resumen', 'campos' y 'screenshots'.
+    """
+    filas = conexion.execute(f"""
+        SELECT b.id, b.inicio, b.fin, b.num_screenshots, a.timestamp, a.summary,
+               {", ".join("a." + campo for campo in database_module.CAMPOS_RESUMEN)}
+        FROM analysis_batches b LEFT JOIN analysis_summaries a ON a.batch_id = b.id
+        WHERE b.id > ? AND (b.dispositivo = ? OR b.dispositivo IS NULL)
+        ORDER BY b.id
+        LIMIT ?
+    """, (ultimo_batch_id, dispositivo, limite)).fetchall()
+    lotes = {}
+    for batch_id, inicio, fin, num_screenshots, timestamp, resumen, *valores in filas:
+        campos = {campo: valor for campo, valor in zip(database_module.CAMPOS_RESUMEN, valores) if valor is not None}
+        lotes.setdefault(batch_id, {"id": batch_id, "inicio": inicio, "fin": fin, "timestamp": timestamp,
+                                    "num_screenshots": num_screenshots, "resumen": resumen, "campos": campos or None,
+                                    "screenshots": []})
+    if lotes:
+        marcadores = ",".join("?" * len(lotes))
+        for batch_id, timestamp, filepath in conexion.execute(f"""
+            SELECT bs.batch_id, s.timestamp, s.filepath
+            FROM batch_screenshots bs JOIN screenshots s ON s.id = bs.screenshot_id
+            WHERE bs.batch_id IN ({marcadores})
+            ORDER BY s.timestamp
+        """, list(lotes)):
+            lotes[batch_id]["screenshots"].append({"timestamp": timestamp, "filepath": filepath})
+    return list(lotes.values())
+
+def armar_envio(lotes, dispositivo=DISPOSITIVO):
+    """Serializa y comprime (gzip) un envío para el colector."""
+    envio = {"version": VERSION_PROTOCOLO, "dispositivo": dispositivo, "lotes": lotes}
+    return gzip.compress(json.dumps(envio, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+
+
+class SubidorColector:
+    """
+    Sube al colector, desde un hilo en segundo plano, los lotes guardados localmente.
+    Recuerda el último lote confirmado en la tabla 'colector_progreso': tras un corte o un reinicio
+    retoma desde ahí, y si un envío se repite el colector lo deduplica por el inicio de cada lote.
+    """
+
+    def __init__(self, url=COLLECTOR_URL, escritor=None, intervalo_segundos=COLLECTOR_UPLOAD_INTERVAL_SECONDS,
+                 max_lotes=COLLECTOR_MAX_BATCHES, token=COLLECTOR_TOKEN, espera_maxima=600, dispositivo=DISPOSITIVO):
+        """
+        Args:
+            escritor (database_module.EscritorSQLite): Escritor de la base del agente (los lotes se leen de su
+                misma ruta y el progreso se guarda con él). None para el escritor compartido de DATABASE_PATH.
+        """
+        self.url = url.rstrip("/")
+        self.escritor = escritor or database_module.obtener_escritor()
+        self.ruta_db = self.escritor.ruta_db
+        self.intervalo_segundos = intervalo_segundos
+        self.max_lotes = max_lotes
+        self.token = token
+        self.espera_maxima = espera_maxima
+        self.dispositivo = dispositivo
+        self.enviados = 0
+        self.fallos_consecutivos = 0
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="subidor_colector", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def despertar(self):
+        """Pide una subida inmediata (sin esperar al intervalo)."""
+        self._despertar.set()
+
+    def _ultimo_confirmado(self, conexion):
+        fila = conexion.execute("SELECT ultimo_batch_id FROM colector_progreso WHERE url = ?", (self.url,)).fetchone()
+        return fila[0] if fila else 0
+
+    def vaciar(self):
+        """
+        Sube los lotes pendientes más antiguos en un envío.
+        Returns:
+            int: Lotes enviados (0 si no había pendientes).
+        """
+        conexion = sqlite3.connect(self.ruta_db)
+        try:
+            lotes = lotes_pendientes(conexion, self._ultimo_confirmado(conexion), self.max_lotes, self.dispositivo)
+        finally:
+            conexion.close()
+        if not lotes:
+            return 0
+
+        cuerpo = armar_envio(lotes, self.dispositivo)
+        solicitud = urllib.request.Request(self.url + RUTA_LOTES, data=cuerpo, method="POST", headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+            **({"Authorization": f"Bearer {self.token}"} if self.token else {}),
+        })
+        with metricas_module.medir("subida_colector_segundos"):
+            with urllib.request.urlopen(solicitud, timeout=30) as respuesta:
+                resultado = json.loads(respuesta.read())
+        metricas_module.incrementar("bytes_enviados_total", len(cuerpo), destino="colector")
+        metricas_module.incrementar("lotes_subidos_total", len(lotes))
+
+        ultimo = lotes[-1]["id"]
+        actualizado = database_module.a_epoch(datetime.now())
+        self.escritor.ejecutar(lambda c: c.execute(
+            "INSERT OR REPLACE INTO colector_progreso (url, ultimo_batch_id, actualizado) VALUES (?, ?, ?)",
+            (self.url, ultimo, actualizado),
+        ))
+        self.enviados += len(lotes)
+        logger.info(f"Colector: {len(lotes)} lotes enviados ({len(cuerpo)} bytes comprimidos, "
+                    f"{resultado.get('nuevos')} nuevos, {resultado.get('duplicados')} duplicados).")
+        return len(lotes)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                enviados = self.vaciar()
+                self.fallos_consecutivos = 0
+                if enviados == self.max_lotes:
+                    continue # Quedan más pendientes: seguir subiendo sin esperar
+                espera = self.intervalo_segundos
+            except (urllib.error.URLError, OSError, ValueError, sqlite3.Error) as e:
+                self.fallos_consecutivos += 1
+                metricas_module.incrementar("errores_total", etapa="colector")
+                espera = random.uniform(0, min(self.espera_maxima, self.intervalo_segundos * (2 ** self.fallos_consecutivos)))
+                logger.warning(f"Error al subir lotes al colector ({e}). Reintento en {espera:.0f}s.")
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+
+_subidor = None
+
+def iniciar_subidor_colector():
+    """Arranca (una vez) el SubidorColector compartido hacia COLLECTOR_URL y lo retorna."""
+    global _subidor
+    if _subidor is None:
+        _subidor = SubidorColector()
+        _subidor.iniciar()
+    return _subidor
+
+
+if __name__ == '__main__':
+    # Colector central: python colector_module.py [--host 0.0.0.0] [--puerto 8765] [--datos colector_datos]
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Colector central de lotes de varios agentes.")
+    parser.add_argument("--host", default=COLLECTOR_HOST)
+    parser.add_argument("--puerto", type=int, default=COLLECTOR_PORT)
+    parser.add_argument("--datos", default=COLLECTOR_DATA_DIR, help="Directorio con una base SQLite por dispositivo")
+    argumentos = parser.parse_args()
+    almacen = AlmacenColector(argumentos.datos)
+    servidor = ServidorColector(almacen, argumentos.host, argumentos.puerto)
+    metricas_module.iniciar_exportacion()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.cerrar()
+        almacen.cerrar()
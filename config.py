@@ -1,14 +1,93 @@
 # config.py
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
 # Configuración de la base de datos SQLite3
 DATABASE_NAME = os.getenv("DATABASE_NAME") # Nombre de la base de datos
 DATABASE_PATH = os.path.join(os.getcwd(), DATABASE_NAME)
+SQLITE_GROUP_COMMIT_MS = int(os.getenv("SQLITE_GROUP_COMMIT_MS", "50")) # Ventana para agrupar escrituras en un solo commit
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # PRAGMA synchronous del escritor (NORMAL es seguro con WAL)
 
 # Configuración del intervalo de análisis (en segundos)
 ANALYSIS_INTERVAL_SECONDS = os.getenv("ANALYSIS_INTERVAL_SECONDS") # Intervalo de análisis
+CAPTURE_INTERVAL_SECONDS = float(os.getenv("CAPTURE_INTERVAL_SECONDS", "2")) # Pausa entre capturas individuales
+
+# --- Configuración de la tasa de captura adaptativa ---
+CAPTURE_ADAPTIVE = os.getenv("CAPTURE_ADAPTIVE", "false").lower() in ("1", "true", "si", "sí") # Ajustar la pausa según el cambio en pantalla
+CAPTURE_MIN_INTERVAL_SECONDS = float(os.getenv("CAPTURE_MIN_INTERVAL_SECONDS", "0.5")) # Pausa mínima (pantalla cambiando rápido)
+CAPTURE_MAX_INTERVAL_SECONDS = float(os.getenv("CAPTURE_MAX_INTERVAL_SECONDS", "30")) # Pausa máxima (pantalla estática)
+CAPTURE_CHANGE_THRESHOLD = float(os.getenv("CAPTURE_CHANGE_THRESHOLD", "0.02")) # Diferencia media (0-1) considerada cambio rápido
+CAPTURE_STATIC_THRESHOLD = float(os.getenv("CAPTURE_STATIC_THRESHOLD", "0.002")) # Diferencia media (0-1) considerada pantalla estática
+CAPTURE_BACKOFF_FACTOR = float(os.getenv("CAPTURE_BACKOFF_FACTOR", "2")) # Multiplicador de la pausa con pantalla estática
+
+CAPTURE_PERSIST = os.getenv("CAPTURE_PERSIST", "true").lower() in ("1", "true", "si", "sí") # Guardar en disco (PNG) los frames conservados
+
+# --- Configuración del almacenamiento de capturas (empaquetado por día, retención y cuota de disco) ---
+STORAGE_MANAGER_ENABLED = os.getenv("STORAGE_MANAGER_ENABLED", "false").lower() in ("1", "true", "si", "sí") # Gestor en segundo plano
+STORAGE_CHECK_INTERVAL_SECONDS = float(os.getenv("STORAGE_CHECK_INTERVAL_SECONDS", "3600")) # Cada cuánto se revisa el disco
+STORAGE_PACK_AFTER_HOURS = float(os.getenv("STORAGE_PACK_AFTER_HOURS", "24")) # Antigüedad a partir de la cual se empaqueta (0 = nunca)
+STORAGE_PACK_FORMAT = os.getenv("STORAGE_PACK_FORMAT", "original") # 'original' (sin recodificar), 'PNG', o 'WEBP'/'JPEG' (con pérdida)
+STORAGE_PACK_QUALITY = int(os.getenv("STORAGE_PACK_QUALITY", "80")) # Calidad de la recodificación (WEBP/JPEG)
+STORAGE_RETENTION_DAYS = float(os.getenv("STORAGE_RETENTION_DAYS", "0")) # Días que se conservan los frames analizados (0 = sin límite)
+STORAGE_MAX_GB = float(os.getenv("STORAGE_MAX_GB", "0")) # Cuota total de capturas en disco (0 = sin cuota)
+STORAGE_MIN_FREE_GB = float(os.getenv("STORAGE_MIN_FREE_GB", "1")) # Espacio libre mínimo en el disco de las capturas
+
+# --- Configuración del modo pipeline (captura continua + etapas en segundo plano) ---
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "false").lower() in ("1", "true", "si", "sí") # Activa el modo pipeline
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2")) # Lotes máximos en espera entre etapas
+PIPELINE_BACKPRESSURE = os.getenv("PIPELINE_BACKPRESSURE", "fusionar") # 'fusionar' o 'descartar' si el análisis se atrasa
+PIPELINE_MAX_MERGED_FRAMES = int(os.getenv("PIPELINE_MAX_MERGED_FRAMES", "120")) # Tope de frames de un lote fusionado: por encima se descarta el más antiguo (0 = sin límite)
+
+# --- Configuración del reprocesamiento de capturas archivadas (python main.py --reprocesar DIRECTORIO) ---
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", "0")) # Procesos que decodifican y preprocesan (0 = uno por núcleo)
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "4")) # Ciclos en análisis/almacenamiento a la vez
+REPLAY_NOTIFY = os.getenv("REPLAY_NOTIFY", "false").lower() in ("1", "true", "si", "sí") # Enviar el email de cada ciclo reprocesado
+
+# --- Configuración de la deduplicación de frames casi idénticos ---
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "si", "sí") # Colapsar frames repetidos antes de la IA
+DEDUP_HASH_METHOD = os.getenv("DEDUP_HASH_METHOD", "dhash") # 'dhash' o 'ahash'
+DEDUP_HAMMING_THRESHOLD = int(os.getenv("DEDUP_HAMMING_THRESHOLD", "5")) # Distancia máxima (bits de 64) para considerar dos frames iguales
+
+# --- Configuración del preprocesamiento de imágenes antes de enviarlas a la IA ---
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() in ("1", "true", "si", "sí") # Reducir y comprimir antes de enviar
+PREPROCESS_MAX_PIXELS = int(os.getenv("PREPROCESS_MAX_PIXELS", "1000000")) # Píxeles máximos por frame
+PREPROCESS_REQUEST_MAX_PIXELS = int(os.getenv("PREPROCESS_REQUEST_MAX_PIXELS", "8000000")) # Presupuesto de píxeles por solicitud
+PREPROCESS_REQUEST_MAX_BYTES = int(os.getenv("PREPROCESS_REQUEST_MAX_BYTES", "4000000")) # Presupuesto de bytes por solicitud
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "false").lower() in ("1", "true", "si", "sí") # Escala de grises
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "JPEG") # 'JPEG', 'WEBP' o 'PNG'
+PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "80")) # Calidad de codificación (1-95)
+PREPROCESS_CROP = os.getenv("PREPROCESS_CROP", "") # Píxeles a recortar 'arriba,derecha,abajo,izquierda' (ej: barra de tareas '0,0,48,0')
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2")) # Hilos del pool de preprocesamiento
+
+# --- Configuración de la caché de resultados de la IA (tabla 'ai_cache' en la base SQLite) ---
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() in ("1", "true", "si", "sí") # Reutilizar resultados de pantallas idénticas
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000")) # Máximo de entradas (se expulsan las menos usadas)
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", str(7 * 24 * 3600))) # Antigüedad máxima de una entrada
+
+# --- Configuración del motor de análisis (cuota, concurrencia y reintentos) ---
+AI_ANALYSIS_MODE = os.getenv("AI_ANALYSIS_MODE", "conjunto") # 'conjunto' (una solicitud), 'por_frame' (paralelo + agregación), 'mosaico' (hojas de contacto) o 'jerarquico' (bloques + reducción)
+AI_REQUESTS_PER_MINUTE = float(os.getenv("AI_REQUESTS_PER_MINUTE", "15")) # Cuota de solicitudes por minuto (0 = sin límite)
+AI_BURST = int(os.getenv("AI_BURST", "4")) # Solicitudes que pueden salir en ráfaga
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4")) # Llamadas simultáneas al modelo
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "4")) # Reintentos ante 429/5xx/timeout
+AI_BACKOFF_BASE_SECONDS = float(os.getenv("AI_BACKOFF_BASE_SECONDS", "1")) # Espera base del backoff exponencial
+AI_BACKOFF_MAX_SECONDS = float(os.getenv("AI_BACKOFF_MAX_SECONDS", "30")) # Espera máxima entre reintentos
+AI_REQUEST_TIMEOUT_SECONDS = float(os.getenv("AI_REQUEST_TIMEOUT_SECONDS", "60")) # Timeout por llamada
+AI_STREAMING = os.getenv("AI_STREAMING", "false").lower() in ("1", "true", "si", "sí") # Recibir la respuesta en streaming y publicar cada campo apenas se completa
+
+# Configuración del modo jerárquico (resumen por bloques para intervalos largos)
+AI_CHUNK_SIZE = int(os.getenv("AI_CHUNK_SIZE", "20")) # Frames por bloque (solo un bloque de píxeles en memoria a la vez)
+AI_CHUNK_RETRIES = int(os.getenv("AI_CHUNK_RETRIES", "2")) # Reintentos de un bloque fallido (solo se repite ese bloque)
+AI_REDUCE_FANIN = int(os.getenv("AI_REDUCE_FANIN", "8")) # Resúmenes intermedios que se combinan en cada paso de reducción
+
+# Configuración del modo mosaico (hojas de contacto)
+MONTAGE_MAX_WIDTH = int(os.getenv("MONTAGE_MAX_WIDTH", "2048")) # Ancho máximo de cada hoja, en píxeles
+MONTAGE_MAX_HEIGHT = int(os.getenv("MONTAGE_MAX_HEIGHT", "2048")) # Alto máximo de cada hoja, en píxeles
+MONTAGE_MAX_SHEETS = int(os.getenv("MONTAGE_MAX_SHEETS", "4")) # Máximo de hojas por solicitud
+MONTAGE_MAX_TILES_PER_SHEET = int(os.getenv("MONTAGE_MAX_TILES_PER_SHEET", "16")) # Mosaicos por hoja antes de agregar otra hoja
+MONTAGE_QUALITY = int(os.getenv("MONTAGE_QUALITY", "85")) # Calidad de codificación de las hojas (formato PREPROCESS_FORMAT)
 
 # Configuración del correo electrónico (reemplaza con tus datos)
 EMAIL_SENDER = os.getenv("EMAIL_FROM") # Correo electrónico del remitente
@@ -17,14 +96,44 @@ EMAIL_SMTP_SERVER = os.getenv("SMTP_SERVER") # Servidor SMTP
 EMAIL_SMTP_PORT = os.getenv("SMTP_PORT") # Puerto SMTP
 EMAIL_SMTP_USERNAME = os.getenv("SMTP_USERNAME") # Usuario SMTP
 EMAIL_SMTP_PASSWORD = os.getenv("SMTP_PASSWORD") # Contraseña SMTP
+EMAIL_SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "si", "sí") # Usar STARTTLS
+EMAIL_KEEPALIVE_SECONDS = float(os.getenv("SMTP_KEEPALIVE_SECONDS", "60")) # NOOP periódico para mantener viva la conexión
+EMAIL_RETRY_QUEUE_SIZE = int(os.getenv("EMAIL_RETRY_QUEUE_SIZE", "50")) # Correos máximos en espera de envío
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "5")) # Reintentos por correo antes de descartarlo
+EMAIL_DIGEST_ENABLED = os.getenv("EMAIL_DIGEST_ENABLED", "false").lower() in ("1", "true", "si", "sí") # Agrupar varios ciclos en un correo
+EMAIL_DIGEST_WINDOW_SECONDS = float(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", "3600")) # Tiempo máximo que espera un digest
+EMAIL_DIGEST_MAX_SUMMARIES = int(os.getenv("EMAIL_DIGEST_MAX_SUMMARIES", "12")) # Resúmenes por digest
 
 # --- Configuración de Firebase (NUEVO - Ruta al archivo de credenciales) ---
 FIREBASE_CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS_PATH")
+FIREBASE_FLUSH_INTERVAL_SECONDS = float(os.getenv("FIREBASE_FLUSH_INTERVAL_SECONDS", "10")) # Pausa entre envíos de la outbox
+FIREBASE_MAX_BATCH = int(os.getenv("FIREBASE_MAX_BATCH", "500")) # Entradas máximas por update() multi-ruta
+FIREBASE_BACKOFF_MAX_SECONDS = float(os.getenv("FIREBASE_BACKOFF_MAX_SECONDS", "600")) # Espera máxima entre reintentos
+
+# --- Configuración del colector central (agentes de varios dispositivos -> un colector) ---
+COLLECTOR_URL = os.getenv("COLLECTOR_URL", "") # Agente: URL del colector (ej: http://127.0.0.1:8765); vacío = sin subida
+COLLECTOR_TOKEN = os.getenv("COLLECTOR_TOKEN", "") # Token compartido entre agentes y colector (cabecera Authorization)
+COLLECTOR_UPLOAD_INTERVAL_SECONDS = float(os.getenv("COLLECTOR_UPLOAD_INTERVAL_SECONDS", "30")) # Agente: pausa entre subidas
+COLLECTOR_MAX_BATCHES = int(os.getenv("COLLECTOR_MAX_BATCHES", "200")) # Agente: lotes máximos por envío
+COLLECTOR_HOST = os.getenv("COLLECTOR_HOST", "127.0.0.1") # Colector: interfaz en la que escucha
+COLLECTOR_PORT = int(os.getenv("COLLECTOR_PORT", "8765")) # Colector: puerto
+COLLECTOR_DATA_DIR = os.getenv("COLLECTOR_DATA_DIR", "colector_datos") # Colector: directorio con una base SQLite por dispositivo
+COLLECTOR_MAX_BODY_MB = float(os.getenv("COLLECTOR_MAX_BODY_MB", "32")) # Colector: tamaño máximo de un envío descomprimido
+
+# --- Configuración de métricas ---
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "si", "sí") # Registrar tiempos y contadores por etapa
+METRICS_EXPORT_INTERVAL_SECONDS = float(os.getenv("METRICS_EXPORT_INTERVAL_SECONDS", "60")) # Cada cuánto se exportan
+METRICS_LOG_JSON = os.getenv("METRICS_LOG_JSON", "true").lower() in ("1", "true", "si", "sí") # Exportar como registro JSON en el log
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "") # Ruta del textfile de Prometheus (ej: /var/lib/node_exporter/analizador.prom)
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0")) # Puerto del endpoint /metrics en 127.0.0.1 (0 = desactivado)
 
 # --- Configuración del Nombre del Dispositivo (NUEVO) ---
 DISPOSITIVO = os.getenv("DISPOSITIVO", "Dispositivo_Predeterminado") # Nombre por defecto: Dispositivo_Predeterminado
 
-# Directorio para guardar las capturas de pantalla (opcional)
-SCREENSHOTS_DIR = 'screenshots'
-if not os.path.exists(SCREENSHOTS_DIR):
-    os.makedirs(SCREENSHOTS_DIR)
\ No newline at end of file
+# Tasas de captura por dispositivo (JSON), ej: {"Laptop_Juan": {"min": 1, "max": 20}}. Reemplaza CAPTURE_MIN/MAX_INTERVAL_SECONDS para este DISPOSITIVO.
+_TASAS_DISPOSITIVO = json.loads(os.getenv("CAPTURE_RATES_BY_DEVICE", "{}")).get(DISPOSITIVO, {})
+CAPTURE_MIN_INTERVAL_SECONDS = float(_TASAS_DISPOSITIVO.get("min", CAPTURE_MIN_INTERVAL_SECONDS))
+CAPTURE_MAX_INTERVAL_SECONDS = float(_TASAS_DISPOSITIVO.get("max", CAPTURE_MAX_INTERVAL_SECONDS))
+
+# Directorio para guardar las capturas de pantalla (opcional). Se crea en main.inicializar() o al guardar el primer frame.
+SCREENSHOTS_DIR = 'screenshots'
\ No newline at end of file
@@ -1,10 +1,18 @@
 # database_module.py
 import sqlite3
 import os
+import json
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+import metricas_module
+from utilidades_json_module import extraer_json
 from config import DATABASE_PATH, FIREBASE_CREDENTIALS_PATH, DISPOSITIVO # Importar DISPOSITIVO desde config
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import db
+from config import SQLITE_GROUP_COMMIT_MS, SQLITE_SYNCHRONOUS
+from config import FIREBASE_FLUSH_INTERVAL_SECONDS, FIREBASE_MAX_BATCH, FIREBASE_BACKOFF_MAX_SECONDS
 import logging
 from datetime import datetime
 
@@ -22,71 +30,723 @@ def crear_conexion():
         logger.error(f"Error al conectar a la base de datos SQLite: {e}")
     return conexion
 
+ESQUEMA_VERSION = 6 # Versión del esquema (PRAGMA user_version)
+
+ESQUEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS screenshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,  -- Epoch en segundos
+        filepath TEXT UNIQUE NOT NULL,
+        dispositivo TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analysis_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dispositivo TEXT,
+        inicio INTEGER NOT NULL,  -- Epoch en segundos del inicio del intervalo capturado
+        fin INTEGER NOT NULL,
+        num_screenshots INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS batch_screenshots (
+        batch_id INTEGER NOT NULL REFERENCES analysis_batches(id),
+        screenshot_id INTEGER NOT NULL REFERENCES screenshots(id),
+        PRIMARY KEY (batch_id, screenshot_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analysis_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        screenshot_id INTEGER REFERENCES screenshots(id),  -- Primer screenshot del lote (compatibilidad)
+        batch_id INTEGER REFERENCES analysis_batches(id),
+        timestamp INTEGER NOT NULL,  -- Epoch en segundos
+        summary TEXT,
+        dispositivo TEXT,
+        analisis_conjunto TEXT,  -- Campos del JSON de la IA, separados al guardar (NULL si no era JSON)
+        comportamiento_global TEXT,
+        uso_tiempo_global TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS firebase_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ruta TEXT NOT NULL,  -- Ruta de Firebase a escribir
+        valor TEXT NOT NULL,  -- Valor serializado como JSON
+        creado INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS firebase_rechazos (
+        id INTEGER PRIMARY KEY,  -- ID que tenía la entrada en firebase_outbox
+        ruta TEXT NOT NULL,
+        valor TEXT NOT NULL,
+        creado INTEGER NOT NULL,
+        rechazado INTEGER NOT NULL,  -- Epoch en que Firebase la rechazó
+        error TEXT  -- Motivo del rechazo (ej: clave con caracteres no permitidos, valor demasiado grande)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS replay_progreso (
+        clave TEXT PRIMARY KEY,  -- Ciclo reprocesado: dispositivo, inicio, fin y cantidad de archivos
+        estado TEXT NOT NULL,  -- 'completado' o 'error' (se reintenta en la próxima ejecución)
+        batch_id INTEGER REFERENCES analysis_batches(id),
+        actualizado INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS screenshot_archivo (
+        filepath TEXT PRIMARY KEY,  -- Ruta original (screenshots.filepath)
+        paquete TEXT,  -- Paquete .tar del día; NULL si el frame se eliminó por retención o cuota
+        desplazamiento INTEGER,  -- Byte del paquete donde empiezan los datos de la imagen
+        longitud INTEGER,
+        archivado INTEGER NOT NULL  -- Epoch en que se empaquetó o eliminó
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS resumenes_parciales (
+        dispositivo TEXT NOT NULL,
+        inicio INTEGER NOT NULL,  -- Epoch del inicio del ciclo que se está analizando
+        campo TEXT NOT NULL,  -- Campo del JSON de la IA ya recibido (modo streaming)
+        valor TEXT,
+        recibido INTEGER NOT NULL,
+        PRIMARY KEY (dispositivo, inicio, campo)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS colector_progreso (
+        url TEXT PRIMARY KEY,  -- Colector de destino
+        ultimo_batch_id INTEGER NOT NULL,  -- Último lote confirmado por el colector
+        actualizado INTEGER NOT NULL
+    )
+    """,
+    # Índice de texto completo de los resúmenes: rowid = analysis_summaries.id. Los campos del JSON de la IA
+    # van en columnas separadas; 'texto' guarda el resto (o el resumen entero si no es JSON).
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS analysis_summaries_fts USING fts5 (
+        analisis_conjunto, comportamiento_global, uso_tiempo_global, texto,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summaries_fts_borrar AFTER DELETE ON analysis_summaries BEGIN
+        DELETE FROM analysis_summaries_fts WHERE rowid = old.id;
+    END
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_screenshots_dispositivo_ts ON screenshots (dispositivo, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_screenshots_ts ON screenshots (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_batches_dispositivo_inicio ON analysis_batches (dispositivo, inicio)",
+    "CREATE INDEX IF NOT EXISTS idx_batch_screenshots_screenshot ON batch_screenshots (screenshot_id)",
+    "CREATE INDEX IF NOT EXISTS idx_summaries_dispositivo_ts ON analysis_summaries (dispositivo, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_summaries_ts ON analysis_summaries (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_summaries_batch ON analysis_summaries (batch_id)",
+    "CREATE INDEX IF NOT EXISTS idx_archivo_paquete ON screenshot_archivo (paquete)",
+]
+
+def _migrar_a_v1(cursor):
+    """
+    Migra el esquema original (timestamps TEXT, resumen ligado solo al primer screenshot) al v1:
+    timestamps epoch INTEGER, columna 'dispositivo' en screenshots y un lote por cada resumen existente.
+    Las fechas TEXT antiguas están en hora local; se convierten a epoch con el modificador 'utc'. Una fecha
+    que no se puede interpretar toma la de la fila relacionada o, si tampoco hay, 0 (la fila se conserva).
+    """
+    invalidas = cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM screenshots WHERE strftime('%s', timestamp) IS NULL)
+             + (SELECT COUNT(*) FROM analysis_summaries WHERE strftime('%s', timestamp) IS NULL)
+    """).fetchone()[0]
+    if invalidas:
+        logger.warning(f"{invalidas} filas del esquema original tienen una fecha que no se puede interpretar.")
+    cursor.execute("ALTER TABLE screenshots RENAME TO screenshots_v0")
+    cursor.execute("ALTER TABLE analysis_summaries RENAME TO analysis_summaries_v0")
+    for sentencia in ESQUEMA[:4]:
+        cursor.execute(sentencia)
+    cursor.execute("""
+        INSERT INTO screenshots (id, timestamp, filepath, dispositivo)
+        SELECT s.id, COALESCE(CAST(strftime('%s', s.timestamp, 'utc') AS INTEGER),
+                              (SELECT CAST(strftime('%s', a.timestamp, 'utc') AS INTEGER)
+                               FROM analysis_summaries_v0 a WHERE a.screenshot_id = s.id LIMIT 1), 0),
+               s.filepath,
+               (SELECT a.dispositivo FROM analysis_summaries_v0 a WHERE a.screenshot_id = s.id LIMIT 1)
+        FROM screenshots_v0 s
+    """)
+    cursor.execute("""
+        INSERT INTO analysis_batches (id, dispositivo, inicio, fin, num_screenshots)
+        SELECT a.id, a.dispositivo, COALESCE(s.timestamp, CAST(strftime('%s', a.timestamp, 'utc') AS INTEGER), 0),
+               COALESCE(CAST(strftime('%s', a.timestamp, 'utc') AS INTEGER), s.timestamp, 0), 1
+        FROM analysis_summaries_v0 a LEFT JOIN screenshots s ON s.id = a.screenshot_id
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO batch_screenshots (batch_id, screenshot_id)
+        SELECT id, screenshot_id FROM analysis_summaries_v0 WHERE screenshot_id IS NOT NULL
+    """)
+    cursor.execute("""
+        INSERT INTO analysis_summaries (id, screenshot_id, batch_id, timestamp, summary, dispositivo)
+        SELECT a.id, a.screenshot_id, a.id, COALESCE(CAST(strftime('%s', a.timestamp, 'utc') AS INTEGER), s.timestamp, 0),
+               a.summary, a.dispositivo
+        FROM analysis_summaries_v0 a LEFT JOIN screenshots s ON s.id = a.screenshot_id
+    """)
+    cursor.execute("DROP TABLE analysis_summaries_v0")
+    cursor.execute("DROP TABLE screenshots_v0")
+
+def _migrar_a_v2(cursor):
+    """Crea el índice de texto completo (FTS5) y lo llena con los resúmenes existentes."""
+    for sentencia in ESQUEMA:
+        if "analysis_summaries_fts" in sentencia:
+            cursor.execute(sentencia)
+    filas = cursor.execute("SELECT id, summary FROM analysis_summaries").fetchall()
+    _indexar_resumenes(cursor, filas)
+    logger.info(f"Índice de texto completo creado con {len(filas)} resúmenes.")
+
+def _migrar_a_v6(cursor):
+    """
+    Agrega a analysis_summaries las columnas de los campos del JSON de la IA y las llena desde el
+    índice de texto completo, que ya guarda cada resumen separado en esos campos (no se vuelve a parsear).
+    """
+    existentes = {fila[1] for fila in cursor.execute("PRAGMA table_info(analysis_summaries)")}
+    for campo in CAMPOS_RESUMEN:
+        if campo not in existentes: # Una base migrada desde v0 ya tiene las columnas (_migrar_a_v1 usa ESQUEMA)
+            cursor.execute(f"ALTER TABLE analysis_summaries ADD COLUMN {campo} TEXT")
+    cursor.execute(f"""
+        UPDATE analysis_summaries
+        SET ({", ".join(CAMPOS_RESUMEN)}) = (
+            SELECT {", ".join("f." + campo for campo in CAMPOS_RESUMEN)}
+            FROM analysis_summaries_fts f WHERE f.rowid = analysis_summaries.id
+        )
+        WHERE analisis_conjunto IS NULL
+    """)
+    logger.info(f"Campos estructurados agregados a {cursor.rowcount} resúmenes.")
+
+MIGRACIONES = {1: _migrar_a_v1, 2: _migrar_a_v2, 6: _migrar_a_v6} # versión destino -> función de migración
+
 def crear_tablas():
-    """Crea las tablas 'screenshots' y 'analysis_summaries' en la base de datos SQLite si no existen."""
+    """
+    Crea las tablas de la base de datos SQLite si no existen y migra las bases existentes
+    a la versión actual del esquema (PRAGMA user_version). Todas las migraciones y el cambio de versión
+    van en una sola transacción: si algo falla, la base queda exactamente como estaba.
+    """
     conexion = crear_conexion()
     if conexion:
+        conexion.isolation_level = None # Transacción explícita: en el modo por defecto, ALTER TABLE confirma por su cuenta
         cursor = conexion.cursor()
         try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS screenshots (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    filepath TEXT UNIQUE NOT NULL
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS analysis_summaries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    screenshot_id INTEGER NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    summary TEXT,
-                    dispositivo TEXT,  -- NUEVA COLUMNA 'dispositivo'
-                    FOREIGN KEY (screenshot_id) REFERENCES screenshots(id)
-                )
-            """)
-            conexion.commit()
-            logger.info("Tablas 'screenshots' y 'analysis_summaries' creadas o verificadas en SQLite.")
+            cursor.execute("BEGIN IMMEDIATE")
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            existe = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'screenshots'").fetchone()
+            if existe:
+                for destino in range(version + 1, ESQUEMA_VERSION + 1):
+                    if destino not in MIGRACIONES:
+                        continue # Versión que solo agrega tablas nuevas: las crea ESQUEMA más abajo
+                    logger.info(f"Migrando el esquema SQLite de la versión {destino - 1} a la {destino}...")
+                    MIGRACIONES[destino](cursor)
+            for sentencia in ESQUEMA:
+                cursor.execute(sentencia)
+            cursor.execute(f"PRAGMA user_version = {ESQUEMA_VERSION}")
+            cursor.execute("COMMIT")
+            logger.info(f"Tablas SQLite creadas o verificadas (esquema v{ESQUEMA_VERSION}).")
         except sqlite3.Error as e:
+            if conexion.in_transaction:
+                cursor.execute("ROLLBACK")
             logger.error(f"Error al crear tablas en la base de datos SQLite: {e}")
         finally:
             conexion.close()
 
-def guardar_screenshot_db(filepath):
-    """Guarda la información de una screenshot en la base de datos SQLite y retorna su ID."""
-    conexion = crear_conexion()
-    screenshot_id = None
-    if conexion:
-        cursor = conexion.cursor()
+CAMPOS_RESUMEN = ("analisis_conjunto", "comportamiento_global", "uso_tiempo_global") # Claves del JSON de la IA
+
+def campos_resumen(summary, datos=None):
+    """
+    Separa un resumen en las columnas estructuradas y las del índice de texto completo.
+    Args:
+        summary (str): Resumen de la IA.
+        datos (dict): Opcional. El resumen ya parseado (ej: por el parser incremental del streaming).
+    Returns:
+        tuple: (analisis_conjunto, comportamiento_global, uso_tiempo_global, texto). Si el resumen no es un
+               JSON, todo va en 'texto'; si lo es, 'texto' junta los valores de las demás claves.
+    """
+    if datos is None:
+        datos = extraer_json(summary)
+    if datos is None:
+        return (None, None, None, summary)
+    def a_texto(valor):
+        if valor is None or isinstance(valor, str):
+            return valor
+        return json.dumps(valor, ensure_ascii=False)
+    resto = [a_texto(valor) for clave, valor in datos.items() if clave not in CAMPOS_RESUMEN]
+    return tuple(a_texto(datos.get(campo)) for campo in CAMPOS_RESUMEN) + ("\n".join(r for r in resto if r) or None,)
+
+SQL_INDEXAR = """
+    INSERT INTO analysis_summaries_fts (rowid, analisis_conjunto, comportamiento_global, uso_tiempo_global, texto)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+def _indexar_resumenes(conexion, filas):
+    """Agrega al índice de texto completo los resúmenes (id, summary) dados (se ejecuta en el escritor)."""
+    conexion.executemany(SQL_INDEXAR, [(summary_id,) + campos_resumen(summary) for summary_id, summary in filas if summary])
+
+def _insertar_resumen(conexion, screenshot_id, batch_id, summary, campos=None, momento=None):
+    """
+    Inserta un resumen con sus campos estructurados y lo indexa (se ejecuta en el escritor).
+    El resumen se parsea una sola vez, al guardarlo; las lecturas usan las columnas.
+    `momento` es la fecha del resumen (por defecto, ahora).
+    Returns:
+        int: ID del resumen.
+    """
+    separados = campos_resumen(summary, campos) if summary else (None, None, None, None)
+    summary_id = conexion.execute("""
+        INSERT INTO analysis_summaries (screenshot_id, batch_id, timestamp, summary, dispositivo,
+                                        analisis_conjunto, comportamiento_global, uso_tiempo_global)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (screenshot_id, batch_id, a_epoch(momento or datetime.now()), summary, DISPOSITIVO) + separados[:3]).lastrowid
+    if summary:
+        conexion.execute(SQL_INDEXAR, (summary_id,) + separados)
+    return summary_id
+
+def a_epoch(valor):
+    """Convierte un datetime (o un epoch ya numérico) a epoch entero en segundos. None se mantiene."""
+    if valor is None or isinstance(valor, (int, float)):
+        return None if valor is None else int(valor)
+    return int(valor.timestamp())
+
+# --- Escritor SQLite persistente (una conexión, un hilo, commits agrupados) ---
+class EscritorSQLite:
+    """
+    Dueño único de una conexión SQLite de escritura, en un hilo dedicado.
+    Otros hilos envían escrituras por una cola; el hilo agrupa las que llegan dentro de una
+    ventana breve en una sola transacción (group commit), de modo que un ciclo completo cuesta
+    un único commit/fsync en lugar de uno por fila.
+    """
+
+    def __init__(self, ruta_db, ventana_commit_ms=50, max_por_transaccion=500, synchronous="NORMAL"):
+        self.ruta_db = ruta_db
+        self.ventana_commit = ventana_commit_ms / 1000.0
+        self.max_por_transaccion = max_por_transaccion
+        self.synchronous = synchronous
+        self._cola = queue.Queue()
+        self._listo = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="escritor_sqlite", daemon=True)
+        self._hilo.start()
+        self._listo.wait()
+
+    def _configurar(self, conexion):
+        conexion.execute("PRAGMA journal_mode=WAL") # Lectores concurrentes sin bloquear al escritor
+        conexion.execute(f"PRAGMA synchronous={self.synchronous}") # NORMAL: en WAL solo hace fsync en checkpoints
+        conexion.execute("PRAGMA cache_size=-20000") # ~20 MB de caché de páginas
+        conexion.execute("PRAGMA temp_store=MEMORY")
+        conexion.execute("PRAGMA busy_timeout=5000")
+
+    def enviar(self, operacion):
+        """
+        Encola una escritura. `operacion(conexion)` se ejecuta en el hilo escritor dentro de la
+        transacción en curso. Retorna un Future con el valor que retorne la operación.
+        """
+        futuro = Future()
+        self._cola.put((operacion, futuro))
+        return futuro
+
+    def ejecutar(self, operacion, timeout=None):
+        """Encola una escritura y espera a que esté confirmada (commit). Retorna su resultado."""
+        return self.enviar(operacion).result(timeout)
+
+    def cerrar(self):
+        """Confirma las escrituras pendientes y cierra la conexión."""
+        self._cola.put(None)
+        self._hilo.join()
+
+    def _bucle(self):
+        conexion = sqlite3.connect(self.ruta_db, isolation_level=None) # Transacciones explícitas
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("INSERT INTO screenshots (timestamp, filepath) VALUES (?, ?)", (timestamp, filepath))
-            screenshot_id = cursor.lastrowid # Obtener el ID asignado automáticamente
-            conexion.commit()
-            logger.info(f"Screenshot guardada en SQLite: {filepath}, ID: {screenshot_id}")
+            self._configurar(conexion)
+            logger.info(f"Escritor SQLite iniciado en: {self.ruta_db} (WAL, synchronous={self.synchronous})")
         except sqlite3.Error as e:
-            logger.error(f"Error al guardar screenshot en SQLite: {e}")
-        finally:
-            conexion.close()
-    return screenshot_id
+            logger.error(f"Error al configurar la conexión SQLite del escritor: {e}")
+        self._listo.set()
 
-def guardar_resumen_analisis_db(screenshot_id, summary):
-    """Guarda el resumen del análisis de una screenshot en la base de datos SQLite."""
-    conexion = crear_conexion()
-    if conexion:
-        cursor = conexion.cursor()
+        terminar = False
+        while not terminar:
+            tareas = [self._cola.get()]
+            limite = time.monotonic() + self.ventana_commit
+            while len(tareas) < self.max_por_transaccion:
+                try:
+                    tareas.append(self._cola.get(timeout=max(0.0, limite - time.monotonic())))
+                except queue.Empty:
+                    break
+            if None in tareas:
+                terminar = True
+                tareas = [t for t in tareas if t is not None]
+            if tareas:
+                self._ejecutar_transaccion(conexion, tareas)
+        conexion.close()
+
+    def _ejecutar_transaccion(self, conexion, tareas):
+        with metricas_module.medir("escritura_sqlite_segundos"):
+            self._transaccion(conexion, tareas)
+        metricas_module.incrementar("operaciones_sqlite_total", len(tareas))
+
+    def _transaccion(self, conexion, tareas):
+        resultados = []
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("""
-                INSERT INTO analysis_summaries (screenshot_id, timestamp, summary, dispositivo)
-                VALUES (?, ?, ?, ?)  -- Incluir 'dispositivo' en la inserción
-            """, (screenshot_id, timestamp, summary, DISPOSITIVO)) # Usar la variable DISPOSITIVO de config
-            conexion.commit()
-            logger.info(f"Resumen de análisis guardado en SQLite para screenshot ID {screenshot_id}, dispositivo: {DISPOSITIVO}")
+            conexion.execute("BEGIN")
+            for operacion, futuro in tareas:
+                # Un SAVEPOINT por operación: si una falla, se deshace solo esa y el resto se confirma
+                conexion.execute("SAVEPOINT operacion")
+                try:
+                    resultados.append((futuro, operacion(conexion), None))
+                    conexion.execute("RELEASE operacion")
+                except Exception as e:
+                    conexion.execute("ROLLBACK TO operacion")
+                    conexion.execute("RELEASE operacion")
+                    resultados.append((futuro, None, e))
+            conexion.execute("COMMIT")
         except sqlite3.Error as e:
-            logger.error(f"Error al guardar resumen de análisis en SQLite: {e}")
-        finally:
-            conexion.close()
+            metricas_module.incrementar("errores_total", etapa="sqlite")
+            logger.error(f"Error al confirmar la transacción en SQLite: {e}")
+            if conexion.in_transaction:
+                conexion.execute("ROLLBACK")
+            for _, futuro in tareas:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+
+
+_escritor = None # Escritor compartido, creado en el primer uso
+_escritor_lock = threading.Lock()
+
+def obtener_escritor():
+    """Retorna el EscritorSQLite compartido sobre DATABASE_PATH."""
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None:
+            _escritor = EscritorSQLite(DATABASE_PATH, SQLITE_GROUP_COMMIT_MS, synchronous=SQLITE_SYNCHRONOUS)
+        return _escritor
+
+def _insertar_screenshots(conexion, filepaths, timestamps):
+    """Inserta las screenshots con executemany y retorna sus IDs en el mismo orden (se ejecuta en el escritor)."""
+    ahora = a_epoch(datetime.now())
+    filas = [(a_epoch(ts) or ahora, filepath, DISPOSITIVO)
+             for filepath, ts in zip(filepaths, timestamps or [None] * len(filepaths))]
+    conexion.executemany("INSERT OR IGNORE INTO screenshots (timestamp, filepath, dispositivo) VALUES (?, ?, ?)", filas)
+    ids = {}
+    for inicio in range(0, len(filepaths), 500): # Límite de parámetros por consulta
+        bloque = filepaths[inicio:inicio + 500]
+        marcadores = ",".join("?" * len(bloque))
+        ids.update(conexion.execute(f"SELECT filepath, id FROM screenshots WHERE filepath IN ({marcadores})", bloque).fetchall())
+    return [ids.get(filepath) for filepath in filepaths]
+
+def guardar_screenshots_db(filepaths, timestamps=None):
+    """
+    Guarda varias screenshots en una sola transacción (executemany) y retorna sus IDs.
+    Args:
+        filepaths (list): Rutas de las screenshots.
+        timestamps (list): Opcional. datetime de cada captura (por defecto, ahora).
+    Returns:
+        list: IDs asignados, en el mismo orden que `filepaths` (None si alguna no se pudo guardar).
+    """
+    if not filepaths:
+        return []
+    try:
+        screenshot_ids = obtener_escritor().ejecutar(lambda conexion: _insertar_screenshots(conexion, filepaths, timestamps))
+        logger.info(f"{len(filepaths)} screenshots guardadas en SQLite en una transacción. IDs: {screenshot_ids[0]}..{screenshot_ids[-1]}")
+        return screenshot_ids
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar screenshots en SQLite: {e}")
+        return [None] * len(filepaths)
+
+def guardar_batch_db(filepaths, timestamps, resumen, inicio, fin, campos=None):
+    """
+    Guarda un ciclo completo en una sola transacción: sus screenshots, el lote (analysis_batches),
+    la relación lote-screenshot y el resumen global. Descarta los campos parciales del ciclo.
+    El resumen se fecha con el fin del ciclo, no con el momento en que se guarda: un ciclo
+    reprocesado conserva la fecha en que se capturó.
+    Args:
+        filepaths (list): Rutas de las screenshots del lote.
+        timestamps (list): datetime de cada captura.
+        resumen (str): Resumen global de la IA.
+        inicio (datetime): Inicio del intervalo capturado.
+        fin (datetime): Fin del intervalo capturado.
+        campos (dict): Opcional. El resumen ya parseado, para no volver a parsearlo.
+    Returns:
+        dict: {'batch_id', 'summary_id', 'screenshot_ids'}, o None si falló.
+    """
+    def operacion(conexion):
+        screenshot_ids = [i for i in _insertar_screenshots(conexion, filepaths, timestamps) if i] if filepaths else []
+        batch_id = conexion.execute(
+            "INSERT INTO analysis_batches (dispositivo, inicio, fin, num_screenshots) VALUES (?, ?, ?, ?)",
+            (DISPOSITIVO, a_epoch(inicio), a_epoch(fin), len(screenshot_ids)),
+        ).lastrowid
+        conexion.executemany("INSERT OR IGNORE INTO batch_screenshots (batch_id, screenshot_id) VALUES (?, ?)",
+                             [(batch_id, screenshot_id) for screenshot_id in screenshot_ids])
+        summary_id = _insertar_resumen(conexion, screenshot_ids[0] if screenshot_ids else None, batch_id, resumen, campos, fin)
+        conexion.execute("DELETE FROM resumenes_parciales WHERE dispositivo = ? AND inicio = ?", (DISPOSITIVO, a_epoch(inicio)))
+        return {"batch_id": batch_id, "summary_id": summary_id, "screenshot_ids": screenshot_ids}
+
+    try:
+        resultado = obtener_escritor().ejecutar(operacion)
+        logger.info(f"Lote {resultado['batch_id']} guardado en SQLite con {len(resultado['screenshot_ids'])} screenshots, dispositivo: {DISPOSITIVO}")
+        return resultado
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar el lote en SQLite: {e}")
+        return None
+
+def guardar_screenshot_db(filepath):
+    """Guarda la información de una screenshot en la base de datos SQLite y retorna su ID."""
+    return guardar_screenshots_db([filepath])[0]
+
+def guardar_resumen_analisis_db(screenshot_id, summary):
+    """Guarda el resumen del análisis de una screenshot en la base de datos SQLite. Retorna True si se guardó."""
+    def operacion(conexion):
+        _insertar_resumen(conexion, screenshot_id, None, summary) # Con la variable DISPOSITIVO de config
+
+    try:
+        obtener_escritor().ejecutar(operacion)
+        logger.info(f"Resumen de análisis guardado en SQLite para screenshot ID {screenshot_id}, dispositivo: {DISPOSITIVO}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar resumen de análisis en SQLite: {e}")
+        return False
+
+def guardar_campo_parcial(inicio, campo, valor):
+    """
+    Registra un campo del resumen de un ciclo que todavía se está analizando (modo streaming).
+    No espera el commit: la escritura se agrupa con las demás del escritor y el análisis sigue recibiendo
+    la respuesta. guardar_batch_db descarta los campos parciales al guardar el resumen completo.
+    Args:
+        inicio (datetime): Inicio del ciclo (identifica el ciclo junto con DISPOSITIVO).
+        campo (str): Clave del JSON de la IA.
+        valor: Valor del campo (los que no son texto se guardan como JSON).
+    """
+    fila = (DISPOSITIVO, a_epoch(inicio), campo, valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False),
+            a_epoch(datetime.now()))
+    obtener_escritor().enviar(lambda conexion: conexion.execute(
+        "INSERT OR REPLACE INTO resumenes_parciales (dispositivo, inicio, campo, valor, recibido) VALUES (?, ?, ?, ?, ?)", fila))
+
+def descartar_campos_parciales(inicio):
+    """
+    Borra los campos parciales del ciclo (SQLite y nodo de Firebase), ej: cuando la respuesta del modelo
+    se reintenta desde el principio y los campos recibidos dejan de valer.
+    Args:
+        inicio (datetime): Inicio del ciclo (identifica el ciclo junto con DISPOSITIVO).
+    """
+    fila = (DISPOSITIVO, a_epoch(inicio))
+    obtener_escritor().enviar(lambda conexion: conexion.execute(
+        "DELETE FROM resumenes_parciales WHERE dispositivo = ? AND inicio = ?", fila))
+    encolar_firebase({_ruta_parcial_firebase(inicio): None}) # None borra el nodo en update()
+
+def consultar_resumenes_parciales(dispositivo=None):
+    """
+    Campos ya recibidos de los ciclos en análisis (o cuyo análisis se interrumpió).
+    Returns:
+        list: dicts con 'dispositivo', 'inicio', 'recibido' y 'campos' (dict campo -> valor), del más reciente al más antiguo.
+    """
+    condicion, parametros = ("WHERE dispositivo = ?", (dispositivo,)) if dispositivo is not None else ("", ())
+    ciclos = {}
+    for fila in _conexion_lectura().execute(f"""
+        SELECT dispositivo, inicio, campo, valor, recibido FROM resumenes_parciales {condicion}
+        ORDER BY inicio DESC, recibido
+    """, parametros):
+        ciclo = ciclos.setdefault((fila["dispositivo"], fila["inicio"]), {
+            "dispositivo": fila["dispositivo"], "inicio": fila["inicio"], "recibido": fila["recibido"], "campos": {}})
+        ciclo["campos"][fila["campo"]] = fila["valor"]
+        ciclo["recibido"] = max(ciclo["recibido"], fila["recibido"])
+    return list(ciclos.values())
+
+# --- Consultas por dispositivo y rango de tiempo ---
+_lectura_local = threading.local()
+
+def _conexion_lectura():
+    """Conexión de solo lectura reutilizada por hilo (en WAL no bloquea al escritor)."""
+    conexion = getattr(_lectura_local, "conexion", None)
+    if conexion is None:
+        conexion = sqlite3.connect(DATABASE_PATH)
+        conexion.row_factory = sqlite3.Row
+        _lectura_local.conexion = conexion
+    return conexion
+
+def _consultar_rango(tabla, columnas, dispositivo, desde, hasta, limite, antes_de):
+    condiciones, parametros = [], []
+    if dispositivo is not None:
+        condiciones.append("dispositivo = ?")
+        parametros.append(dispositivo)
+    if desde is not None:
+        condiciones.append("timestamp >= ?")
+        parametros.append(a_epoch(desde))
+    if hasta is not None:
+        condiciones.append("timestamp < ?")
+        parametros.append(a_epoch(hasta))
+    if antes_de is not None:
+        condiciones.append("(timestamp, id) < (?, ?)") # Paginación por cursor: no recorre las páginas anteriores
+        parametros.extend(antes_de)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    filas = _conexion_lectura().execute(
+        f"SELECT {columnas} FROM {tabla} {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+        parametros + [limite],
+    ).fetchall()
+    filas = [dict(fila) for fila in filas]
+    siguiente = (filas[-1]["timestamp"], filas[-1]["id"]) if len(filas) == limite else None
+    return filas, siguiente
+
+def consultar_resumenes(dispositivo=None, desde=None, hasta=None, limite=100, antes_de=None):
+    """
+    Resúmenes de análisis de un dispositivo (o de todos) en un rango de tiempo, del más reciente al más antiguo.
+    Args:
+        dispositivo (str): Nombre del dispositivo; None para todos.
+        desde, hasta (datetime | int): Rango [desde, hasta) en datetime o epoch.
+        limite (int): Tamaño de página.
+        antes_de (tuple): Cursor de la página siguiente, tal como lo retorna la llamada anterior.
+    Returns:
+        tuple: (lista de dicts, cursor de la página siguiente o None si no hay más).
+    """
+    return _consultar_rango("analysis_summaries", "id, batch_id, screenshot_id, timestamp, summary, dispositivo, "
+                            + ", ".join(CAMPOS_RESUMEN),
+                            dispositivo, desde, hasta, limite, antes_de)
+
+def consultar_screenshots(dispositivo=None, desde=None, hasta=None, limite=100, antes_de=None):
+    """Screenshots de un dispositivo (o de todos) en un rango de tiempo. Misma paginación que consultar_resumenes."""
+    return _consultar_rango("screenshots", "id, timestamp, filepath, dispositivo",
+                            dispositivo, desde, hasta, limite, antes_de)
+
+def _consulta_fts(texto):
+    """Convierte texto libre en una consulta FTS5: cada palabra entre comillas (ej: 'youtube.com' no es sintaxis)."""
+    terminos = ['"' + termino.replace('"', '""') + '"' for termino in texto.split()]
+    return " ".join(terminos)
+
+def buscar_resumenes(consulta, dispositivo=None, desde=None, hasta=None, limite=20, campo=None, sintaxis_fts=False):
+    """
+    Búsqueda de texto completo en los resúmenes, ordenada por relevancia (BM25).
+    Args:
+        consulta (str): Palabras a buscar (deben aparecer todas). Mayúsculas y acentos se ignoran.
+        dispositivo (str): Nombre del dispositivo; None para todos.
+        desde, hasta (datetime | int): Rango [desde, hasta) en datetime o epoch.
+        limite (int): Máximo de resultados.
+        campo (str): Opcional. Restringe la búsqueda a una columna: 'analisis_conjunto',
+                     'comportamiento_global', 'uso_tiempo_global' o 'texto'.
+        sintaxis_fts (bool): Si es True, `consulta` se pasa tal cual a FTS5 (OR, NEAR, prefijos con *, etc.).
+    Returns:
+        list: dicts con id, batch_id, timestamp, dispositivo, los campos del resumen y 'fragmento'
+              (extracto con las coincidencias entre [corchetes]), del más relevante al menos relevante.
+    """
+    expresion = consulta if sintaxis_fts else _consulta_fts(consulta)
+    if not expresion:
+        return []
+    if campo is not None:
+        if campo not in CAMPOS_RESUMEN + ("texto",):
+            raise ValueError(f"Campo de búsqueda desconocido: {campo}")
+        expresion = f"{campo} : ({expresion})"
+    condiciones, parametros = ["analysis_summaries_fts MATCH ?"], [expresion]
+    if dispositivo is not None:
+        condiciones.append("s.dispositivo = ?")
+        parametros.append(dispositivo)
+    if desde is not None:
+        condiciones.append("s.timestamp >= ?")
+        parametros.append(a_epoch(desde))
+    if hasta is not None:
+        condiciones.append("s.timestamp < ?")
+        parametros.append(a_epoch(hasta))
+    filas = _conexion_lectura().execute(f"""
+        SELECT s.id, s.batch_id, s.timestamp, s.dispositivo,
+               f.analisis_conjunto, f.comportamiento_global, f.uso_tiempo_global, f.texto,
+               snippet(analysis_summaries_fts, -1, '[', ']', '…', 12) AS fragmento,
+               f.rank AS puntaje
+        FROM analysis_summaries_fts f JOIN analysis_summaries s ON s.id = f.rowid
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY f.rank
+        LIMIT ?
+    """, parametros + [limite]).fetchall()
+    return [dict(fila) for fila in filas]
+
+def consultar_screenshots_de_batch(batch_id):
+    """Todas las screenshots de un lote, en orden cronológico."""
+    filas = _conexion_lectura().execute("""
+        SELECT s.id, s.timestamp, s.filepath, s.dispositivo
+        FROM batch_screenshots b JOIN screenshots s ON s.id = b.screenshot_id
+        WHERE b.batch_id = ?
+        ORDER BY s.timestamp, s.id
+    """, (batch_id,)).fetchall()
+    return [dict(fila) for fila in filas]
+
+def rutas_analizadas(filepaths):
+    """
+    De las rutas dadas, retorna las que ya pertenecen a un lote con un resumen válido
+    (los lotes cuyo resumen es un mensaje de error no cuentan como analizados).
+    """
+    analizadas = set()
+    for inicio in range(0, len(filepaths), 500): # Límite de parámetros por consulta
+        bloque = list(filepaths[inicio:inicio + 500])
+        marcadores = ",".join("?" * len(bloque))
+        filas = _conexion_lectura().execute(f"""
+            SELECT DISTINCT s.filepath
+            FROM screenshots s
+            JOIN batch_screenshots b ON b.screenshot_id = s.id
+            JOIN analysis_summaries a ON a.batch_id = b.batch_id
+            WHERE s.filepath IN ({marcadores}) AND a.summary IS NOT NULL AND a.summary NOT LIKE 'Error en el análisis de IA%'
+        """, bloque).fetchall()
+        analizadas.update(fila[0] for fila in filas)
+    return analizadas
+
+# --- Índice de capturas empaquetadas (tabla 'screenshot_archivo', ver almacenamiento_module) ---
+def ubicacion_archivada(filepath):
+    """
+    Retorna dónde quedó una captura que ya no está suelta en disco.
+    Returns:
+        dict: 'paquete', 'desplazamiento' y 'longitud' ('paquete' es None si la captura se eliminó),
+              o None si la captura nunca se archivó.
+    """
+    fila = _conexion_lectura().execute(
+        "SELECT paquete, desplazamiento, longitud FROM screenshot_archivo WHERE filepath = ?", (filepath,)
+    ).fetchone()
+    return dict(fila) if fila else None
+
+def capturas_de_paquete(paquete):
+    """Capturas guardadas en un paquete: lista de (filepath, desplazamiento, longitud) en orden."""
+    return _conexion_lectura().execute(
+        "SELECT filepath, desplazamiento, longitud FROM screenshot_archivo WHERE paquete = ? ORDER BY desplazamiento",
+        (paquete,),
+    ).fetchall()
+
+def registrar_archivadas(filas):
+    """
+    Registra la ubicación de capturas empaquetadas o eliminadas.
+    Args:
+        filas (list): (filepath, paquete, desplazamiento, longitud); paquete None para las eliminadas.
+    """
+    archivado = a_epoch(datetime.now())
+    valores = [tuple(fila) + (archivado,) for fila in filas]
+    obtener_escritor().ejecutar(lambda conexion: conexion.executemany("""
+        INSERT OR REPLACE INTO screenshot_archivo (filepath, paquete, desplazamiento, longitud, archivado)
+        VALUES (?, ?, ?, ?, ?)
+    """, valores))
+
+# --- Progreso del reprocesamiento (tabla 'replay_progreso') ---
+def ciclos_reprocesados(claves):
+    """Retorna las claves de ciclos ya completados en ejecuciones anteriores del reprocesamiento."""
+    completados = set()
+    claves = list(claves)
+    for inicio in range(0, len(claves), 500):
+        bloque = claves[inicio:inicio + 500]
+        marcadores = ",".join("?" * len(bloque))
+        filas = _conexion_lectura().execute(
+            f"SELECT clave FROM replay_progreso WHERE estado = 'completado' AND clave IN ({marcadores})", bloque
+        ).fetchall()
+        completados.update(fila[0] for fila in filas)
+    return completados
+
+def marcar_ciclo_reprocesado(clave, estado, batch_id=None):
+    """Registra el resultado de un ciclo reprocesado ('completado' o 'error')."""
+    actualizado = a_epoch(datetime.now())
+    try:
+        obtener_escritor().ejecutar(lambda conexion: conexion.execute(
+            "INSERT OR REPLACE INTO replay_progreso (clave, estado, batch_id, actualizado) VALUES (?, ?, ?, ?)",
+            (clave, estado, batch_id, actualizado),
+        ))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar el progreso del reprocesamiento: {e}")
+        return False
 
 # --- Configuración e Interacción con Firebase Realtime Database ---
 firebase_app = None # Variable global para la app de Firebase inicializada
@@ -96,6 +756,8 @@ def inicializar_firebase_db():
     global firebase_app # Usa la variable global
     if firebase_app: # Si ya está inicializada, no hacer nada
         return firebase_app
+    import firebase_admin # Importación diferida: el SDK solo se carga cuando el subidor necesita la red
+    from firebase_admin import credentials
 
     cred = None
     if FIREBASE_CREDENTIALS_PATH:
@@ -118,42 +780,250 @@ def inicializar_firebase_db():
         logger.error(f"Error al inicializar la aplicación de Firebase Admin: {e}", exc_info=True)
         return None
 
-def guardar_descripcion_firebase(screenshot_id, descripcion):
-    """Guarda la descripción de una screenshot en Firebase Realtime Database."""
-    firebase_app = inicializar_firebase_db() # Intenta inicializar Firebase si no lo está
-    if not firebase_app:
-        logger.error("No se pudo guardar la descripción en Firebase porque la inicialización falló.")
-        return False
+# --- Outbox durable para Firebase (tabla 'firebase_outbox' + subidor en segundo plano) ---
+NODO_DISPOSITIVO = re.sub(r"[.#$\[\]/]", "_", DISPOSITIVO) # Firebase no admite . # $ [ ] / en una clave
 
+def encolar_firebase(actualizaciones):
+    """
+    Registra escrituras para Firebase en la outbox local de SQLite. No hace ninguna llamada de red:
+    el SubidorFirebase las envía en segundo plano y sobreviven a reinicios y a la falta de conexión.
+    Args:
+        actualizaciones (dict): Ruta de Firebase -> valor (serializable a JSON).
+    Returns:
+        bool: True si quedaron guardadas en la outbox.
+    """
+    creado = a_epoch(datetime.now())
+    filas = [(ruta, json.dumps(valor, ensure_ascii=False), creado) for ruta, valor in actualizaciones.items()]
     try:
-        ref = db.reference(f'/screenshots_analisis/{DISPOSITIVO}/{screenshot_id}') # Ruta en Firebase incluyendo DISPOSITIVO
-        ref.child('descripcion_ia').set(descripcion) # Guarda la descripción bajo el nodo 'descripcion_ia'
-        ref.child('dispositivo').set(DISPOSITIVO) # Guarda el nombre del dispositivo
-        logger.info(f"Descripción de análisis para screenshot ID {screenshot_id}, dispositivo: {DISPOSITIVO} guardada en Firebase.")
+        obtener_escritor().ejecutar(
+            lambda conexion: conexion.executemany("INSERT INTO firebase_outbox (ruta, valor, creado) VALUES (?, ?, ?)", filas)
+        )
         return True
-    except Exception as e:
-        logger.error(f"Error al guardar descripción en Firebase para screenshot ID {screenshot_id}: {e}", exc_info=True)
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar en la outbox de Firebase: {e}")
         return False
 
-def guardar_resumen_firebase(resumen_global_ia):
-    """Guarda el resumen global del análisis en Firebase Realtime Database."""
-    firebase_app = inicializar_firebase_db() # Intenta inicializar Firebase si no lo está
-    if not firebase_app:
-        logger.error("No se pudo guardar el resumen global en Firebase porque la inicialización falló.")
-        return False
+def guardar_descripcion_firebase(screenshot_id, descripcion):
+    """Encola la descripción de una screenshot para Firebase Realtime Database (una sola actualización multi-ruta)."""
+    base = f'/screenshots_analisis/{NODO_DISPOSITIVO}/{screenshot_id}' # Ruta en Firebase incluyendo DISPOSITIVO
+    encolado = encolar_firebase({
+        f'{base}/descripcion_ia': descripcion, # Guarda la descripción bajo el nodo 'descripcion_ia'
+        f'{base}/dispositivo': DISPOSITIVO, # Guarda el nombre del dispositivo
+    })
+    if encolado:
+        logger.info(f"Descripción de análisis para screenshot ID {screenshot_id}, dispositivo: {DISPOSITIVO} encolada para Firebase.")
+    return encolado
 
-    try:
-        timestamp_str_firebase = datetime.now().strftime("%Y-%m-%d_%H:%M:%S") # Formato para Firebase (compatible con nodos)
-        ref = db.reference(f'/resumenes_globales/{DISPOSITIVO}/{timestamp_str_firebase}') # Ruta para resúmenes globales, incluyendo DISPOSITIVO y timestamp
-        ref.set({
+def _ruta_parcial_firebase(inicio):
+    return f'/resumenes_parciales/{NODO_DISPOSITIVO}/{inicio.strftime("%Y-%m-%d_%H:%M:%S")}' # Un nodo por ciclo en análisis
+
+def guardar_parcial_firebase(inicio, campos):
+    """Encola para Firebase los campos ya recibidos del resumen del ciclo que empezó en `inicio` (modo streaming)."""
+    return encolar_firebase({_ruta_parcial_firebase(inicio): dict(campos, dispositivo=DISPOSITIVO)})
+
+def guardar_resumen_firebase(resumen_global_ia, inicio_parcial=None, momento=None):
+    """
+    Encola el resumen global del análisis para Firebase Realtime Database.
+    Si se indica `inicio_parcial`, en el mismo envío se borra el nodo parcial de ese ciclo.
+    `momento` (el fin del ciclo) da la clave del nodo: los ciclos reprocesados a la vez no se pisan
+    y conservan la fecha de captura. Por defecto, ahora.
+    """
+    timestamp_str_firebase = (momento or datetime.now()).strftime("%Y-%m-%d_%H:%M:%S") # Formato para Firebase (compatible con nodos)
+    actualizaciones = {
+        f'/resumenes_globales/{NODO_DISPOSITIVO}/{timestamp_str_firebase}': { # Ruta para resúmenes globales, incluyendo DISPOSITIVO y timestamp
             'dispositivo': DISPOSITIVO, # Guarda el nombre del dispositivo en el resumen global
             'resumen': resumen_global_ia  # Guarda el resumen global IA bajo el nodo 'resumen'
-        })
-        logger.info(f"Resumen global de análisis guardado en Firebase para dispositivo: {DISPOSITIVO}.")
+        }
+    }
+    if inicio_parcial is not None:
+        actualizaciones[_ruta_parcial_firebase(inicio_parcial)] = None # None borra el nodo en update()
+    encolado = encolar_firebase(actualizaciones)
+    if encolado:
+        logger.info(f"Resumen global de análisis encolado para Firebase, dispositivo: {DISPOSITIVO}.")
+    return encolado
+
+def referencia_raiz_firebase():
+    """Inicializa Firebase (una vez) y retorna la referencia raíz, o None si la inicialización falla."""
+    if not inicializar_firebase_db():
+        return None
+    from firebase_admin import db
+    return db.reference('/')
+
+CODIGOS_RECHAZO_FIREBASE = ("INVALID_ARGUMENT", "OUT_OF_RANGE", "FAILED_PRECONDITION")
+
+def es_rechazo_firebase(error):
+    """
+    Indica si Firebase rechazó el contenido de un update() (clave no permitida, valor demasiado grande...):
+    reenviarlo no sirve. Los errores de red, cuota o credenciales no son rechazos y se reintentan.
+    """
+    if isinstance(error, (ValueError, TypeError)): # Validación del propio cliente antes de enviar
         return True
-    except Exception as e:
-        logger.error(f"Error al guardar resumen global en Firebase: {e}", exc_info=True)
-        return False
+    if getattr(error, "code", None) in CODIGOS_RECHAZO_FIREBASE: # firebase_admin.exceptions.FirebaseError
+        return True
+    return getattr(getattr(error, "http_response", None), "status_code", None) in (400, 413)
+
+class SubidorFirebase:
+    """
+    Vacía la outbox de Firebase desde un hilo en segundo plano.
+    En cada envío combina las entradas pendientes en un único update() multi-ruta (si una ruta
+    aparece varias veces, gana la última). Ante un fallo, reintenta con backoff exponencial;
+    las entradas solo se borran de la outbox después de un envío exitoso. Si Firebase rechaza el
+    contenido del envío, las rutas se envían de a una y las rechazadas pasan a 'firebase_rechazos',
+    para que una entrada inválida no bloquee al resto de la outbox.
+    """
+
+    def __init__(self, obtener_referencia=referencia_raiz_firebase, escritor=None, intervalo_segundos=10,
+                 max_por_envio=500, espera_maxima=600):
+        """
+        Args:
+            obtener_referencia (callable): Retorna un objeto con `update(dict)` (la referencia raíz de
+                Firebase, o un sustituto local/emulador en pruebas). Se llama una sola vez, en el hilo.
+            escritor (EscritorSQLite): Escritor de la base que contiene la outbox (se lee de su misma ruta).
+                None para el escritor compartido de DATABASE_PATH.
+            intervalo_segundos (float): Pausa entre envíos cuando no hay pendientes.
+            max_por_envio (int): Entradas máximas combinadas en un update().
+            espera_maxima (float): Tope del backoff entre reintentos.
+        """
+        self.obtener_referencia = obtener_referencia
+        self.escritor = escritor or obtener_escritor()
+        self.ruta_db = self.escritor.ruta_db
+        self.intervalo_segundos = intervalo_segundos
+        self.max_por_envio = max_por_envio
+        self.espera_maxima = espera_maxima
+        self.enviados = 0
+        self.fallos_consecutivos = 0
+        self._referencia = None
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="subidor_firebase", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def despertar(self):
+        """Pide un envío inmediato (sin esperar al intervalo)."""
+        self._despertar.set()
+
+    def pendientes(self):
+        conexion = sqlite3.connect(self.ruta_db)
+        try:
+            return conexion.execute("SELECT COUNT(*) FROM firebase_outbox").fetchone()[0]
+        finally:
+            conexion.close()
+
+    def vaciar(self):
+        """
+        Realiza un envío con las entradas pendientes más antiguas.
+        Returns:
+            int: Entradas enviadas (0 si no había pendientes o si el envío falló).
+        """
+        if self._referencia is None:
+            self._referencia = self.obtener_referencia() # Firebase se inicializa una sola vez, en este hilo
+            if self._referencia is None:
+                raise ConnectionError("No se pudo inicializar Firebase.")
+
+        conexion = sqlite3.connect(self.ruta_db)
+        try:
+            filas = conexion.execute(
+                "SELECT id, ruta, valor FROM firebase_outbox ORDER BY id LIMIT ?", (self.max_por_envio,)
+            ).fetchall()
+        finally:
+            conexion.close()
+        if not filas:
+            return 0
+
+        actualizacion, por_ruta = {}, {}
+        for fila in filas:
+            ruta = fila[1].lstrip('/')
+            actualizacion[ruta] = json.loads(fila[2]) # Coalescencia: la última escritura de cada ruta gana
+            por_ruta.setdefault(ruta, []).append(fila)
+        try:
+            with metricas_module.medir("escritura_firebase_segundos"):
+                self._referencia.update(actualizacion)
+        except Exception as e:
+            if not es_rechazo_firebase(e):
+                raise
+            logger.warning(f"Firebase rechazó el envío ({e}): se reenvían las {len(actualizacion)} rutas de a una.")
+            return self._vaciar_de_a_una(actualizacion, por_ruta)
+        self._confirmar(filas)
+        logger.info(f"Firebase: {len(filas)} entradas enviadas en un único update() ({len(actualizacion)} rutas).")
+        return len(filas)
+
+    def _vaciar_de_a_una(self, actualizacion, por_ruta):
+        """
+        Envía cada ruta en su propio update(): las aceptadas se borran de la outbox y las rechazadas
+        se mueven a 'firebase_rechazos'. Un error que no es un rechazo se propaga (backoff normal).
+        """
+        enviadas = 0
+        for ruta, valor in actualizacion.items():
+            filas = por_ruta[ruta]
+            try:
+                with metricas_module.medir("escritura_firebase_segundos"):
+                    self._referencia.update({ruta: valor})
+            except Exception as e:
+                if not es_rechazo_firebase(e):
+                    raise
+                self._rechazar(filas, e)
+                continue
+            self._confirmar(filas)
+            enviadas += len(filas)
+        return enviadas
+
+    def _confirmar(self, filas):
+        """Borra de la outbox las entradas ya escritas en Firebase."""
+        metricas_module.incrementar("bytes_enviados_total", sum(len(fila[2]) for fila in filas), destino="firebase")
+        metricas_module.incrementar("entradas_firebase_total", len(filas))
+        ids = [(fila[0],) for fila in filas]
+        self.escritor.ejecutar(lambda c: c.executemany("DELETE FROM firebase_outbox WHERE id = ?", ids))
+        self.enviados += len(filas)
+
+    def _rechazar(self, filas, error):
+        """Mueve a 'firebase_rechazos' las entradas que Firebase no acepta."""
+        rechazado = a_epoch(datetime.now())
+        ids = [(fila[0],) for fila in filas]
+        def operacion(conexion):
+            conexion.executemany("""
+                INSERT OR REPLACE INTO firebase_rechazos (id, ruta, valor, creado, rechazado, error)
+                SELECT id, ruta, valor, creado, ?, ? FROM firebase_outbox WHERE id = ?
+            """, [(rechazado, str(error)[:500], fila[0]) for fila in filas])
+            conexion.executemany("DELETE FROM firebase_outbox WHERE id = ?", ids)
+        self.escritor.ejecutar(operacion)
+        metricas_module.incrementar("entradas_firebase_rechazadas_total", len(filas))
+        logger.error(f"Firebase rechazó la ruta {filas[0][1]} ({error}): {len(filas)} entradas movidas a firebase_rechazos.")
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                enviados = self.vaciar()
+                self.fallos_consecutivos = 0
+                if enviados == self.max_por_envio:
+                    continue # Quedan más pendientes: seguir vaciando sin esperar
+                espera = self.intervalo_segundos
+            except Exception as e:
+                self.fallos_consecutivos += 1
+                metricas_module.incrementar("errores_total", etapa="firebase")
+                espera = random.uniform(0, min(self.espera_maxima, self.intervalo_segundos * (2 ** self.fallos_consecutivos)))
+                logger.warning(f"Error al enviar la outbox a Firebase ({e}). Reintento en {espera:.0f}s.")
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+_subidor_firebase = None
+
+def iniciar_subidor_firebase(obtener_referencia=referencia_raiz_firebase):
+    """Arranca (una vez) el SubidorFirebase compartido y lo retorna."""
+    global _subidor_firebase
+    if _subidor_firebase is None:
+        _subidor_firebase = SubidorFirebase(obtener_referencia, obtener_escritor(), FIREBASE_FLUSH_INTERVAL_SECONDS,
+                                            FIREBASE_MAX_BATCH, FIREBASE_BACKOFF_MAX_SECONDS)
+        _subidor_firebase.iniciar()
+    return _subidor_firebase
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+# dedup_module.py
+import logging
+
+import almacenamiento_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+METODOS_HASH = ("ahash", "dhash")
+
+
+def _a_escala_de_grises(fuente, ancho, alto):
+    """Abre la imagen (ruta, PIL.Image o Frame en memoria), la pasa a escala de grises y la reduce a ancho x alto."""
+    import numpy as np # Importaciones diferidas: solo se cargan al deduplicar el primer frame
+    from PIL import Image
+    if isinstance(fuente, str):
+        imagen = almacenamiento_module.abrir_imagen(fuente)
+    elif hasattr(fuente, "a_imagen"):
+        imagen = fuente.a_imagen()
+    else:
+        imagen = fuente
+    reducida = imagen.convert("L").resize((ancho, alto), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.asarray(reducida, dtype=np.int16)
+
+
+def calcular_hash(fuente, metodo="dhash", tamano=8):
+    """
+    Calcula un hash perceptual de la imagen.
+    Args:
+        fuente (str | PIL.Image.Image | screenshot_module.Frame): Ruta, imagen cargada o frame en memoria.
+        metodo (str): 'ahash' (promedio) o 'dhash' (diferencia horizontal).
+        tamano (int): Lado de la rejilla; el hash tiene tamano*tamano bits.
+    Returns:
+        int: El hash como entero.
+    """
+    if metodo == "ahash":
+        pixeles = _a_escala_de_grises(fuente, tamano, tamano)
+        bits = pixeles > pixeles.mean()
+    elif metodo == "dhash":
+        pixeles = _a_escala_de_grises(fuente, tamano + 1, tamano)
+        bits = pixeles[:, 1:] > pixeles[:, :-1]
+    else:
+        raise ValueError(f"Método de hash no soportado: {metodo}. Opciones: {METODOS_HASH}")
+    valor = 0
+    for bit in bits.flatten():
+        valor = (valor << 1) | int(bit)
+    return valor
+
+
+def distancia_hamming(hash_a, hash_b):
+    """Cantidad de bits distintos entre dos hashes."""
+    return (hash_a ^ hash_b).bit_count()
+
+
+class DeduplicadorFrames:
+    """
+    Colapsa frames casi idénticos a medida que se capturan.
+    Un frame se descarta si su hash está a una distancia de Hamming <= umbral del último frame
+    conservado; en ese caso se extiende el tiempo en pantalla del frame conservado.
+    """
+
+    def __init__(self, umbral=5, metodo="dhash"):
+        self.umbral = umbral
+        self.metodo = metodo
+        self.frames = [] # Frames conservados: dicts con 'fuente', 'hash', 'inicio', 'ultimo', 'repeticiones'
+        self.total = 0
+
+    def agregar(self, fuente, timestamp):
+        """
+        Procesa un frame nuevo.
+        Args:
+            fuente: Ruta o imagen del frame.
+            timestamp (datetime): Momento de la captura.
+        Returns:
+            bool: True si el frame se conservó, False si se colapsó con el anterior.
+        """
+        self.total += 1
+        try:
+            hash_frame = calcular_hash(fuente, self.metodo)
+        except Exception as e:
+            logger.error(f"Error al calcular el hash perceptual de {fuente}: {e}")
+            hash_frame = None
+
+        if self.frames and hash_frame is not None:
+            ultimo = self.frames[-1]
+            if ultimo["hash"] is not None and distancia_hamming(ultimo["hash"], hash_frame) <= self.umbral:
+                ultimo["ultimo"] = timestamp
+                ultimo["repeticiones"] += 1
+                return False
+
+        self.frames.append({
+            "fuente": fuente,
+            "hash": hash_frame,
+            "inicio": timestamp,
+            "ultimo": timestamp,
+            "repeticiones": 1,
+        })
+        return True
+
+    def frames_unicos(self, fin=None):
+        """
+        Retorna los frames conservados con su tiempo en pantalla.
+        Cada frame permanece en pantalla desde su primera captura hasta la primera captura del
+        siguiente frame distinto (o hasta `fin` para el último).
+        Args:
+            fin (datetime): Fin del intervalo capturado. Por defecto, la última captura.
+        Returns:
+            list: Lista de dicts con 'fuente', 'hash', 'inicio', 'repeticiones' y 'duracion_segundos'.
+        """
+        resultado = []
+        for indice, frame in enumerate(self.frames):
+            if indice + 1 < len(self.frames):
+                hasta = self.frames[indice + 1]["inicio"]
+            else:
+                hasta = fin or frame["ultimo"]
+            resultado.append({
+                "fuente": frame["fuente"],
+                "hash": frame["hash"],
+                "inicio": frame["inicio"],
+                "repeticiones": frame["repeticiones"],
+                "duracion_segundos": max(0.0, (hasta - frame["inicio"]).total_seconds()),
+            })
+        return resultado
+
+
+def deduplicar_frames(rutas, timestamps, umbral=5, metodo="dhash"):
+    """
+    Versión por lotes de DeduplicadorFrames.
+    Args:
+        rutas (list): Rutas de las capturas, en orden cronológico.
+        timestamps (list): datetime de cada captura.
+    Returns:
+        list: Frames conservados con su tiempo en pantalla (ver DeduplicadorFrames.frames_unicos).
+    """
+    deduplicador = DeduplicadorFrames(umbral, metodo)
+    for ruta, timestamp in zip(rutas, timestamps):
+        deduplicador.agregar(ruta, timestamp)
+    return deduplicador.frames_unicos()
@@ -1,14 +1,33 @@
 # email_module.py
+import logging
+import random
 import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime
 from email.mime.text import MIMEText
+import metricas_module
 from config import EMAIL_SENDER, EMAIL_RECEIVER, EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT, EMAIL_SMTP_USERNAME, EMAIL_SMTP_PASSWORD
+from config import (EMAIL_SMTP_STARTTLS, EMAIL_KEEPALIVE_SECONDS, EMAIL_RETRY_QUEUE_SIZE, EMAIL_MAX_RETRIES,
+                    EMAIL_DIGEST_ENABLED, EMAIL_DIGEST_WINDOW_SECONDS, EMAIL_DIGEST_MAX_SUMMARIES)
 
-def enviar_email(resumen_texto):
-    """Envía un correo electrónico con el resumen del análisis."""
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+ASUNTO = 'Resumen de Actividad del Usuario - Análisis de Pantalla'
+
+
+def construir_mensaje(resumen_texto, asunto=ASUNTO):
+    """Construye el mensaje MIME con el resumen del análisis."""
     msg = MIMEText(resumen_texto, 'plain')
-    msg['Subject'] = 'Resumen de Actividad del Usuario - Análisis de Pantalla'
+    msg['Subject'] = asunto
     msg['From'] = EMAIL_SENDER
     msg['To'] = EMAIL_RECEIVER
+    return msg
+
+def enviar_email(resumen_texto):
+    """Envía un correo electrónico con el resumen del análisis."""
+    msg = construir_mensaje(resumen_texto)
 
     server = None  # Inicializar server fuera del bloque try
     try:
@@ -16,15 +35,228 @@ def enviar_email(resumen_texto):
         server.starttls()
         server.login(EMAIL_SMTP_USERNAME, EMAIL_SMTP_PASSWORD)
         server.sendmail(EMAIL_SENDER, EMAIL_RECEIVER, msg.as_string())
-        print("Correo electrónico enviado correctamente!")
+        logger.info("Correo electrónico enviado correctamente!")
     except Exception as e:
-        print(f"Error al enviar correo electrónico: {e}")
+        logger.error(f"Error al enviar correo electrónico: {e}")
     finally:
         try: # Añadimos un try-except al intentar cerrar la conexión
             if server: # Verificamos si el servidor se inicializó antes de intentar cerrarlo
                 server.quit()
         except Exception as e_quit:
-            print(f"Error al cerrar la conexión SMTP (quit): {e_quit}")
+            logger.warning(f"Error al cerrar la conexión SMTP (quit): {e_quit}")
+
+
+class RemitenteSMTP:
+    """
+    Envía correos desde un hilo en segundo plano manteniendo una única conexión SMTP autenticada.
+    La conexión se mantiene viva con NOOP mientras está inactiva y se reabre si el servidor la cierra.
+    Los mensajes pendientes esperan en una cola acotada; los que fallan se reintentan con backoff.
+    """
+
+    def __init__(self, servidor=EMAIL_SMTP_SERVER, puerto=EMAIL_SMTP_PORT, usuario=EMAIL_SMTP_USERNAME,
+                 contrasena=EMAIL_SMTP_PASSWORD, starttls=EMAIL_SMTP_STARTTLS, keepalive_segundos=EMAIL_KEEPALIVE_SECONDS,
+                 capacidad=EMAIL_RETRY_QUEUE_SIZE, max_reintentos=EMAIL_MAX_RETRIES):
+        self.servidor = servidor
+        self.puerto = int(puerto or 587)
+        self.usuario = usuario
+        self.contrasena = contrasena
+        self.starttls = starttls
+        self.keepalive_segundos = keepalive_segundos
+        self.max_reintentos = max_reintentos
+        self.enviados = 0
+        self.descartados = 0
+        self._cola = deque() # (mensaje, intentos, próximo intento)
+        self.capacidad = capacidad
+        self._condicion = threading.Condition()
+        self._conexion = None
+        self._ultimo_uso = 0.0
+        self._detener = False
+        self._hilo = threading.Thread(target=self._bucle, name="remitente_smtp", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, mensaje):
+        """
+        Encola un mensaje (MIMEText) para enviarlo en segundo plano. Nunca bloquea.
+        Si la cola está llena, se descarta el mensaje más antiguo.
+        """
+        with self._condicion:
+            if len(self._cola) >= self.capacidad:
+                self._cola.popleft()
+                self.descartados += 1
+                metricas_module.incrementar("emails_descartados_total")
+                logger.warning(f"Cola de correo llena ({self.capacidad}): se descartó el mensaje más antiguo.")
+            self._cola.append((mensaje, 0, 0.0))
+            self._condicion.notify()
+
+    def pendientes(self):
+        with self._condicion:
+            return len(self._cola)
+
+    def detener(self, timeout=None):
+        """Termina el hilo tras intentar enviar lo pendiente y cierra la conexión."""
+        with self._condicion:
+            self._detener = True
+            self._condicion.notify()
+        self._hilo.join(timeout)
+
+    def _conectar(self):
+        conexion = smtplib.SMTP(self.servidor, self.puerto, timeout=30)
+        if self.starttls:
+            conexion.starttls()
+        if self.usuario:
+            conexion.login(self.usuario, self.contrasena)
+        logger.info(f"Conexión SMTP abierta con {self.servidor}:{self.puerto}.")
+        return conexion
+
+    def _cerrar_conexion(self):
+        if self._conexion is not None:
+            try:
+                self._conexion.quit()
+            except Exception:
+                pass
+            self._conexion = None
+
+    def _conexion_viva(self):
+        """Retorna una conexión utilizable, verificándola con NOOP si estuvo inactiva."""
+        if self._conexion is not None and time.monotonic() - self._ultimo_uso >= self.keepalive_segundos:
+            try:
+                if self._conexion.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP rechazado")
+            except (smtplib.SMTPException, OSError):
+                self._conexion = None # El servidor cerró la conexión: se reabre abajo
+        if self._conexion is None:
+            self._conexion = self._conectar()
+        self._ultimo_uso = time.monotonic()
+        return self._conexion
+
+    def _enviar(self, mensaje):
+        texto = mensaje.as_string()
+        with metricas_module.medir("envio_email_segundos"):
+            try:
+                self._conexion_viva().sendmail(mensaje['From'], mensaje['To'], texto)
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                    raise # Rechazo del servidor (SMTPException hereda de OSError): lo reintenta _bucle con backoff
+                self._conexion = None
+                self._conexion_viva().sendmail(mensaje['From'], mensaje['To'], texto) # Un reintento inmediato con conexión nueva
+        self._ultimo_uso = time.monotonic()
+        metricas_module.incrementar("bytes_enviados_total", len(texto.encode("utf-8")), destino="email")
+
+    def _bucle(self):
+        while True:
+            tarea = None
+            with self._condicion:
+                if self._detener and not self._cola:
+                    break
+                if self._cola and (self._detener or self._cola[0][2] <= time.monotonic()):
+                    tarea = self._cola.popleft()
+                else:
+                    espera = self.keepalive_segundos
+                    if self._cola:
+                        espera = min(espera, self._cola[0][2] - time.monotonic())
+                    notificado = self._condicion.wait(max(0.0, espera))
+                    if notificado or self._cola or self._conexion is None:
+                        continue
+
+            if tarea is None:
+                try:
+                    self._conexion_viva() # Inactivo: keepalive (NOOP) para no perder la sesión autenticada
+                except Exception as e:
+                    logger.warning(f"Keepalive SMTP fallido: {e}")
+                    self._conexion = None
+                continue
+
+            mensaje, intentos, _ = tarea
+            try:
+                self._enviar(mensaje)
+                self.enviados += 1
+                metricas_module.incrementar("emails_enviados_total")
+                logger.info("Correo electrónico enviado correctamente.")
+            except Exception as e:
+                self._cerrar_conexion()
+                metricas_module.incrementar("errores_total", etapa="email")
+                if intentos + 1 > self.max_reintentos or self._detener:
+                    self.descartados += 1
+                    metricas_module.incrementar("emails_descartados_total")
+                    logger.error(f"Error al enviar correo electrónico; se descarta tras {intentos + 1} intentos: {e}")
+                else:
+                    espera = random.uniform(0, min(300, 5 * (2 ** intentos)))
+                    logger.warning(f"Error al enviar correo electrónico ({e}). Reintento en {espera:.0f}s.")
+                    with self._condicion:
+                        self._cola.appendleft((mensaje, intentos + 1, time.monotonic() + espera))
+        self._cerrar_conexion()
+
+
+class DigestEmail:
+    """
+    Agrupa los resúmenes de varios ciclos en un solo correo.
+    El digest se envía al juntar `max_resumenes` resúmenes o al cumplirse `ventana_segundos`
+    desde el primer resumen pendiente, lo que ocurra primero.
+    """
+
+    def __init__(self, remitente, ventana_segundos=EMAIL_DIGEST_WINDOW_SECONDS, max_resumenes=EMAIL_DIGEST_MAX_SUMMARIES):
+        self.remitente = remitente
+        self.ventana_segundos = ventana_segundos
+        self.max_resumenes = max_resumenes
+        self._resumenes = [] # (datetime, texto)
+        self._lock = threading.Lock()
+        self._temporizador = None
+
+    def agregar(self, resumen_texto):
+        """Agrega el resumen de un ciclo al digest pendiente."""
+        with self._lock:
+            self._resumenes.append((datetime.now(), resumen_texto))
+            if len(self._resumenes) == 1:
+                self._temporizador = threading.Timer(self.ventana_segundos, self.vaciar)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+            completo = len(self._resumenes) >= self.max_resumenes
+        if completo:
+            self.vaciar()
+
+    def vaciar(self):
+        """Envía (encola) el digest con los resúmenes pendientes, si hay alguno."""
+        with self._lock:
+            resumenes, self._resumenes = self._resumenes, []
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+        if not resumenes:
+            return
+        inicio, fin = resumenes[0][0], resumenes[-1][0]
+        partes = [f"Digest de {len(resumenes)} análisis entre {inicio.strftime('%Y-%m-%d %H:%M:%S')} y {fin.strftime('%Y-%m-%d %H:%M:%S')}.\n"]
+        for momento, texto in resumenes:
+            partes.append(f"=== {momento.strftime('%Y-%m-%d %H:%M:%S')} ===\n{texto}\n")
+        asunto = f"{ASUNTO} ({len(resumenes)} ciclos)"
+        self.remitente.encolar(construir_mensaje("\n".join(partes), asunto))
+
+
+_remitente = None
+_digest = None
+_lock_global = threading.Lock()
+
+def obtener_remitente():
+    """Retorna el RemitenteSMTP compartido (una conexión SMTP para todo el proceso)."""
+    global _remitente
+    with _lock_global:
+        if _remitente is None:
+            _remitente = RemitenteSMTP()
+        return _remitente
+
+def encolar_email(resumen_texto):
+    """
+    Encola el resumen de un ciclo para su envío en segundo plano, sin bloquear el ciclo de análisis.
+    Con EMAIL_DIGEST_ENABLED, el resumen se acumula en el digest en lugar de enviarse solo.
+    """
+    global _digest
+    remitente = obtener_remitente()
+    if EMAIL_DIGEST_ENABLED:
+        with _lock_global:
+            if _digest is None:
+                _digest = DigestEmail(remitente)
+        _digest.agregar(resumen_texto)
+    else:
+        remitente.encolar(construir_mensaje(resumen_texto))
 
 if __name__ == '__main__':
-    enviar_email()
\ No newline at end of file
+    enviar_email()
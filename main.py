@@ -1,10 +1,10 @@
 # main.py
+import argparse
 import time
 import schedule
 from datetime import datetime
 import logging
 import os
-import platform
 
 # Modulos propios
 import screenshot_module # CORREGIDO: Importar screenshot_module en lugar de screenshot
@@ -12,144 +12,415 @@ import ai_analysis_module # Asegúrate de tener este modulo (aunque sea un place
 import database_module
 import email_module
 import summary_module # NUEVO: Importar summary_module
+import pipeline_module
+import dedup_module
+import preprocess_module
+import metricas_module
+import replay_module
+import almacenamiento_module
+import colector_module
 from config import ANALYSIS_INTERVAL_SECONDS, DISPOSITIVO,SCREENSHOTS_DIR # Importar DISPOSITIVO desde config
+from config import REPLAY_NOTIFY, STORAGE_MANAGER_ENABLED, COLLECTOR_URL
+from config import CAPTURE_INTERVAL_SECONDS, PIPELINE_MODE, PIPELINE_QUEUE_SIZE, PIPELINE_BACKPRESSURE, PIPELINE_MAX_MERGED_FRAMES
+from config import (CAPTURE_ADAPTIVE, CAPTURE_MIN_INTERVAL_SECONDS, CAPTURE_MAX_INTERVAL_SECONDS, CAPTURE_CHANGE_THRESHOLD,
+                    CAPTURE_STATIC_THRESHOLD, CAPTURE_BACKOFF_FACTOR)
+from config import DEDUP_ENABLED, DEDUP_HASH_METHOD, DEDUP_HAMMING_THRESHOLD, CAPTURE_PERSIST, AI_ANALYSIS_MODE, AI_STREAMING
+from config import (PREPROCESS_ENABLED, PREPROCESS_MAX_PIXELS, PREPROCESS_REQUEST_MAX_PIXELS, PREPROCESS_REQUEST_MAX_BYTES,
+                    PREPROCESS_GRAYSCALE, PREPROCESS_FORMAT, PREPROCESS_QUALITY, PREPROCESS_CROP, PREPROCESS_WORKERS)
 
 # --- Configuración de logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+MODO_JERARQUICO = AI_ANALYSIS_MODE == "jerarquico" # Frames a disco durante la captura y análisis por bloques con memoria acotada
 
-def ejecutar_analisis_completo():
+
+def capturar_lote(fin_monotonico=None, detener=None):
     """
-    Ejecuta el proceso completo de análisis:
-    1. Captura screenshots.
-    2. Realiza análisis con IA (módulo ai_analysis_module).
-    3. Guarda resultados en base de datos SQLite y Firebase.
-    4. Genera resumen y envia email (opcional).
+    Captura screenshots hasta el instante `fin_monotonico` (reloj monotónico).
+    Las capturas individuales se programan cada CAPTURE_INTERVAL_SECONDS (o con la pausa que decida
+    el muestreador adaptativo) desde la captura anterior programada, de modo que una captura lenta
+    no desplaza a las siguientes.
+    Args:
+        fin_monotonico (float): Instante de fin del lote según time.monotonic().
+                                Por defecto, ahora + ANALYSIS_INTERVAL_SECONDS.
+        detener (threading.Event): Evento opcional para cortar la captura antes de tiempo.
+    Returns:
+        dict: Lote con las claves 'frames' (capturas distintas en memoria, con su tiempo en pantalla),
+              'rutas' (rutas de esas capturas), 'inicio' y 'fin', o None si no hubo capturas.
     """
-    inicio_captura = datetime.now()
-    logger.info(f"[{DISPOSITIVO}] Iniciando análisis completo a las {inicio_captura.strftime('%Y-%m-%d %H:%M:%S')}") # Incluir DISPOSITIVO en logs
+    inicio_lote = datetime.now()
+    inicio_monotonico = time.monotonic()
+    if fin_monotonico is None:
+        fin_monotonico = inicio_monotonico + int(ANALYSIS_INTERVAL_SECONDS)
 
-    # 1. Captura de screenshots (multiples capturas en un intervalo)
-    tiempo_inicio_intervalo = time.time()
-    rutas_screenshots = []
-    while time.time() - tiempo_inicio_intervalo < int(ANALYSIS_INTERVAL_SECONDS):
-        filepath_screenshot = capturar_pantalla()
-        if filepath_screenshot:
-            rutas_screenshots.append(filepath_screenshot)
-        time.sleep(2) # Pausa breve entre capturas individuales
-
-    if not rutas_screenshots:
-        logger.warning(f"[{DISPOSITIVO}] No se pudieron capturar screenshots. Abortando análisis.") # Incluir DISPOSITIVO en logs
-        return
+    total_capturas = 0
+    frames_sin_dedup = []
+    preprocesados = {} # id(frame) -> Future del preprocesamiento, lanzado en cuanto se conserva el frame
+    deduplicador = dedup_module.DeduplicadorFrames(DEDUP_HAMMING_THRESHOLD, DEDUP_HASH_METHOD) if DEDUP_ENABLED else None
+    muestreador = obtener_muestreador()
+    proxima_captura = inicio_monotonico
+    while proxima_captura < fin_monotonico and not (detener and detener.is_set()):
+        frame = capturar_pantalla()
+        if frame:
+            total_capturas += 1
+            if deduplicador:
+                conservado = deduplicador.agregar(frame, frame.timestamp) # Los frames repetidos se liberan aquí
+            else:
+                conservado = True
+                frames_sin_dedup.append(frame)
+            metricas_module.incrementar("frames_conservados_total" if conservado else "frames_descartados_total")
+            if conservado and (CAPTURE_PERSIST or MODO_JERARQUICO):
+                ruta = obtener_escritor_frames().guardar(frame, ruta_prevista(frame)) # Escritura a disco en segundo plano
+                if ruta and MODO_JERARQUICO:
+                    # Memoria acotada: el lote guarda solo la ruta y el análisis relee los frames por bloques
+                    if deduplicador:
+                        deduplicador.frames[-1]["fuente"] = ruta
+                    else:
+                        frames_sin_dedup[-1] = ruta
+            if conservado and PREPROCESS_ENABLED and AI_ANALYSIS_MODE not in ("mosaico", "jerarquico"):
+                preprocesados[id(frame)] = obtener_preprocesador().enviar(frame) # Se solapa con las siguientes capturas
+        intervalo = CAPTURE_INTERVAL_SECONDS
+        if muestreador and frame:
+            intervalo = muestreador.siguiente_intervalo(frame) # Más rápido si la pantalla cambia, más lento si está estática
+        proxima_captura += intervalo
+        ahora = time.monotonic()
+        if proxima_captura < ahora: # La captura se atrasó: saltar al siguiente instante programado
+            proxima_captura += ((ahora - proxima_captura) // intervalo + 1) * intervalo
+        espera = min(proxima_captura, fin_monotonico) - time.monotonic()
+        if espera > 0:
+            if detener:
+                detener.wait(espera)
+            else:
+                time.sleep(espera)
 
-    logger.info(f"[{DISPOSITIVO}] Captura de {len(rutas_screenshots)} screenshots realizada.") # Incluir DISPOSITIVO en logs
+    if not total_capturas:
+        logger.warning(f"[{DISPOSITIVO}] No se pudieron capturar screenshots en el lote.") # Incluir DISPOSITIVO en logs
+        return None
 
-    # 2. Análisis de las screenshots con IA (usando ai_analysis_module)
+    fin_lote = datetime.now()
+    if deduplicador:
+        frames = [
+            {"frame": f["fuente"], "ruta": ruta_de(f["fuente"]), "inicio": f["inicio"],
+             "duracion_segundos": f["duracion_segundos"], "repeticiones": f["repeticiones"]}
+            for f in deduplicador.frames_unicos(fin_lote)
+        ]
+    else:
+        frames = [
+            {"frame": f, "ruta": ruta_de(f), "inicio": momento_de(f), "duracion_segundos": None, "repeticiones": 1}
+            for f in frames_sin_dedup
+        ]
+    for frame in frames:
+        frame["preprocesado"] = preprocesados.get(id(frame["frame"]))
+
+    logger.info(f"[{DISPOSITIVO}] Captura de {total_capturas} screenshots realizada ({len(frames)} distintas).") # Incluir DISPOSITIVO en logs
+    return {"rutas": [f["ruta"] for f in frames], "frames": frames, "inicio": inicio_lote, "fin": fin_lote}
+
+
+def analizar_lote(lote):
+    """Etapa 2: analiza con IA las screenshots distintas del lote y agrega 'resumen' al lote."""
+    frames = lote["frames"]
+    campos = {}
     try:
-        resumen_global_ia = ai_analysis_module.analizar_conjunto_screenshots(rutas_screenshots) # Analizar el conjunto de rutas
+        imagenes = preparar_imagenes(frames)
+        if AI_ANALYSIS_MODE == "por_frame":
+            funcion_analisis = ai_analysis_module.analizar_por_frame_y_agregar # Frames en paralelo + agregación
+        elif MODO_JERARQUICO:
+            funcion_analisis = lambda imagenes, duraciones, al_campo: ai_analysis_module.analizar_por_bloques(
+                iterar_elementos(frames), preparar=preparar_bloque if PREPROCESS_ENABLED else None, al_campo=al_campo) # Bloques + reducción
+        elif AI_ANALYSIS_MODE == "mosaico":
+            funcion_analisis = lambda imagenes, duraciones, al_campo: ai_analysis_module.analizar_hojas_contacto(
+                imagenes, duraciones, [frame["inicio"] for frame in frames], al_campo) # Pocas hojas de contacto en lugar de N imágenes
+        else:
+            funcion_analisis = ai_analysis_module.analizar_conjunto_screenshots
+        resumen_global_ia = funcion_analisis(
+            imagenes,
+            duraciones=[frame["duracion_segundos"] for frame in frames],
+            al_campo=publicar_campo(lote, campos),
+        ) # Analizar solo los frames distintos, con su tiempo en pantalla
         logger.info(f"[{DISPOSITIVO}] Análisis de IA completado. Resumen: {resumen_global_ia}") # Incluir DISPOSITIVO en logs
+        cache = ai_analysis_module.obtener_cache()
+        if cache:
+            logger.info(f"[{DISPOSITIVO}] Caché de IA: {cache.estadisticas()}") # Aciertos/fallos acumulados
     except Exception as e:
         logger.error(f"[{DISPOSITIVO}] Error durante el análisis de IA: {e}", exc_info=True) # Incluir DISPOSITIVO en logs
         resumen_global_ia = "Error en el análisis de IA." # Resumen de error en caso de fallo
+    for frame in frames:
+        frame.pop("frame", None) # Liberar los buffers de píxeles: las etapas siguientes no los necesitan
+        frame.pop("preprocesado", None)
+    lote["resumen"] = resumen_global_ia
+    lote["campos"] = campos if campos and not ai_analysis_module.es_resumen_error(resumen_global_ia) else None
+    return lote
+
+
+def publicar_campo(lote, campos):
+    """
+    Retorna el callback que recibe cada campo del resumen apenas el modelo lo completa. Junta los campos
+    en `campos` (se guardan como columnas sin volver a parsear la respuesta) y, en modo streaming, los
+    publica de inmediato en SQLite (resumenes_parciales) y en Firebase, antes de que termine la respuesta.
+    Si la respuesta se reintenta desde el principio (clave None), descarta los campos ya recibidos.
+    """
+    def al_campo(clave, valor):
+        if clave is None:
+            campos.clear()
+            if AI_STREAMING:
+                database_module.descartar_campos_parciales(lote["inicio"])
+            return
+        campos[clave] = valor
+        if AI_STREAMING:
+            database_module.guardar_campo_parcial(lote["inicio"], clave, valor)
+            database_module.guardar_parcial_firebase(lote["inicio"], campos)
+            logger.info(f"[{DISPOSITIVO}] Campo '{clave}' del resumen recibido.") # Incluir DISPOSITIVO en logs
+    return al_campo
+
+
+def preparar_imagenes(frames):
+    """
+    Obtiene las imágenes a enviar al modelo: los frames preprocesados (ajustados al presupuesto
+    de la solicitud) o, si el preprocesamiento está desactivado, los frames originales.
+    Registra en cada frame los bytes antes y después del preprocesamiento.
+    """
+    if MODO_JERARQUICO:
+        obtener_escritor_frames().esperar() # Los bloques se leen de disco: los frames deben estar escritos
+        return None
+    if not PREPROCESS_ENABLED or AI_ANALYSIS_MODE == "mosaico": # El mosaico reduce los frames originales por su cuenta
+        return [frame["frame"] for frame in frames]
+
+    preprocesador = obtener_preprocesador()
+    resultados = []
+    for frame in frames:
+        futuro = frame.get("preprocesado")
+        resultados.append(futuro.result() if futuro else preprocesador.preprocesar(frame["frame"]))
+    preprocesador.ajustar_a_presupuesto(resultados)
+
+    for frame, resultado in zip(frames, resultados):
+        frame["bytes_originales"] = resultado["bytes_originales"]
+        frame["bytes_finales"] = resultado["bytes_finales"]
+        logger.info(f"[{DISPOSITIVO}] Frame {os.path.basename(frame['ruta'] or '') or frame['inicio'].strftime('%H:%M:%S')}: {resultado['bytes_originales']} -> {resultado['bytes_finales']} bytes ({resultado['ancho']}x{resultado['alto']}, calidad {resultado['calidad']})")
+    total_original = sum(r["bytes_originales"] for r in resultados)
+    total_final = sum(r["bytes_finales"] for r in resultados)
+    logger.info(f"[{DISPOSITIVO}] Preprocesamiento: {total_original} -> {total_final} bytes en {len(resultados)} frames.") # Incluir DISPOSITIVO en logs
+    return resultados
+
 
-    # 3. Guardar resultados en base de datos (SQLite y Firebase)
-    screenshot_ids_sqlite = [] # Para guardar los IDs de SQLite y relacionar con Firebase si es necesario
-
-    for filepath in rutas_screenshots:
-        screenshot_id_sqlite = database_module.guardar_screenshot_db(filepath) # Guardar en SQLite y obtener ID
-        if screenshot_id_sqlite:
-            screenshot_ids_sqlite.append(screenshot_id_sqlite)
-             # --- Guardar DESCRIPCIÓN (individual por screenshot) en Firebase (OPCIONAL - por ahora no tenemos descripciones individuales) ---
-             # Por ahora no tenemos descripciones individuales generadas por la IA para cada screenshot
-             # Si ai_analysis_module devolviera descripciones individuales, aquí las guardaríamos en Firebase
-             # Ejemplo (hipotético):
-             # descripcion_ia_screenshot = ai_analysis_module.analizar_screenshot_individual(filepath)
-             # if descripcion_ia_screenshot:
-             #     database_module.guardar_descripcion_firebase(screenshot_id_sqlite, descripcion_ia_screenshot)
-
-    # Guardar RESUMEN GLOBAL (del conjunto de screenshots) en SQLite y Firebase
-    if screenshot_ids_sqlite: # Solo guardar resumen si hay screenshots asociadas
-        # --- Guardar RESUMEN GLOBAL en SQLite ---
-        # NOTA IMPORTANTE:  En la version anterior, guardabas un resumen POR CADA screenshot en SQLite
-        #                   Ahora, parece que quieres guardar UN RESUMEN GLOBAL por cada ejecución de `ejecutar_analisis_completo`
-        #                   He comentado la linea antigua y he dejado la linea para guardar el resumen global.
-        #                   Si querias el comportamiento antiguo (resumen por screenshot),  habria que ajustarlo.
-        # resumen_guardado_sqlite = database_module.guardar_resumen_analisis_db(screenshot_id_sqlite, resumen_global_ia) # ANTERIOR:  Asociado a la ULTIMA screenshot (incorrecto)
-        # --- Guardar RESUMEN GLOBAL en SQLite (NUEVO -  Asociado a TODAS las screenshots del intervalo, usando el ID de la primera screenshot) ---
-        resumen_guardado_sqlite = database_module.guardar_resumen_analisis_db(screenshot_ids_sqlite[0] if screenshot_ids_sqlite else None, resumen_global_ia) # NUEVO: Asociado al PRIMER screenshot del lote (o None si no hay screenshots)
-
-
-        if resumen_guardado_sqlite:
-            logger.info(f"[{DISPOSITIVO}] Resumen global guardado en SQLite para screenshots con IDs (primer ID): {screenshot_ids_sqlite[0] if screenshot_ids_sqlite else 'Ninguno'}") # Incluir DISPOSITIVO en logs
+def iterar_elementos(frames):
+    """Genera los frames del lote para analizar_por_bloques, sin cargar sus píxeles."""
+    for frame in frames:
+        yield {"fuente": frame["frame"], "inicio": frame["inicio"], "duracion_segundos": frame["duracion_segundos"]}
+
+
+def preparar_bloque(fuentes):
+    """Preprocesa un bloque del modo jerárquico, ajustándolo al presupuesto de una solicitud."""
+    preprocesador = obtener_preprocesador()
+    return preprocesador.ajustar_a_presupuesto([preprocesador.preprocesar(fuente) for fuente in fuentes])
+
+
+def guardar_lote(lote):
+    """Etapa 3: guarda las screenshots y el resumen global del lote en SQLite y Firebase."""
+    resumen_global_ia = lote["resumen"]
+
+    # Screenshots, lote y resumen global en una sola transacción. Solo se registran los frames escritos a disco:
+    # con CAPTURE_PERSIST=false, si el escritor descartó el frame (cola llena) o si la escritura falló, no hay archivo.
+    if _escritor_frames is not None:
+        _escritor_frames.esperar() # Los frames del lote pueden estar todavía en la cola de escritura
+    persistidos = []
+    for frame in lote["frames"]:
+        frame["ruta"] = ruta_de(frame["frame"]) # Frame: el escritor asigna la ruta solo tras escribirlo
+        if frame["ruta"] and os.path.exists(frame["ruta"]):
+            persistidos.append(frame)
         else:
-            logger.warning(f"[{DISPOSITIVO}] Error al guardar resumen global en SQLite.") # Incluir DISPOSITIVO en logs
+            frame["ruta"] = None
+    lote["rutas"] = [frame["ruta"] for frame in lote["frames"]]
+    resultado_sqlite = database_module.guardar_batch_db(
+        [frame["ruta"] for frame in persistidos], [frame["inicio"] for frame in persistidos],
+        resumen_global_ia, lote["inicio"], lote["fin"], lote.get("campos"),
+    )
+    screenshot_ids_sqlite = resultado_sqlite["screenshot_ids"] if resultado_sqlite else []
 
+    if resultado_sqlite:
+        logger.info(f"[{DISPOSITIVO}] Resumen global guardado en SQLite para el lote {resultado_sqlite['batch_id']} ({len(screenshot_ids_sqlite)} screenshots)") # Incluir DISPOSITIVO en logs
+    else:
+        logger.warning(f"[{DISPOSITIVO}] Error al guardar el lote y su resumen global en SQLite.") # Incluir DISPOSITIVO en logs
+
+    # Guardar RESUMEN GLOBAL (del conjunto de screenshots) en Firebase
+    if resultado_sqlite: # El resumen se sube aunque el lote no tenga frames en disco
         # --- Guardar RESUMEN GLOBAL en Firebase ---
-        resumen_guardado_firebase = database_module.guardar_resumen_firebase(resumen_global_ia)
+        # (solo se encola en la outbox local: el subidor en segundo plano lo envía, el ciclo no espera a la red)
+        resumen_guardado_firebase = database_module.guardar_resumen_firebase(
+            resumen_global_ia, lote["inicio"] if AI_STREAMING else None, # El resumen completo reemplaza al parcial
+            lote["fin"]) # Fecha de captura del ciclo (también al reprocesar)
         if resumen_guardado_firebase:
-            logger.info(f"[{DISPOSITIVO}] Resumen global guardado en Firebase exitosamente.") # Incluir DISPOSITIVO en logs
+            logger.info(f"[{DISPOSITIVO}] Resumen global encolado para Firebase.") # Incluir DISPOSITIVO en logs
         else:
-            logger.warning(f"[{DISPOSITIVO}] Error al guardar resumen global en Firebase.") # Incluir DISPOSITIVO en logs
+            logger.warning(f"[{DISPOSITIVO}] Error al encolar resumen global para Firebase.") # Incluir DISPOSITIVO en logs
     else:
-        logger.warning(f"[{DISPOSITIVO}] No hay screenshot_ids de SQLite disponibles para guardar el resumen.") # Incluir DISPOSITIVO en logs
+        logger.warning(f"[{DISPOSITIVO}] El lote no se guardó en SQLite: no se encola el resumen para Firebase.") # Incluir DISPOSITIVO en logs
+
+    lote["screenshot_ids"] = screenshot_ids_sqlite
+    lote["batch_id"] = resultado_sqlite["batch_id"] if resultado_sqlite else None
+    return lote
 
 
-    # 4. Generar resumen de email y enviar (opcional)
-    # --- Generar resumen de email (NUEVO - usando summary_module) ---
-    resumen_email_texto = summary_module.generar_resumen_email({"conjunto_pantallas": resumen_global_ia}) # NUEVO: Usar summary_module
+def notificar_lote(lote):
+    """Etapa 4: genera el resumen de email y lo envía."""
+    resumen_email_texto = summary_module.generar_resumen_email({"conjunto_pantallas": lote["resumen"]})
     if resumen_email_texto:
         logger.info(f"[{DISPOSITIVO}] Resumen de email generado:\n{resumen_email_texto}") # Incluir DISPOSITIVO en logs
-        email_module.enviar_email(resumen_email_texto)
-        logger.info(f"[{DISPOSITIVO}] Email enviado exitosamente.") # Incluir DISPOSITIVO en logs
+        email_module.encolar_email(resumen_email_texto) # El envío (o el digest) ocurre en segundo plano
+        logger.info(f"[{DISPOSITIVO}] Email encolado para envío.") # Incluir DISPOSITIVO en logs
     else:
         logger.warning(f"[{DISPOSITIVO}] No se pudo generar el resumen de email.") # Incluir DISPOSITIVO en logs
+    return lote
+
+
+def ejecutar_analisis_completo():
+    """
+    Ejecuta el proceso completo de análisis de forma secuencial:
+    1. Captura screenshots.
+    2. Realiza análisis con IA (módulo ai_analysis_module).
+    3. Guarda resultados en base de datos SQLite y Firebase.
+    4. Genera resumen y envia email (opcional).
+    """
+    inicio_captura = datetime.now()
+    logger.info(f"[{DISPOSITIVO}] Iniciando análisis completo a las {inicio_captura.strftime('%Y-%m-%d %H:%M:%S')}") # Incluir DISPOSITIVO en logs
+
+    # 1. Captura de screenshots (multiples capturas en un intervalo)
+    with metricas_module.medir("etapa_segundos", etapa="captura"):
+        lote = capturar_lote()
+    if not lote:
+        logger.warning(f"[{DISPOSITIVO}] No se pudieron capturar screenshots. Abortando análisis.") # Incluir DISPOSITIVO en logs
+        return
 
+    # 2-4. Análisis, almacenamiento y notificación
+    for nombre, etapa in ETAPAS_PIPELINE:
+        with metricas_module.medir("etapa_segundos", etapa=nombre):
+            lote = etapa(lote)
 
     fin_analisis = datetime.now()
     duracion_analisis_segundos = (fin_analisis - inicio_captura).total_seconds()
+    metricas_module.observar("ciclo_segundos", duracion_analisis_segundos)
     logger.info(f"[{DISPOSITIVO}] Análisis completo finalizado a las {fin_analisis.strftime('%Y-%m-%d %H:%M:%S')}. Duración: {duracion_analisis_segundos:.2f} segundos") # Incluir DISPOSITIVO en logs
     logger.info("-" * 50) # Separador para logs
 
 
+ETAPAS_PIPELINE = [
+    ("analisis", analizar_lote),
+    ("almacenamiento", guardar_lote),
+    ("notificacion", notificar_lote),
+]
+
+
+def ruta_de(fuente):
+    """Ruta de archivo de un frame del lote (Frame en memoria o ruta ya persistida); None si no se escribió a disco."""
+    return fuente if isinstance(fuente, str) else fuente.ruta
+
+def momento_de(fuente):
+    """Momento de captura de un frame del lote; para rutas, se lee del nombre del archivo."""
+    if not isinstance(fuente, str):
+        return fuente.timestamp
+    return screenshot_module.parsear_nombre_captura(fuente)["timestamp"]
+
+
 def capturar_pantalla():
     """
-    Captura una screenshot de la pantalla dependiendo del sistema operativo.
-    Guarda la screenshot en un archivo y retorna la ruta del archivo.
+    Captura una screenshot del monitor principal en memoria, reutilizando la sesión de mss del hilo.
+    No escribe a disco: `frame.ruta` queda en None hasta que el EscritorFrames escribe el frame
+    (ver CAPTURE_PERSIST y ruta_prevista).
+    Returns:
+        screenshot_module.Frame: El frame capturado, o None si ocurre un error.
     """
-    sistema_operativo = platform.system()
-    timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-    nombre_archivo = f"screenshot_{DISPOSITIVO}_{timestamp_str}.png" # Incluir DISPOSITIVO en el nombre del archivo
-    ruta_completa = os.path.join(SCREENSHOTS_DIR, nombre_archivo)
-
-    if sistema_operativo == "Linux":
-        try:
-            screenshot_module.capturar_pantalla_linux(ruta_completa) # CORREGIDO: Llamar a screenshot_module.capturar_pantalla_linux
-            logger.info(f"[{DISPOSITIVO}] Screenshot guardada en: {ruta_completa} (Linux)") # Incluir DISPOSITIVO en logs
-            return ruta_completa
-        except Exception as e:
-            logger.error(f"[{DISPOSITIVO}] Error al capturar screenshot en Linux: {e}") # Incluir DISPOSITIVO en logs
-            return None
-    elif sistema_operativo == "Windows":
-        try:
-            from PIL import ImageGrab # Importar solo en Windows
-            screenshot_pil = ImageGrab.grab()
-            screenshot_pil.save(ruta_completa)
-            logger.info(f"[{DISPOSITIVO}] Screenshot guardada en: {ruta_completa} (Windows)") # Incluir DISPOSITIVO en logs
-            return ruta_completa
-        except Exception as e:
-            logger.error(f"[{DISPOSITIVO}] Error al capturar screenshot en Windows: {e}") # Incluir DISPOSITIVO en logs
-            return None
-    else:
-        logger.error(f"[{DISPOSITIVO}] Sistema operativo no soportado para captura de pantalla: {sistema_operativo}") # Incluir DISPOSITIVO en logs
+    try:
+        with metricas_module.medir("captura_segundos"):
+            frame = screenshot_module.obtener_capturador().capturar()
+    except Exception as e:
+        metricas_module.incrementar("errores_total", etapa="captura")
+        logger.error(f"[{DISPOSITIVO}] Error al capturar screenshot: {e}") # Incluir DISPOSITIVO en logs
         return None
+    return frame
+
+
+def ruta_prevista(frame):
+    """Ruta del archivo donde se persistiría el frame (el nombre que parsea screenshot_module)."""
+    # Milisegundos en el nombre: con captura adaptativa puede haber varias capturas por segundo
+    timestamp_str = frame.timestamp.strftime("%Y%m%d_%H%M%S_") + f"{frame.timestamp.microsecond // 1000:03d}"
+    nombre_archivo = f"screenshot_{DISPOSITIVO}_{timestamp_str}.png" # Incluir DISPOSITIVO en el nombre del archivo
+    return os.path.join(SCREENSHOTS_DIR, nombre_archivo)
+
+
+_escritor_frames = None # Hilo de escritura a disco, creado en el primer uso
+
+def obtener_escritor_frames():
+    """Retorna el EscritorFrames compartido (persistencia en segundo plano)."""
+    global _escritor_frames
+    if _escritor_frames is None:
+        _escritor_frames = screenshot_module.EscritorFrames()
+    return _escritor_frames
+
+
+_muestreador = None # Muestreador adaptativo; se conserva entre lotes para no reiniciar la tasa en cada ciclo
+
+def obtener_muestreador():
+    """Retorna el MuestreadorAdaptativo compartido, o None si la captura adaptativa está desactivada."""
+    global _muestreador
+    if _muestreador is None and CAPTURE_ADAPTIVE:
+        _muestreador = screenshot_module.MuestreadorAdaptativo(
+            intervalo_inicial=CAPTURE_INTERVAL_SECONDS,
+            intervalo_minimo=CAPTURE_MIN_INTERVAL_SECONDS,
+            intervalo_maximo=CAPTURE_MAX_INTERVAL_SECONDS,
+            umbral_cambio=CAPTURE_CHANGE_THRESHOLD,
+            umbral_estatico=CAPTURE_STATIC_THRESHOLD,
+            factor_backoff=CAPTURE_BACKOFF_FACTOR,
+        )
+    return _muestreador
+
+
+_preprocesador = None # Pool de preprocesamiento, creado en el primer uso
+
+def opciones_preprocesador():
+    """Argumentos de PreprocesadorImagenes según config (también los usan los procesos del reprocesamiento)."""
+    return dict(
+        max_pixeles=PREPROCESS_MAX_PIXELS,
+        max_pixeles_solicitud=PREPROCESS_REQUEST_MAX_PIXELS,
+        max_bytes_solicitud=PREPROCESS_REQUEST_MAX_BYTES,
+        escala_grises=PREPROCESS_GRAYSCALE,
+        formato=PREPROCESS_FORMAT,
+        calidad=PREPROCESS_QUALITY,
+        recorte=preprocess_module.parsear_recorte(PREPROCESS_CROP),
+    )
+
+def obtener_preprocesador():
+    """Retorna el PreprocesadorImagenes compartido, configurado desde config."""
+    global _preprocesador
+    if _preprocesador is None:
+        _preprocesador = preprocess_module.PreprocesadorImagenes(hilos=PREPROCESS_WORKERS, **opciones_preprocesador())
+    return _preprocesador
+
+
+def inicializar():
+    """
+    Efectos de arranque del agente, explícitos en lugar de ocurrir al importar los módulos.
+    Los SDK pesados (Gemini, Firebase, PIL, mss) no se cargan aquí sino en su primer uso,
+    para que el agente empiece a capturar cuanto antes.
+    """
+    os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+    database_module.crear_tablas() # Asegurar que las tablas SQLite existen al inicio
+    database_module.iniciar_subidor_firebase() # Envía la outbox de Firebase en segundo plano (incluye lo pendiente de ejecuciones anteriores)
+    metricas_module.iniciar_exportacion() # Log JSON / textfile / endpoint HTTP de métricas
+    if STORAGE_MANAGER_ENABLED:
+        almacenamiento_module.iniciar_gestor() # Empaquetado, retención y cuota de las capturas en segundo plano
+    if COLLECTOR_URL:
+        colector_module.iniciar_subidor_colector() # Modo agente: sube los lotes guardados al colector central
 
 
 def main():
     """Función principal para configurar y ejecutar el programa."""
-    database_module.crear_tablas() # Asegurar que las tablas SQLite existen al inicio
+    inicializar()
 
     logger.info(f"[{DISPOSITIVO}] Iniciando el programa de análisis de actividad del usuario del usuario.") # Incluir DISPOSITIVO en logs
+    if PIPELINE_MODE:
+        ejecutar_pipeline()
+        return
+
     schedule.every(int(ANALYSIS_INTERVAL_SECONDS)).seconds.do(ejecutar_analisis_completo) # Programar la tarea principal
 
     while True:
@@ -157,5 +428,60 @@ def main():
         time.sleep(1)
 
 
+def reprocesar(directorio):
+    """
+    Modo reprocesamiento: analiza y guarda capturas ya archivadas en `directorio` (por ejemplo, las
+    tomadas mientras la IA o la base de datos fallaban), agrupadas en ciclos de ANALYSIS_INTERVAL_SECONDS
+    según el momento en el nombre de cada archivo. Corre tan rápido como lo permiten la CPU y la cuota
+    de la IA, y se puede interrumpir y retomar. Solo toma las capturas de DISPOSITIVO (y las del formato
+    antiguo, sin dispositivo en el nombre): para otro equipo, ejecutar con DISPOSITIVO=<nombre>.
+    Returns:
+        dict: Resultado de replay_module.Reprocesador.ejecutar.
+    """
+    inicializar()
+    capturas = replay_module.escanear_capturas(directorio)
+    ciclos = replay_module.agrupar_en_ciclos(capturas, int(ANALYSIS_INTERVAL_SECONDS))
+    logger.info(f"[{DISPOSITIVO}] Reprocesando {len(capturas)} capturas de {directorio} en {len(ciclos)} ciclos.")
+    usa_preprocesados = PREPROCESS_ENABLED and AI_ANALYSIS_MODE in ("conjunto", "por_frame") # Modos que consumen frame['preprocesado']
+    reprocesador = replay_module.Reprocesador(
+        analizar_lote,
+        guardar_lote,
+        notificar=notificar_lote if REPLAY_NOTIFY else None,
+        opciones_preprocesado=opciones_preprocesador() if usa_preprocesados else None,
+    )
+    resultado = reprocesador.ejecutar(ciclos)
+    logger.info(f"[{DISPOSITIVO}] Reprocesamiento finalizado: {resultado}")
+    return resultado
+
+
+def ejecutar_pipeline():
+    """
+    Modo pipeline: la captura corre de forma continua con su propio temporizador y cada lote
+    terminado pasa por colas acotadas a los hilos de análisis, almacenamiento y notificación.
+    """
+    pipeline = pipeline_module.PipelineAnalisis(
+        capturar_lote,
+        ETAPAS_PIPELINE,
+        int(ANALYSIS_INTERVAL_SECONDS),
+        capacidad_cola=PIPELINE_QUEUE_SIZE,
+        politica=PIPELINE_BACKPRESSURE,
+        max_frames_fusion=PIPELINE_MAX_MERGED_FRAMES,
+    )
+    pipeline.iniciar()
+    try:
+        while True:
+            time.sleep(int(ANALYSIS_INTERVAL_SECONDS))
+            logger.info(f"[{DISPOSITIVO}] Estado del pipeline: {pipeline.estado()}") # Profundidad de colas y contadores
+    except KeyboardInterrupt:
+        logger.info(f"[{DISPOSITIVO}] Deteniendo el pipeline...")
+        pipeline.detener(timeout=5)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Análisis de actividad del usuario a partir de capturas de pantalla.")
+    parser.add_argument("--reprocesar", metavar="DIRECTORIO", help="Reprocesar las capturas archivadas en DIRECTORIO y salir")
+    argumentos = parser.parse_args()
+    if argumentos.reprocesar:
+        reprocesar(argumentos.reprocesar)
+    else:
+        main()
\ No newline at end of file
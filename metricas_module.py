@@ -0,0 +1,243 @@
+# metricas_module.py
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, METRICS_TEXTFILE, METRICS_HTTP_PORT, METRICS_EXPORT_INTERVAL_SECONDS, METRICS_LOG_JSON
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+PREFIJO = "analizador_" # Prefijo de las métricas en formato Prometheus
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0) # Segundos
+
+
+class Histograma:
+    """Histograma acumulativo con límites fijos (compatible con el tipo histogram de Prometheus)."""
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = tuple(limites)
+        self.conteos = [0] * (len(self.limites) + 1) # El último es +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p):
+        """Estimación del percentil p (0-100): límite superior del bucket que lo contiene."""
+        if not self.cantidad:
+            return None
+        objetivo = self.cantidad * p / 100.0
+        acumulado = 0
+        for limite, conteo in zip(self.limites + (self.maximo,), self.conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+
+def _clave(nombre, etiquetas):
+    return (nombre, tuple(sorted(etiquetas.items())))
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pares) + "}"
+
+
+class RegistroMetricas:
+    """
+    Registro en memoria de contadores, valores (gauges) e histogramas, con etiquetas.
+    Seguro entre hilos. Las etapas lo alimentan con `incrementar`, `fijar`, `observar` y `medir`;
+    la exportación (log JSON, textfile o HTTP de Prometheus) lee una instantánea.
+    """
+
+    def __init__(self, activo=True):
+        self.activo = activo
+        self._contadores = {}
+        self._valores = {}
+        self._histogramas = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        """Suma `valor` a un contador (ej: frames_conservados_total)."""
+        if not self.activo:
+            return
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, **etiquetas):
+        """Fija el valor actual de una métrica (ej: profundidad de una cola)."""
+        if not self.activo:
+            return
+        with self._lock:
+            self._valores[_clave(nombre, etiquetas)] = valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        """Registra una observación en un histograma (ej: latencia en segundos)."""
+        if not self.activo:
+            return
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+
+    @contextmanager
+    def medir(self, nombre, **etiquetas):
+        """Mide la duración del bloque `with` y la registra en el histograma `nombre` (segundos)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+    def instantanea(self):
+        """
+        Retorna el estado actual de todas las métricas.
+        Returns:
+            dict: 'contadores', 'valores' e 'histogramas' (cantidad, suma, máximo, p50, p99 y buckets),
+                  con el nombre y las etiquetas de cada serie.
+        """
+        with self._lock:
+            contadores = [{"nombre": n, "etiquetas": dict(e), "valor": v} for (n, e), v in self._contadores.items()]
+            valores = [{"nombre": n, "etiquetas": dict(e), "valor": v} for (n, e), v in self._valores.items()]
+            histogramas = [{
+                "nombre": n, "etiquetas": dict(e), "cantidad": h.cantidad, "suma": round(h.suma, 6),
+                "maximo": round(h.maximo, 6), "p50": h.percentil(50), "p99": h.percentil(99),
+                "buckets": dict(zip([str(l) for l in h.limites] + ["+Inf"], h.conteos)),
+            } for (n, e), h in self._histogramas.items()]
+        return {"timestamp": time.time(), "contadores": contadores, "valores": valores, "histogramas": histogramas}
+
+    def a_prometheus(self):
+        """Serializa las métricas en el formato de texto de Prometheus."""
+        lineas = []
+        with self._lock:
+            for tipo, series in (("counter", self._contadores), ("gauge", self._valores)):
+                vistos = set()
+                for (nombre, etiquetas), valor in sorted(series.items()):
+                    if nombre not in vistos:
+                        lineas.append(f"# TYPE {PREFIJO}{nombre} {tipo}")
+                        vistos.add(nombre)
+                    lineas.append(f"{PREFIJO}{nombre}{_formatear_etiquetas(etiquetas)} {valor}")
+            vistos = set()
+            for (nombre, etiquetas), histograma in sorted(self._histogramas.items()):
+                if nombre not in vistos:
+                    lineas.append(f"# TYPE {PREFIJO}{nombre} histogram")
+                    vistos.add(nombre)
+                acumulado = 0
+                for limite, conteo in zip([str(l) for l in histograma.limites] + ["+Inf"], histograma.conteos):
+                    acumulado += conteo
+                    lineas.append(f"{PREFIJO}{nombre}_bucket{_formatear_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+                lineas.append(f"{PREFIJO}{nombre}_sum{_formatear_etiquetas(etiquetas)} {histograma.suma}")
+                lineas.append(f"{PREFIJO}{nombre}_count{_formatear_etiquetas(etiquetas)} {histograma.cantidad}")
+        return "\n".join(lineas) + "\n"
+
+    def escribir_textfile(self, ruta):
+        """Escribe las métricas en `ruta` (textfile collector de node_exporter), de forma atómica."""
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            archivo.write(self.a_prometheus())
+        os.replace(temporal, ruta)
+
+    def registrar_log(self, destino=logger):
+        """Emite la instantánea como un único registro de log en JSON."""
+        destino.info(json.dumps({"metricas": self.instantanea()}, ensure_ascii=False))
+
+    def reiniciar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._valores.clear()
+            self._histogramas.clear()
+
+
+class ServidorMetricas:
+    """Expone las métricas por HTTP: /metrics (Prometheus) y /metrics.json (instantánea JSON)."""
+
+    def __init__(self, registro, puerto, host="127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Solo si se activa el endpoint
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    cuerpo, tipo = json.dumps(registro.instantanea()).encode("utf-8"), "application/json"
+                elif self.path.startswith("/metrics"):
+                    cuerpo, tipo = registro.a_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, formato, *args): # Sin una línea de log por cada scrape
+                pass
+
+        self._servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        self.puerto = self._servidor.server_address[1]
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="servidor_metricas", daemon=True)
+        self._hilo.start()
+        logger.info(f"Métricas disponibles en http://{host}:{self.puerto}/metrics")
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+registro = RegistroMetricas(METRICS_ENABLED) # Registro compartido por todos los módulos
+incrementar = registro.incrementar
+fijar = registro.fijar
+observar = registro.observar
+medir = registro.medir
+
+
+def exportar():
+    """Exporta la instantánea actual: registro JSON en el log y textfile de Prometheus, según la configuración."""
+    if not registro.activo:
+        return
+    if METRICS_LOG_JSON:
+        registro.registrar_log()
+    if METRICS_TEXTFILE:
+        try:
+            registro.escribir_textfile(METRICS_TEXTFILE)
+        except OSError as e:
+            logger.warning(f"No se pudo escribir el textfile de métricas {METRICS_TEXTFILE}: {e}")
+
+
+_servidor = None
+_hilo_exportacion = None
+
+def iniciar_exportacion():
+    """
+    Arranca (una vez) la exportación periódica cada METRICS_EXPORT_INTERVAL_SECONDS y,
+    si METRICS_HTTP_PORT está configurado, el endpoint HTTP local.
+    """
+    global _servidor, _hilo_exportacion
+    if not registro.activo or _hilo_exportacion is not None:
+        return
+    if METRICS_HTTP_PORT:
+        try:
+            _servidor = ServidorMetricas(registro, METRICS_HTTP_PORT)
+        except OSError as e:
+            logger.error(f"No se pudo iniciar el endpoint de métricas en el puerto {METRICS_HTTP_PORT}: {e}")
+
+    def bucle():
+        while True:
+            time.sleep(METRICS_EXPORT_INTERVAL_SECONDS)
+            exportar()
+
+    _hilo_exportacion = threading.Thread(target=bucle, name="exportador_metricas", daemon=True)
+    _hilo_exportacion.start()
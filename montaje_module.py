@@ -0,0 +1,206 @@
+# montaje_module.py
+import logging
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import almacenamiento_module
+import preprocess_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+ALTO_ETIQUETA = 18 # Alto en píxeles de la franja con la hora debajo de cada mosaico
+SEPARACION = 4 # Píxeles entre mosaicos
+PATRON_MONITOR = re.compile(r"^(?P<base>.+)_monitor(?P<monitor>\d+)\.\w+$") # screenshot_YYYYMMDD_HHMMSS_monitorN.png
+
+
+def agrupar_monitores(rutas):
+    """
+    Agrupa las rutas que genera screenshot_module.capturar_pantallas (una por monitor y por instante)
+    en una lista por instante, con los monitores en orden. Las rutas sin sufijo de monitor quedan solas.
+    Args:
+        rutas (list): Rutas de archivos de captura.
+    Returns:
+        list: Elementos para `crear_hojas_contacto` (una ruta o una lista de rutas por instante).
+    """
+    grupos = []
+    indices = {}
+    for ruta in rutas:
+        coincidencia = PATRON_MONITOR.match(os.path.basename(ruta))
+        if not coincidencia:
+            grupos.append(ruta)
+            continue
+        base = coincidencia.group("base")
+        if base not in indices:
+            indices[base] = len(grupos)
+            grupos.append([])
+        grupos[indices[base]].append((int(coincidencia.group("monitor")), ruta))
+    return [[r for _, r in sorted(g)] if isinstance(g, list) else g for g in grupos]
+
+
+def _abrir(fuente):
+    """Retorna una PIL.Image (perezosa si es un archivo) a partir de una ruta, Frame o imagen."""
+    if isinstance(fuente, str):
+        return almacenamiento_module.abrir_imagen(fuente)
+    if hasattr(fuente, "a_imagen"):
+        return fuente.a_imagen()
+    return fuente
+
+def _tamano(fuente):
+    """Ancho y alto de una captura sin decodificar sus píxeles."""
+    if hasattr(fuente, "ancho"):
+        return fuente.ancho, fuente.alto
+    if isinstance(fuente, str):
+        with almacenamiento_module.abrir_imagen(fuente) as imagen: # Solo lee la cabecera
+            return imagen.size
+    return fuente.size
+
+def _monitores(elemento):
+    return list(elemento) if isinstance(elemento, (list, tuple)) else [elemento]
+
+def proporcion(elemento):
+    """Relación ancho/alto de un elemento, con sus monitores uno al lado del otro a la misma altura."""
+    return sum(ancho / alto for ancho, alto in map(_tamano, _monitores(elemento)))
+
+
+def calcular_grilla(cantidad, proporcion_mosaico, max_ancho, max_alto):
+    """
+    Elige el número de columnas que maximiza el tamaño de los mosaicos dentro de la resolución máxima.
+    Returns:
+        tuple: (columnas, filas, ancho_mosaico, alto_mosaico), sin contar la franja de la etiqueta.
+    """
+    mejor = None
+    for columnas in range(1, cantidad + 1):
+        filas = math.ceil(cantidad / columnas)
+        ancho = (max_ancho - SEPARACION * (columnas - 1)) // columnas
+        alto_disponible = (max_alto - SEPARACION * (filas - 1)) // filas - ALTO_ETIQUETA
+        ancho = min(ancho, int(alto_disponible * proporcion_mosaico))
+        if ancho <= 0:
+            continue
+        if mejor is None or ancho > mejor[2]:
+            mejor = (columnas, filas, ancho, max(1, int(ancho / proporcion_mosaico)))
+    if mejor is None:
+        raise ValueError(f"La resolución máxima {max_ancho}x{max_alto} es demasiado chica para {cantidad} mosaicos.")
+    return mejor
+
+
+def _fuente_etiqueta():
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size=ALTO_ETIQUETA - 4)
+    except TypeError: # Pillow < 10.1: fuente bitmap de tamaño fijo
+        return ImageFont.load_default()
+
+def _componer_mosaico(elemento, ancho, alto):
+    """Reduce cada monitor del elemento y los pega uno al lado del otro en un mosaico de ancho x alto."""
+    from PIL import Image
+    mosaico = Image.new("RGB", (ancho, alto))
+    monitores = _monitores(elemento)
+    proporciones = [w / h for w, h in map(_tamano, monitores)]
+    total = sum(proporciones)
+    x = 0
+    for indice, (monitor, prop) in enumerate(zip(monitores, proporciones)):
+        ancho_monitor = ancho - x if indice == len(monitores) - 1 else max(1, round(ancho * prop / total))
+        imagen = _abrir(monitor)
+        if hasattr(imagen, "draft"):
+            imagen.draft("RGB", (ancho_monitor, alto)) # Decodificación reducida (JPEG) cuando el formato lo permite
+        reducida = imagen.convert("RGB").resize((ancho_monitor, alto), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        mosaico.paste(reducida, (x, 0))
+        x += ancho_monitor
+    return mosaico
+
+
+def crear_hojas_contacto(elementos, timestamps=None, etiquetas=None, max_ancho=2048, max_alto=2048,
+                         max_hojas=4, max_mosaicos_por_hoja=16):
+    """
+    Arma hojas de contacto: las capturas se reducen a mosaicos en una grilla, en orden cronológico
+    (de izquierda a derecha y de arriba abajo), cada uno con una etiqueta con su hora.
+    Args:
+        elementos (list): Capturas en orden. Cada una es una ruta, un screenshot_module.Frame, una
+                          PIL.Image o una lista de ellas (un instante en varios monitores, que se
+                          colocan uno al lado del otro dentro del mosaico).
+        timestamps (list): Opcional. datetime de cada elemento (por defecto, el de los Frame).
+        etiquetas (list): Opcional. Texto adicional de cada etiqueta (ej: tiempo en pantalla).
+        max_ancho (int): Ancho máximo de cada hoja, en píxeles.
+        max_alto (int): Alto máximo de cada hoja, en píxeles.
+        max_hojas (int): Máximo de hojas; si no alcanzan, cada hoja lleva más mosaicos.
+        max_mosaicos_por_hoja (int): Mosaicos por hoja a partir de los cuales se agrega otra hoja.
+    Returns:
+        list: PIL.Image RGB de cada hoja.
+    """
+    if not elementos:
+        return []
+    from PIL import Image, ImageDraw # Importación diferida: PIL solo se carga en el modo mosaico
+    cantidad = len(elementos)
+    num_hojas = max(1, min(max_hojas, math.ceil(cantidad / max_mosaicos_por_hoja)))
+    por_hoja = math.ceil(cantidad / num_hojas)
+    proporcion_mosaico = proporcion(elementos[0])
+    fuente = _fuente_etiqueta()
+
+    hojas = []
+    for inicio in range(0, cantidad, por_hoja):
+        grupo = range(inicio, min(inicio + por_hoja, cantidad))
+        columnas, filas, ancho, alto = calcular_grilla(len(grupo), proporcion_mosaico, max_ancho, max_alto)
+        alto_celda = alto + ALTO_ETIQUETA
+        hoja = Image.new("RGB", (columnas * ancho + SEPARACION * (columnas - 1),
+                                 filas * alto_celda + SEPARACION * (filas - 1)), "white")
+        dibujo = ImageDraw.Draw(hoja)
+        for posicion, indice in enumerate(grupo):
+            x = (posicion % columnas) * (ancho + SEPARACION)
+            y = (posicion // columnas) * (alto_celda + SEPARACION)
+            hoja.paste(_componer_mosaico(elementos[indice], ancho, alto), (x, y))
+            momento = timestamps[indice] if timestamps else getattr(_monitores(elementos[indice])[0], "timestamp", None)
+            texto = f"{indice + 1}"
+            if isinstance(momento, datetime):
+                texto += f" {momento.strftime('%H:%M:%S')}"
+            if etiquetas and etiquetas[indice]:
+                texto += f" {etiquetas[indice]}"
+            dibujo.rectangle((x, y + alto, x + ancho - 1, y + alto_celda - 1), fill="black")
+            dibujo.text((x + 3, y + alto + 1), texto, fill="white", font=fuente)
+        hojas.append(hoja)
+    return hojas
+
+
+def codificar_hoja(hoja, formato="JPEG", calidad=80):
+    """
+    Codifica una hoja de contacto con la misma forma que los frames de preprocess_module,
+    para que ai_analysis_module (caché, envío, logs) la trate como cualquier frame preprocesado.
+    """
+    formato = formato.upper()
+    datos = preprocess_module.codificar_imagen(hoja, formato, calidad)
+    return {
+        "datos": datos,
+        "mime_type": preprocess_module.FORMATOS_MIME[formato],
+        "ancho": hoja.width,
+        "alto": hoja.height,
+        "calidad": calidad,
+        "bytes_originales": hoja.width * hoja.height * 3,
+        "bytes_finales": len(datos),
+    }
+
+
+if __name__ == '__main__':
+    # Comparación del tamaño de solicitud: python montaje_module.py <directorio_con_capturas> [cantidad]
+    from config import (MONTAGE_MAX_WIDTH, MONTAGE_MAX_HEIGHT, MONTAGE_MAX_SHEETS, MONTAGE_MAX_TILES_PER_SHEET,
+                        MONTAGE_QUALITY, PREPROCESS_FORMAT)
+    directorio = sys.argv[1]
+    cantidad = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rutas = sorted(os.path.join(directorio, n) for n in os.listdir(directorio) if n.endswith(".png"))[:cantidad]
+    elementos = agrupar_monitores(rutas)
+
+    inicio = time.perf_counter()
+    preprocesador = preprocess_module.PreprocesadorImagenes(formato=PREPROCESS_FORMAT)
+    individuales = preprocesador.ajustar_a_presupuesto([preprocesador.preprocesar(r) for r in rutas])
+    duracion_individual = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    hojas = [codificar_hoja(h, PREPROCESS_FORMAT, MONTAGE_QUALITY) for h in crear_hojas_contacto(
+        elementos, max_ancho=MONTAGE_MAX_WIDTH, max_alto=MONTAGE_MAX_HEIGHT,
+        max_hojas=MONTAGE_MAX_SHEETS, max_mosaicos_por_hoja=MONTAGE_MAX_TILES_PER_SHEET)]
+    duracion_mosaico = time.perf_counter() - inicio
+
+    print(f"Por imagen: {len(individuales)} imágenes, {sum(r['bytes_finales'] for r in individuales)} bytes, {duracion_individual:.2f}s")
+    print(f"Mosaico:    {len(hojas)} hojas, {sum(h['bytes_finales'] for h in hojas)} bytes, {duracion_mosaico:.2f}s")
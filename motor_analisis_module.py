@@ -0,0 +1,206 @@
+# motor_analisis_module.py
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeoutError
+
+import metricas_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+CODIGOS_REINTENTABLES = (408, 429, 500, 502, 503, 504)
+NOMBRES_REINTENTABLES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                         "DeadlineExceeded", "GatewayTimeout", "BadGateway", "TimeoutError")
+
+
+class ErrorReintentable(Exception):
+    """Error transitorio del backend (cuota, sobrecarga, timeout): la llamada puede reintentarse."""
+
+
+def es_error_reintentable(error):
+    """Indica si el error de una llamada al modelo es transitorio (429/5xx/timeout)."""
+    if isinstance(error, (ErrorReintentable, TimeoutError, ConnectionError)):
+        return True
+    codigo = getattr(error, "code", None)
+    try:
+        if codigo is not None and int(codigo) in CODIGOS_REINTENTABLES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return type(error).__name__ in NOMBRES_REINTENTABLES
+
+
+class LimitadorTasa:
+    """
+    Token bucket: permite ráfagas de hasta `rafaga` solicitudes y un promedio de
+    `solicitudes_por_minuto`. `adquirir` bloquea hasta que haya un token disponible.
+    """
+
+    def __init__(self, solicitudes_por_minuto, rafaga=1):
+        if solicitudes_por_minuto <= 0:
+            raise ValueError("solicitudes_por_minuto debe ser mayor que 0 (para no limitar, no use un limitador).")
+        self.tasa = solicitudes_por_minuto / 60.0 # Tokens por segundo
+        self.capacidad = max(1, rafaga)
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+def llamar_con_reintentos(funcion, reintentos=4, espera_base=1.0, espera_maxima=30.0):
+    """
+    Ejecuta `funcion()` reintentando los errores transitorios con backoff exponencial y jitter completo.
+    Los errores no reintentables (o el último intento fallido) se propagan.
+    """
+    intento = 0
+    while True:
+        try:
+            return funcion()
+        except Exception as e:
+            if intento >= reintentos or not es_error_reintentable(e):
+                raise
+            espera = random.uniform(0, min(espera_maxima, espera_base * (2 ** intento)))
+            intento += 1
+            metricas_module.incrementar("reintentos_ia_total")
+            logger.warning(f"Error transitorio del modelo ({type(e).__name__}: {e}). Reintento {intento}/{reintentos} en {espera:.1f}s.")
+            time.sleep(espera)
+
+
+class MotorAnalisis:
+    """
+    Ejecuta llamadas al modelo a través de un backend intercambiable, aplicando límite de tasa,
+    reintentos con backoff y timeout por llamada. Permite lanzar varias llamadas en paralelo.
+
+    El backend es cualquier objeto con el método
+    `generar(modelo, system_instruction, contenidos, max_output_tokens, timeout)` que retorna
+    el texto de la respuesta (o None) y, opcionalmente, `generar_stream` con los mismos argumentos,
+    que genera los fragmentos de texto a medida que llegan.
+    """
+
+    def __init__(self, backend, limitador=None, hilos=4, reintentos=4, espera_base=1.0, espera_maxima=30.0, timeout=60.0):
+        self.backend = backend
+        self.limitador = limitador
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="motor_ia")
+
+    def generar(self, modelo, system_instruction, contenidos, max_output_tokens):
+        """Llamada síncrona al modelo con límite de tasa y reintentos. Retorna el texto o None."""
+        def intento():
+            if self.limitador:
+                self.limitador.adquirir()
+            return self.backend.generar(modelo, system_instruction, contenidos, max_output_tokens, self.timeout)
+        return llamar_con_reintentos(intento, self.reintentos, self.espera_base, self.espera_maxima)
+
+    def generar_stream(self, modelo, system_instruction, contenidos, max_output_tokens, al_fragmento):
+        """
+        Como `generar`, pero entrega cada fragmento de la respuesta a `al_fragmento(texto)` a medida que
+        el backend lo produce (método `generar_stream` del backend; si no lo tiene, la respuesta completa
+        llega en un único fragmento). Un reintento empieza la respuesta de nuevo: antes se llama a
+        `al_fragmento(None)` para que se descarte lo recibido.
+        Returns:
+            str: Texto completo de la respuesta, o None.
+        """
+        intentos = [0]
+        def intento():
+            if self.limitador:
+                self.limitador.adquirir()
+            if intentos[0]:
+                al_fragmento(None)
+            intentos[0] += 1
+            generar_stream = getattr(self.backend, "generar_stream", None)
+            if generar_stream is None:
+                texto = self.backend.generar(modelo, system_instruction, contenidos, max_output_tokens, self.timeout)
+                if texto:
+                    al_fragmento(texto)
+                return texto
+            partes = []
+            for texto in generar_stream(modelo, system_instruction, contenidos, max_output_tokens, self.timeout):
+                partes.append(texto)
+                al_fragmento(texto)
+            return "".join(partes) or None
+        return llamar_con_reintentos(intento, self.reintentos, self.espera_base, self.espera_maxima)
+
+    def mapear(self, funcion, elementos, timeout=None):
+        """
+        Aplica `funcion` a cada elemento en paralelo y retorna los resultados en el mismo orden.
+        Un elemento que falla o excede el timeout produce None; el resto no se ve afectado.
+        Args:
+            timeout (float): Tiempo máximo total de espera. Por defecto, el timeout por llamada
+                             del motor multiplicado por los intentos posibles.
+        """
+        if timeout is None:
+            timeout = self.timeout * (self.reintentos + 1) + self.espera_maxima * self.reintentos
+        limite = time.monotonic() + timeout
+        futuros = [self._pool.submit(funcion, elemento) for elemento in elementos]
+        resultados = []
+        for indice, futuro in enumerate(futuros):
+            try:
+                resultados.append(futuro.result(timeout=max(0.0, limite - time.monotonic())))
+            except FuturoTimeoutError:
+                futuro.cancel()
+                logger.error(f"El elemento {indice} excedió el tiempo máximo de análisis ({timeout:.0f}s).")
+                resultados.append(None)
+            except Exception as e:
+                logger.error(f"Error al analizar el elemento {indice}: {e}")
+                resultados.append(None)
+        return resultados
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False)
+
+
+class BackendFalso:
+    """
+    Backend local para pruebas y benchmarks: no llama a ninguna API.
+    Simula la latencia y una tasa de errores transitorios, y retorna una respuesta fija.
+    """
+
+    def __init__(self, latencia_segundos=0.0, tasa_error=0.0, respuesta=None, semilla=None):
+        self.latencia_segundos = latencia_segundos
+        self.tasa_error = tasa_error
+        self.respuesta = respuesta or (
+            '{"analisis_conjunto": "Usuario trabajando en un editor de texto.", '
+            '"comportamiento_global": "Sin contenido inapropiado.", '
+            '"uso_tiempo_global": "Uso productivo del tiempo."}'
+        )
+        self.llamadas = 0
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def generar(self, modelo, system_instruction, contenidos, max_output_tokens, timeout=None):
+        with self._lock:
+            self.llamadas += 1
+            falla = self._aleatorio.random() < self.tasa_error
+        if self.latencia_segundos:
+            time.sleep(self.latencia_segundos)
+        if falla:
+            raise ErrorReintentable("429 Resource exhausted (simulado)")
+        return self.respuesta
+
+    def generar_stream(self, modelo, system_instruction, contenidos, max_output_tokens, timeout=None, fragmentos=8):
+        """Como `generar`, pero entrega la respuesta en `fragmentos` partes, con la latencia repartida entre ellas."""
+        with self._lock:
+            self.llamadas += 1
+            falla = self._aleatorio.random() < self.tasa_error
+        if falla:
+            raise ErrorReintentable("429 Resource exhausted (simulado)")
+        tamano = -(-len(self.respuesta) // fragmentos)
+        for inicio in range(0, len(self.respuesta), tamano):
+            if self.latencia_segundos:
+                time.sleep(self.latencia_segundos / fragmentos)
+            yield self.respuesta[inicio:inicio + tamano]
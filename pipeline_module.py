@@ -0,0 +1,212 @@
+# pipeline_module.py
+import logging
+import threading
+import time
+from collections import deque
+
+import metricas_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+POLITICA_DESCARTAR = "descartar" # Descarta el lote más antiguo de la cola
+POLITICA_FUSIONAR = "fusionar" # Fusiona el lote nuevo con el último lote encolado
+
+
+def fusionar_lotes(lote_anterior, lote_nuevo):
+    """
+    Combina dos lotes consecutivos en uno solo.
+    Args:
+        lote_anterior (dict): Lote que ya estaba esperando en la cola.
+        lote_nuevo (dict): Lote recién capturado.
+    Returns:
+        dict: Lote con las capturas de ambos, en orden cronológico.
+    """
+    lote = dict(lote_anterior)
+    for clave, valor in lote_nuevo.items():
+        if isinstance(valor, list) and isinstance(lote.get(clave), list):
+            lote[clave] = lote[clave] + valor
+        elif clave not in lote:
+            lote[clave] = valor
+    lote["fin"] = lote_nuevo.get("fin", lote.get("fin"))
+    lote["fusionados"] = lote_anterior.get("fusionados", 1) + lote_nuevo.get("fusionados", 1)
+    return lote
+
+
+class ColaLotes:
+    """
+    Cola acotada de lotes con control de contrapresión.
+    Cuando la cola está llena, `poner` nunca bloquea: aplica la política configurada
+    (descartar el lote más antiguo o fusionar con el último encolado). Una fusión que superaría
+    `max_frames_fusion` frames se reemplaza por un descarte: el lote fusionado no crece sin límite
+    mientras el análisis está detenido (ej: backoff de la API) y la memoria queda acotada.
+    """
+
+    def __init__(self, capacidad, politica=POLITICA_FUSIONAR, max_frames_fusion=0):
+        """
+        Args:
+            capacidad (int): Máximo de lotes en la cola.
+            politica (str): 'descartar' o 'fusionar' cuando la cola está llena.
+            max_frames_fusion (int): Frames máximos de un lote fusionado (0 = sin límite).
+        """
+        self.capacidad = max(1, int(capacidad))
+        self.politica = politica
+        self.max_frames_fusion = max_frames_fusion
+        self._lotes = deque()
+        self._condicion = threading.Condition()
+        self.descartados = 0
+        self.fusionados = 0
+
+    def poner(self, lote):
+        """Encola un lote aplicando la política de contrapresión si la cola está llena."""
+        with self._condicion:
+            if len(self._lotes) >= self.capacidad:
+                if self.politica == POLITICA_DESCARTAR or self._excede_fusion(self._lotes[-1], lote):
+                    self._lotes.popleft()
+                    self.descartados += 1
+                    metricas_module.incrementar("lotes_descartados_total")
+                    logger.warning(f"Cola llena ({self.capacidad}): se descartó el lote más antiguo.")
+                else:
+                    self._lotes[-1] = fusionar_lotes(self._lotes[-1], lote)
+                    self.fusionados += 1
+                    metricas_module.incrementar("lotes_fusionados_total")
+                    logger.warning(f"Cola llena ({self.capacidad}): lote fusionado con el último encolado.")
+                    self._condicion.notify()
+                    return
+            self._lotes.append(lote)
+            self._condicion.notify()
+
+    def _excede_fusion(self, lote_anterior, lote_nuevo):
+        if not self.max_frames_fusion:
+            return False
+        frames = len(lote_anterior.get("frames", [])) + len(lote_nuevo.get("frames", []))
+        return frames > self.max_frames_fusion
+
+    def poner_bloqueante(self, lote, detener):
+        """Encola un lote esperando a que haya espacio (o a que se pida detener)."""
+        with self._condicion:
+            while len(self._lotes) >= self.capacidad and not detener.is_set():
+                self._condicion.wait(0.5)
+            self._lotes.append(lote)
+            self._condicion.notify_all()
+
+    def obtener(self, timeout=None):
+        """Retorna el siguiente lote o None si no llegó ninguno antes del timeout."""
+        with self._condicion:
+            if not self._lotes:
+                self._condicion.wait(timeout)
+            if not self._lotes:
+                return None
+            lote = self._lotes.popleft()
+            self._condicion.notify_all()
+            return lote
+
+    def profundidad(self):
+        """Cantidad de lotes esperando en la cola."""
+        with self._condicion:
+            return len(self._lotes)
+
+
+class PipelineAnalisis:
+    """
+    Ejecuta la captura de forma continua en su propio hilo y pasa cada lote terminado
+    por una cadena de etapas (análisis, almacenamiento, notificación), cada una con su
+    hilo y su cola acotada. La captura nunca espera a las etapas de red.
+    """
+
+    def __init__(self, capturar, etapas, intervalo_segundos, capacidad_cola=2, politica=POLITICA_FUSIONAR,
+                 max_frames_fusion=0):
+        """
+        Args:
+            capturar (callable): Función `capturar(fin_monotonico, detener)` que captura hasta el
+                instante indicado (reloj monotónico) y retorna un lote (dict) o None.
+            etapas (list): Lista de tuplas (nombre, función). Cada función recibe un lote y retorna
+                el lote (posiblemente enriquecido) o None para cortar la cadena.
+            intervalo_segundos (float): Duración de cada ciclo de captura.
+            capacidad_cola (int): Máximo de lotes esperando entre etapas.
+            politica (str): 'descartar' o 'fusionar' cuando el análisis se atrasa.
+            max_frames_fusion (int): Frames máximos de un lote fusionado; por encima se descarta (0 = sin límite).
+        """
+        self.capturar = capturar
+        self.etapas = etapas
+        self.intervalo_segundos = float(intervalo_segundos)
+        self.detener_evento = threading.Event()
+        self.colas = [ColaLotes(capacidad_cola, politica, max_frames_fusion)]
+        self.colas += [ColaLotes(capacidad_cola) for _ in etapas[1:]]
+        self.procesados = {nombre: 0 for nombre, _ in etapas}
+        self.errores = {nombre: 0 for nombre, _ in etapas}
+        self.ciclos_capturados = 0
+        self._hilos = []
+
+    def iniciar(self):
+        """Arranca el hilo de captura y un hilo por etapa."""
+        self.detener_evento.clear()
+        self._hilos = [threading.Thread(target=self._bucle_captura, name="captura", daemon=True)]
+        for indice, (nombre, _) in enumerate(self.etapas):
+            self._hilos.append(threading.Thread(target=self._bucle_etapa, args=(indice,), name=nombre, daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+        logger.info(f"Pipeline iniciado: intervalo {self.intervalo_segundos}s, etapas {[n for n, _ in self.etapas]}.")
+
+    def detener(self, timeout=None):
+        """Pide a todos los hilos que terminen y espera a que lo hagan."""
+        self.detener_evento.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+
+    def _bucle_captura(self):
+        # Los límites de cada ciclo se calculan desde el instante inicial (reloj monotónico),
+        # así los ciclos no acumulan deriva aunque una captura individual se retrase.
+        origen = time.monotonic()
+        numero_ciclo = 0
+        while not self.detener_evento.is_set():
+            numero_ciclo += 1
+            fin_ciclo = origen + numero_ciclo * self.intervalo_segundos
+            if fin_ciclo <= time.monotonic():
+                # Si el proceso estuvo suspendido, se saltan los ciclos perdidos en lugar de encadenarlos.
+                numero_ciclo = int((time.monotonic() - origen) // self.intervalo_segundos) + 1
+                fin_ciclo = origen + numero_ciclo * self.intervalo_segundos
+            try:
+                with metricas_module.medir("etapa_segundos", etapa="captura"):
+                    lote = self.capturar(fin_ciclo, self.detener_evento)
+            except Exception as e:
+                logger.error(f"Error en la etapa de captura: {e}", exc_info=True)
+                lote = None
+            if lote:
+                self.ciclos_capturados += 1
+                self.colas[0].poner(lote)
+
+    def _bucle_etapa(self, indice):
+        nombre, funcion = self.etapas[indice]
+        cola_entrada = self.colas[indice]
+        cola_salida = self.colas[indice + 1] if indice + 1 < len(self.colas) else None
+        while not self.detener_evento.is_set():
+            lote = cola_entrada.obtener(timeout=0.5)
+            if lote is None:
+                continue
+            metricas_module.fijar("profundidad_cola", cola_entrada.profundidad(), etapa=nombre)
+            try:
+                with metricas_module.medir("etapa_segundos", etapa=nombre):
+                    resultado = funcion(lote)
+                self.procesados[nombre] += 1
+            except Exception as e:
+                self.errores[nombre] += 1
+                metricas_module.incrementar("errores_total", etapa=nombre)
+                logger.error(f"Error en la etapa '{nombre}' del pipeline: {e}", exc_info=True)
+                continue
+            if resultado is not None and cola_salida is not None:
+                cola_salida.poner_bloqueante(resultado, self.detener_evento)
+
+    def estado(self):
+        """
+        Retorna un resumen del estado del pipeline.
+        Returns:
+            dict: Profundidad de cada cola, lotes descartados/fusionados y contadores por etapa.
+        """
+        return {
+            "ciclos_capturados": self.ciclos_capturados,
+            "profundidad_colas": {nombre: cola.profundidad() for (nombre, _), cola in zip(self.etapas, self.colas)},
+            "descartados": self.colas[0].descartados,
+            "fusionados": self.colas[0].fusionados,
+            "procesados": dict(self.procesados),
+            "errores": dict(self.errores),
+        }
@@ -0,0 +1,188 @@
+# preprocess_module.py
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import almacenamiento_module
+import metricas_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+FORMATOS_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+CALIDAD_MINIMA = 35 # Por debajo de esta calidad se reduce la resolución en lugar de la calidad
+
+
+def parsear_recorte(texto):
+    """
+    Convierte 'arriba,derecha,abajo,izquierda' (píxeles a recortar de cada borde) en una tupla.
+    Una cadena vacía significa sin recorte.
+    """
+    if not texto:
+        return (0, 0, 0, 0)
+    valores = [int(v.strip() or 0) for v in texto.split(",")]
+    if len(valores) != 4:
+        raise ValueError(f"Recorte inválido '{texto}': se esperan 4 valores 'arriba,derecha,abajo,izquierda'.")
+    return tuple(valores)
+
+
+def tamano_original(fuente):
+    """Bytes que ocupa la imagen antes de preprocesar (buffer crudo, archivo o píxeles RGB)."""
+    if isinstance(fuente, str):
+        return almacenamiento_module.tamano_captura(fuente)
+    if hasattr(fuente, "tamano_bytes"):
+        return fuente.tamano_bytes
+    return fuente.width * fuente.height * len(fuente.getbands())
+
+
+def codificar_imagen(imagen, formato, calidad):
+    """
+    Codifica una PIL.Image en uno de los FORMATOS_MIME.
+    Args:
+        imagen (PIL.Image.Image): Imagen a codificar.
+        formato (str): 'JPEG', 'WEBP' o 'PNG'.
+        calidad (int): Calidad de codificación (1-95); PNG no la usa.
+    Returns:
+        bytes: Imagen codificada.
+    """
+    buffer = io.BytesIO()
+    if formato == "PNG":
+        imagen.save(buffer, "PNG", optimize=False, compress_level=6)
+    else:
+        imagen.save(buffer, formato, quality=calidad)
+    return buffer.getvalue()
+
+
+class PreprocesadorImagenes:
+    """
+    Prepara las capturas para el modelo: recorta bordes fijos (barra de tareas, dock), reduce la
+    resolución, opcionalmente pasa a escala de grises y codifica en un formato compacto.
+    Trabaja en un pool de hilos para solaparse con la captura.
+    """
+
+    def __init__(self, max_pixeles=1_000_000, max_pixeles_solicitud=8_000_000, max_bytes_solicitud=4_000_000,
+                 escala_grises=False, formato="JPEG", calidad=80, recorte=(0, 0, 0, 0), hilos=2):
+        """
+        Args:
+            max_pixeles (int): Píxeles máximos por frame.
+            max_pixeles_solicitud (int): Presupuesto de píxeles para todos los frames de una solicitud.
+            max_bytes_solicitud (int): Presupuesto de bytes codificados para una solicitud.
+            escala_grises (bool): Convertir a escala de grises.
+            formato (str): 'JPEG', 'WEBP' o 'PNG'.
+            calidad (int): Calidad inicial de codificación (1-95).
+            recorte (tuple): Píxeles a recortar (arriba, derecha, abajo, izquierda).
+            hilos (int): Hilos del pool de preprocesamiento.
+        """
+        self.formato = formato.upper()
+        if self.formato not in FORMATOS_MIME:
+            raise ValueError(f"Formato no soportado: {formato}. Opciones: {list(FORMATOS_MIME)}")
+        self.max_pixeles = max_pixeles
+        self.max_pixeles_solicitud = max_pixeles_solicitud
+        self.max_bytes_solicitud = max_bytes_solicitud
+        self.escala_grises = escala_grises
+        self.calidad = calidad
+        self.recorte = recorte
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="preprocesado")
+
+    def _codificar(self, imagen, calidad):
+        return codificar_imagen(imagen, self.formato, calidad)
+
+    def _reducir(self, imagen, max_pixeles):
+        from PIL import Image
+        pixeles = imagen.width * imagen.height
+        if pixeles <= max_pixeles:
+            return imagen
+        factor = (max_pixeles / pixeles) ** 0.5
+        nuevo = (max(1, int(imagen.width * factor)), max(1, int(imagen.height * factor)))
+        return imagen.resize(nuevo, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    def preprocesar(self, fuente):
+        """
+        Preprocesa una imagen.
+        Args:
+            fuente (str | PIL.Image.Image | screenshot_module.Frame): Imagen a preparar.
+        Returns:
+            dict: 'datos' (bytes codificados), 'mime_type', 'ancho', 'alto', 'calidad',
+                  'bytes_originales', 'bytes_finales' e 'imagen' (PIL reducida, para recodificar).
+        """
+        with metricas_module.medir("codificacion_segundos", tipo="preprocesado"):
+            bytes_originales = tamano_original(fuente)
+            if isinstance(fuente, str):
+                imagen = almacenamiento_module.abrir_imagen(fuente) # Suelta en disco o dentro del paquete de su día
+            elif hasattr(fuente, "a_imagen"):
+                imagen = fuente.a_imagen()
+            else:
+                imagen = fuente
+
+            arriba, derecha, abajo, izquierda = self.recorte
+            if any(self.recorte):
+                imagen = imagen.crop((izquierda, arriba, imagen.width - derecha, imagen.height - abajo))
+            imagen = self._reducir(imagen, self.max_pixeles)
+            imagen = imagen.convert("L" if self.escala_grises else "RGB")
+            datos = self._codificar(imagen, self.calidad)
+        return {
+            "datos": datos,
+            "mime_type": FORMATOS_MIME[self.formato],
+            "ancho": imagen.width,
+            "alto": imagen.height,
+            "calidad": self.calidad,
+            "bytes_originales": bytes_originales,
+            "bytes_finales": len(datos),
+            "imagen": imagen,
+        }
+
+    def enviar(self, fuente):
+        """Encola el preprocesamiento en el pool. Retorna un Future con el dict de `preprocesar`."""
+        return self._pool.submit(self.preprocesar, fuente)
+
+    def ajustar_a_presupuesto(self, resultados):
+        """
+        Ajusta un conjunto de frames preprocesados al presupuesto de píxeles y bytes de una solicitud.
+        Primero reduce la resolución si se excede el presupuesto de píxeles; luego baja la calidad
+        (y, si hace falta, la resolución) de los frames más pesados hasta entrar en el de bytes.
+        Args:
+            resultados (list): Dicts retornados por `preprocesar` (se modifican en el lugar).
+        Returns:
+            list: Los mismos resultados.
+        """
+        if not resultados:
+            return resultados
+
+        total_pixeles = sum(r["ancho"] * r["alto"] for r in resultados)
+        if total_pixeles > self.max_pixeles_solicitud:
+            max_por_frame = self.max_pixeles_solicitud // len(resultados)
+            for resultado in resultados:
+                self._recodificar(resultado, self._reducir(resultado["imagen"], max_por_frame), resultado["calidad"])
+
+        intentos = 0
+        while sum(r["bytes_finales"] for r in resultados) > self.max_bytes_solicitud and intentos < 20:
+            intentos += 1
+            mas_pesado = max(resultados, key=lambda r: r["bytes_finales"])
+            if self.formato != "PNG" and mas_pesado["calidad"] - 10 >= CALIDAD_MINIMA:
+                self._recodificar(mas_pesado, mas_pesado["imagen"], mas_pesado["calidad"] - 10)
+            else:
+                imagen = mas_pesado["imagen"]
+                self._recodificar(mas_pesado, self._reducir(imagen, imagen.width * imagen.height // 2), mas_pesado["calidad"])
+        if intentos:
+            logger.info(f"Lote ajustado al presupuesto de {self.max_bytes_solicitud} bytes en {intentos} recodificaciones.")
+        return resultados
+
+    def _recodificar(self, resultado, imagen, calidad):
+        metricas_module.incrementar("recodificaciones_total")
+        with metricas_module.medir("codificacion_segundos", tipo="recodificacion"):
+            datos = self._codificar(imagen, calidad)
+        resultado.update({
+            "datos": datos,
+            "ancho": imagen.width,
+            "alto": imagen.height,
+            "calidad": calidad,
+            "bytes_finales": len(datos),
+            "imagen": imagen,
+        })
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False)
+
+
+def parte_para_modelo(resultado):
+    """Convierte un frame preprocesado en una parte de contenido (blob) para Gemini."""
+    return {"mime_type": resultado["mime_type"], "data": resultado["datos"]}
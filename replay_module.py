@@ -0,0 +1,225 @@
+# replay_module.py
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import ai_analysis_module
+import database_module
+import metricas_module
+import preprocess_module
+import screenshot_module
+from config import DISPOSITIVO, CAPTURE_INTERVAL_SECONDS, CAPTURE_MAX_INTERVAL_SECONDS
+from config import REPLAY_WORKERS, REPLAY_CONCURRENCY
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+EXTENSIONES = (".png", ".jpg", ".jpeg", ".webp") # Archivos considerados capturas
+
+
+def escanear_capturas(directorio, dispositivo=DISPOSITIVO):
+    """
+    Recorre `directorio` (y sus subdirectorios) buscando capturas con el nombre de screenshot_module.
+    Args:
+        directorio (str): Directorio con las capturas archivadas.
+        dispositivo (str): Solo las capturas de este dispositivo (y las del formato antiguo, sin
+                           dispositivo en el nombre). None para todas.
+    Returns:
+        list: (datetime, ruta) ordenadas por momento de captura.
+    """
+    capturas = []
+    ignoradas = 0
+    for raiz, _, archivos in os.walk(directorio):
+        for nombre in archivos:
+            if not nombre.lower().endswith(EXTENSIONES):
+                continue
+            datos = screenshot_module.parsear_nombre_captura(nombre)
+            if datos is None:
+                ignoradas += 1
+                continue
+            if dispositivo is not None and datos["dispositivo"] not in (dispositivo, None):
+                continue
+            capturas.append((datos["timestamp"], os.path.join(raiz, nombre)))
+    if ignoradas:
+        logger.warning(f"{ignoradas} archivos de {directorio} no tienen el formato de nombre de las capturas y se ignoran.")
+    capturas.sort()
+    return capturas
+
+
+def agrupar_en_ciclos(capturas, intervalo_segundos, intervalo_captura=CAPTURE_INTERVAL_SECONDS,
+                      pausa_maxima=CAPTURE_MAX_INTERVAL_SECONDS, dispositivo=DISPOSITIVO):
+    """
+    Agrupa las capturas en ciclos de análisis: un ciclo empieza con la primera captura que cae fuera
+    de la ventana de `intervalo_segundos` del ciclo anterior, igual que en la captura en vivo.
+    Args:
+        capturas (list): (datetime, ruta) ordenadas, como las retorna `escanear_capturas`.
+        intervalo_segundos (float): Duración de cada ciclo (ANALYSIS_INTERVAL_SECONDS).
+        intervalo_captura (float): Tiempo en pantalla asignado a la última captura de cada ciclo.
+        pausa_maxima (float): Tope del tiempo en pantalla de una captura (huecos por suspensión, etc.).
+        dispositivo (str): Dispositivo, para la clave del ciclo.
+    Returns:
+        list: dicts con 'clave', 'rutas', 'timestamps', 'duraciones', 'inicio' y 'fin'.
+    """
+    grupos = []
+    for momento, ruta in capturas:
+        if not grupos or (momento - grupos[-1][0][0]).total_seconds() >= intervalo_segundos:
+            grupos.append([])
+        grupos[-1].append((momento, ruta))
+
+    ciclos = []
+    for grupo in grupos:
+        timestamps = [momento for momento, _ in grupo]
+        distintos = sorted(set(timestamps)) # Varios monitores comparten el mismo momento
+        siguiente = {a: min((b - a).total_seconds(), pausa_maxima) for a, b in zip(distintos, distintos[1:])}
+        duraciones = [siguiente.get(momento, intervalo_captura) for momento in timestamps]
+        inicio, fin = timestamps[0], timestamps[-1]
+        ciclos.append({
+            "clave": f"{dispositivo}:{database_module.a_epoch(inicio)}:{database_module.a_epoch(fin)}:{len(grupo)}",
+            "rutas": [ruta for _, ruta in grupo],
+            "timestamps": timestamps,
+            "duraciones": duraciones,
+            "inicio": inicio,
+            "fin": fin,
+        })
+    return ciclos
+
+
+# --- Preprocesamiento en procesos (un PreprocesadorImagenes por proceso) ---
+_preprocesador_proceso = None
+
+def _inicializar_proceso(opciones):
+    global _preprocesador_proceso
+    _preprocesador_proceso = preprocess_module.PreprocesadorImagenes(hilos=1, **opciones)
+
+def _preprocesar_en_proceso(ruta):
+    """Decodifica y preprocesa una captura en un proceso del pool. El resultado (con la imagen reducida) vuelve por pickle."""
+    return _preprocesador_proceso.preprocesar(ruta)
+
+
+class Reprocesador:
+    """
+    Reprocesa capturas archivadas sin esperar el tiempo real: los ciclos se analizan y guardan
+    de a `concurrencia` a la vez mientras un pool de procesos decodifica y preprocesa las imágenes.
+    El resultado de cada ciclo queda registrado en la tabla 'replay_progreso', de modo que una
+    ejecución interrumpida continúa donde se detuvo.
+    """
+
+    def __init__(self, analizar, guardar, notificar=None, opciones_preprocesado=None,
+                 procesos=REPLAY_WORKERS, concurrencia=REPLAY_CONCURRENCY):
+        """
+        Args:
+            analizar (callable): Etapa de análisis (lote -> lote con 'resumen'), ej: main.analizar_lote.
+            guardar (callable): Etapa de almacenamiento (lote -> lote con 'batch_id'), ej: main.guardar_lote.
+            notificar (callable): Opcional. Etapa de notificación para cada ciclo completado.
+            opciones_preprocesado (dict): Argumentos de PreprocesadorImagenes para el pool de procesos;
+                None si el modo de análisis no usa frames preprocesados (los frames van como rutas).
+            procesos (int): Procesos del pool (0 = uno por núcleo).
+            concurrencia (int): Ciclos en análisis y almacenamiento a la vez.
+        """
+        self.analizar = analizar
+        self.guardar = guardar
+        self.notificar = notificar
+        self.opciones_preprocesado = opciones_preprocesado
+        self.procesos = procesos or os.cpu_count() or 1
+        self.concurrencia = max(1, concurrencia)
+        self.completados = 0
+        self.errores = 0
+        self.omitidos = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _lote(self, ciclo):
+        """Arma un lote con la misma forma que main.capturar_lote, con los frames como rutas."""
+        frames = []
+        for ruta, momento, duracion in zip(ciclo["rutas"], ciclo["timestamps"], ciclo["duraciones"]):
+            frames.append({
+                "frame": ruta, "ruta": ruta, "inicio": momento, "duracion_segundos": duracion, "repeticiones": 1,
+                "preprocesado": self._pool.submit(_preprocesar_en_proceso, ruta) if self._pool else None,
+            })
+        return {"rutas": list(ciclo["rutas"]), "frames": frames, "inicio": ciclo["inicio"], "fin": ciclo["fin"]}
+
+    def _procesar(self, ciclo):
+        """Analiza y guarda un ciclo. Retorna 'completado' o 'error'."""
+        with metricas_module.medir("ciclo_reprocesado_segundos"):
+            lote = self.analizar(self._lote(ciclo))
+            if ai_analysis_module.es_resumen_error(lote.get("resumen")):
+                database_module.marcar_ciclo_reprocesado(ciclo["clave"], "error")
+                return "error"
+            lote = self.guardar(lote)
+            if not lote.get("batch_id"):
+                database_module.marcar_ciclo_reprocesado(ciclo["clave"], "error")
+                return "error"
+            database_module.marcar_ciclo_reprocesado(ciclo["clave"], "completado", lote["batch_id"])
+        if self.notificar:
+            self.notificar(lote)
+        return "completado"
+
+    def pendientes(self, ciclos):
+        """
+        Descarta los ciclos completados en ejecuciones anteriores y, de los restantes, las capturas que
+        ya tienen un resumen válido (ej: guardadas en vivo antes de que fallara el análisis siguiente).
+        """
+        completados = database_module.ciclos_reprocesados(ciclo["clave"] for ciclo in ciclos)
+        restantes = []
+        for ciclo in ciclos:
+            if ciclo["clave"] in completados:
+                self.omitidos += 1
+                continue
+            analizadas = database_module.rutas_analizadas(ciclo["rutas"])
+            if analizadas:
+                conservar = [i for i, ruta in enumerate(ciclo["rutas"]) if ruta not in analizadas]
+                if not conservar:
+                    self.omitidos += 1
+                    database_module.marcar_ciclo_reprocesado(ciclo["clave"], "completado")
+                    continue
+                ciclo = dict(ciclo, **{campo: [ciclo[campo][i] for i in conservar]
+                                        for campo in ("rutas", "timestamps", "duraciones")})
+            restantes.append(ciclo)
+        return restantes
+
+    def ejecutar(self, ciclos):
+        """
+        Reprocesa los ciclos pendientes.
+        Returns:
+            dict: Ciclos 'completados', 'errores' y 'omitidos' (ya hechos), y 'duracion_segundos'.
+        """
+        inicio = time.perf_counter()
+        ciclos = self.pendientes(ciclos)
+        logger.info(f"[{DISPOSITIVO}] Reprocesamiento: {len(ciclos)} ciclos pendientes ({self.omitidos} ya completados), "
+                    f"{sum(len(c['rutas']) for c in ciclos)} capturas, {self.concurrencia} ciclos a la vez.")
+        if self.opciones_preprocesado is not None:
+            # 'spawn': los procesos no heredan los hilos (escritor SQLite, subidor) ni las conexiones del proceso principal
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_inicializar_proceso, initargs=(self.opciones_preprocesado,))
+        ejecutor = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="reprocesado")
+        try:
+            futuros = {ejecutor.submit(self._procesar, ciclo): ciclo for ciclo in ciclos}
+            for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                ciclo = futuros[futuro]
+                try:
+                    estado = futuro.result()
+                except Exception as e:
+                    logger.error(f"[{DISPOSITIVO}] Error al reprocesar el ciclo {ciclo['clave']}: {e}", exc_info=True)
+                    database_module.marcar_ciclo_reprocesado(ciclo["clave"], "error")
+                    estado = "error"
+                metricas_module.incrementar("ciclos_reprocesados_total", estado=estado)
+                with self._lock:
+                    if estado == "completado":
+                        self.completados += 1
+                    else:
+                        self.errores += 1
+                logger.info(f"[{DISPOSITIVO}] Reprocesamiento: {hechos}/{len(ciclos)} ciclos "
+                            f"({ciclo['inicio'].strftime('%Y-%m-%d %H:%M:%S')}: {estado}).")
+        except KeyboardInterrupt:
+            logger.warning(f"[{DISPOSITIVO}] Reprocesamiento interrumpido: se retomará desde el último ciclo guardado.")
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            ejecutor.shutdown(wait=True)
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+        return {"completados": self.completados, "errores": self.errores, "omitidos": self.omitidos,
+                "duracion_segundos": round(time.perf_counter() - inicio, 2)}
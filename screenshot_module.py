@@ -1,28 +1,262 @@
 # screenshot_module.py
-import mss
-import mss.tools
+import logging
 import os
+import queue
+import re
+import threading
 from datetime import datetime
+
 from config import SCREENSHOTS_DIR
+import metricas_module
+
+logger = logging.getLogger(__name__) # Logger para este módulo
+
+# screenshot_{DISPOSITIVO}_YYYYMMDD_HHMMSS[_mmm].png y el formato antiguo screenshot_YYYYMMDD_HHMMSS_monitorN.png.
+# Se interpreta desde el final para que el nombre del dispositivo pueda contener '_'.
+PATRON_NOMBRE = re.compile(
+    r"^screenshot_(?:(?P<dispositivo>.+?)_)??(?P<fecha>\d{8})_(?P<hora>\d{6})(?:_(?P<ms>\d{3}))?"
+    r"(?:_monitor(?P<monitor>\d+))?\.\w+$"
+)
+
+
+def parsear_nombre_captura(ruta):
+    """
+    Lee el dispositivo, el momento y el monitor del nombre de un archivo de captura.
+    Returns:
+        dict: 'dispositivo' (None en el formato antiguo), 'timestamp' (datetime) y 'monitor' (int o None),
+              o None si el nombre no tiene el formato de las capturas.
+    """
+    coincidencia = PATRON_NOMBRE.match(os.path.basename(ruta))
+    if not coincidencia:
+        return None
+    try:
+        timestamp = datetime.strptime(coincidencia.group("fecha") + coincidencia.group("hora"), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    if coincidencia.group("ms"):
+        timestamp = timestamp.replace(microsecond=int(coincidencia.group("ms")) * 1000)
+    monitor = coincidencia.group("monitor")
+    return {"dispositivo": coincidencia.group("dispositivo"), "timestamp": timestamp,
+            "monitor": int(monitor) if monitor else None}
+
+
+class Frame:
+    """
+    Captura en memoria de un monitor.
+    Guarda el buffer BGRA tal como lo entrega mss, sin copiarlo ni codificarlo.
+    """
+
+    __slots__ = ("raw", "ancho", "alto", "timestamp", "monitor", "ruta")
+
+    def __init__(self, raw, ancho, alto, timestamp, monitor=1, ruta=None):
+        self.raw = raw # bytearray BGRA de mss
+        self.ancho = ancho
+        self.alto = alto
+        self.timestamp = timestamp
+        self.monitor = monitor
+        self.ruta = ruta # Ruta del archivo asociado (solo se escribe a disco si se persiste el frame)
+
+    @property
+    def datos(self):
+        """memoryview sobre el buffer BGRA (sin copia)."""
+        return memoryview(self.raw)
+
+    @property
+    def tamano_bytes(self):
+        return len(self.raw)
+
+    def a_imagen(self):
+        """Convierte el buffer BGRA a una PIL.Image RGB (solo cuando una etapa necesita píxeles)."""
+        from PIL import Image # Importación diferida: PIL no se carga hasta que se necesitan píxeles
+        return Image.frombuffer("RGB", (self.ancho, self.alto), self.raw, "raw", "BGRX", 0, 1)
+
+
+class CapturadorPantalla:
+    """
+    Mantiene una única sesión de mss abierta y la reutiliza en cada captura.
+    mss no es seguro entre hilos: cada instancia debe usarse desde un solo hilo.
+    """
+
+    def __init__(self):
+        self._sct = None
+
+    def _sesion(self):
+        if self._sct is None:
+            import mss # Importación diferida: mss (y su backend gráfico) se carga en la primera captura
+            self._sct = mss.mss()
+        return self._sct
+
+    def monitores(self):
+        """Monitores físicos (ignora el monitor combinado de índice 0 si hay más de uno)."""
+        monitores = self._sesion().monitors
+        return monitores[1:] if len(monitores) > 1 else monitores
+
+    def capturar(self, monitor=1):
+        """
+        Captura un monitor en memoria.
+        Args:
+            monitor (int): Número de monitor (1 = principal).
+        Returns:
+            Frame: El frame capturado.
+        """
+        sct = self._sesion()
+        sct_img = sct.grab(sct.monitors[monitor])
+        return Frame(sct_img.raw, sct_img.width, sct_img.height, datetime.now(), monitor)
+
+    def capturar_todos(self):
+        """Captura todos los monitores físicos. Retorna una lista de Frame."""
+        sct = self._sesion()
+        frames = []
+        for numero, monitor in enumerate(self.monitores(), start=1):
+            sct_img = sct.grab(monitor)
+            frames.append(Frame(sct_img.raw, sct_img.width, sct_img.height, datetime.now(), numero))
+        return frames
+
+    def cerrar(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+
+class MuestreadorAdaptativo:
+    """
+    Ajusta la pausa entre capturas según cuánto cambia la pantalla.
+    Compara una miniatura muy reducida de cada frame (muestreo con paso fijo sobre el buffer BGRA,
+    sin copiar la imagen completa) con la del frame anterior: si la pantalla cambia rápido, reduce
+    la pausa a la mitad hasta el mínimo; si está estática, la multiplica hasta el máximo.
+    """
+
+    def __init__(self, intervalo_inicial=2.0, intervalo_minimo=0.5, intervalo_maximo=30.0,
+                 umbral_cambio=0.02, umbral_estatico=0.002, factor_backoff=2.0, ancho_miniatura=64):
+        """
+        Args:
+            intervalo_inicial (float): Pausa inicial entre capturas, en segundos.
+            intervalo_minimo (float): Pausa mínima (tasa máxima de captura).
+            intervalo_maximo (float): Pausa máxima (tasa mínima de captura).
+            umbral_cambio (float): Diferencia media (0-1) a partir de la cual la pantalla cambia rápido.
+            umbral_estatico (float): Diferencia media (0-1) por debajo de la cual la pantalla está estática.
+            factor_backoff (float): Multiplicador de la pausa mientras la pantalla está estática.
+            ancho_miniatura (int): Ancho aproximado de la miniatura usada para comparar.
+        """
+        self.intervalo_minimo = intervalo_minimo
+        self.intervalo_maximo = intervalo_maximo
+        self.intervalo = min(max(intervalo_inicial, intervalo_minimo), intervalo_maximo)
+        self.umbral_cambio = umbral_cambio
+        self.umbral_estatico = umbral_estatico
+        self.factor_backoff = factor_backoff
+        self.ancho_miniatura = ancho_miniatura
+        self.ultimo_puntaje = None
+        self._miniatura_anterior = None
+
+    def _miniatura(self, frame):
+        import numpy as np
+        paso = max(1, frame.ancho // self.ancho_miniatura)
+        pixeles = np.frombuffer(frame.raw, dtype=np.uint8).reshape(frame.alto, frame.ancho, 4)
+        return pixeles[::paso, ::paso, 1].astype(np.int16) # Canal verde como aproximación de la luminancia
+
+    def puntaje_cambio(self, frame):
+        """
+        Diferencia media absoluta (0-1) entre la miniatura del frame y la del frame anterior.
+        Retorna None para el primer frame.
+        """
+        miniatura = self._miniatura(frame)
+        anterior, self._miniatura_anterior = self._miniatura_anterior, miniatura
+        if anterior is None or anterior.shape != miniatura.shape:
+            return None
+        return float(abs(miniatura - anterior).mean()) / 255.0
+
+    def siguiente_intervalo(self, frame):
+        """Registra el frame recién capturado y retorna la pausa hasta la próxima captura, en segundos."""
+        puntaje = self.puntaje_cambio(frame)
+        self.ultimo_puntaje = puntaje
+        if puntaje is not None:
+            if puntaje >= self.umbral_cambio:
+                self.intervalo = max(self.intervalo_minimo, self.intervalo / 2)
+            elif puntaje <= self.umbral_estatico:
+                self.intervalo = min(self.intervalo_maximo, self.intervalo * self.factor_backoff)
+        return self.intervalo
+
+
+def guardar_frame(frame, ruta):
+    """Codifica el frame como PNG (compresión rápida) y lo guarda en `ruta`, creando el directorio si falta."""
+    directorio = os.path.dirname(ruta)
+    if directorio and not os.path.isdir(directorio):
+        os.makedirs(directorio, exist_ok=True)
+    with metricas_module.medir("codificacion_segundos", tipo="png"):
+        frame.a_imagen().save(ruta, "PNG", compress_level=1)
+    frame.ruta = ruta
+    return ruta
+
+
+class EscritorFrames:
+    """
+    Persiste frames en disco desde un hilo en segundo plano, para que la codificación PNG
+    y la escritura no bloqueen el bucle de captura.
+    """
+
+    def __init__(self, capacidad=16):
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._hilo = threading.Thread(target=self._bucle, name="escritor_frames", daemon=True)
+        self._hilo.start()
+
+    def guardar(self, frame, ruta):
+        """
+        Encola el frame para guardarlo en `ruta` y retorna `ruta`. `frame.ruta` se asigna recién cuando
+        el archivo quedó escrito (ver guardar_frame); si la escritura falla, queda en None.
+        Si la cola está llena (disco lento), el frame no se persiste y se retorna None.
+        """
+        try:
+            self._cola.put_nowait((frame, ruta))
+        except queue.Full:
+            logger.warning(f"Cola de escritura llena: no se persistirá {ruta}.")
+            return None
+        return ruta
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def esperar(self):
+        """Bloquea hasta que todos los frames encolados estén escritos."""
+        self._cola.join()
+
+    def _bucle(self):
+        while True:
+            frame, ruta = self._cola.get()
+            try:
+                guardar_frame(frame, ruta) # Asigna frame.ruta solo si la escritura terminó bien
+            except Exception as e:
+                metricas_module.incrementar("errores_total", etapa="escritura")
+                logger.error(f"Error al guardar el frame en {ruta}: {e}")
+            finally:
+                self._cola.task_done()
+
+
+_hilo_local = threading.local()
+
+
+def obtener_capturador():
+    """Retorna el CapturadorPantalla del hilo actual (uno por hilo, reutilizado entre llamadas)."""
+    capturador = getattr(_hilo_local, "capturador", None)
+    if capturador is None:
+        capturador = CapturadorPantalla()
+        _hilo_local.capturador = capturador
+    return capturador
+
 
 def capturar_pantallas():
     """Captura screenshots de todos los monitores activos."""
-    with mss.mss() as sct:
-        monitores = sct.monitors[1:]  # Ignora el monitor combinado (índice 0) si existe, y captura el resto. Si solo tienes uno, ajusta esto.
-        filepaths = []
-        for monitor_number, monitor in enumerate(monitores):
-            # Formato de nombre de archivo: screenshot_YYYYMMDD_HHMMSS_monitorN.png
-            timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"screenshot_{timestamp_str}_monitor{monitor_number+1}.png"
-            filepath = os.path.join(SCREENSHOTS_DIR, filename)
-
-            sct_img = sct.grab(monitor) # Captura el monitor actual
-            mss.tools.to_png(sct_img.rgb, sct_img.size, output=filepath) # Guarda como PNG
-            filepaths.append(filepath)
-            print(f"Screenshot guardado: {filepath}")
-        return filepaths
+    filepaths = []
+    for frame in obtener_capturador().capturar_todos():
+        # Formato de nombre de archivo: screenshot_YYYYMMDD_HHMMSS_monitorN.png
+        timestamp_str = frame.timestamp.strftime("%Y%m%d_%H%M%S")
+        filename = f"screenshot_{timestamp_str}_monitor{frame.monitor}.png"
+        filepath = os.path.join(SCREENSHOTS_DIR, filename)
+        guardar_frame(frame, filepath)
+        filepaths.append(filepath)
+        print(f"Screenshot guardado: {filepath}")
+    return filepaths
 
 
 if __name__ == '__main__':
     paths = capturar_pantallas() # Para probar la captura directamente
-    print("Rutas de screenshots capturadas:", paths)
\ No newline at end of file
+    print("Rutas de screenshots capturadas:", paths)
@@ -0,0 +1,31 @@
+# conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# config.py lee el entorno al importarse: la base por defecto de las pruebas va a un directorio temporal
+os.environ.setdefault("DATABASE_NAME", os.path.join(tempfile.mkdtemp(prefix="analizador_pruebas_"), "pruebas.db"))
+os.environ.setdefault("METRICS_LOG_JSON", "false")
+os.environ.setdefault("AI_CACHE_ENABLED", "false")
+os.environ.setdefault("AI_REQUESTS_PER_MINUTE", "0")
+
+
+@pytest.fixture
+def base_temporal(tmp_path, monkeypatch):
+    """Apunta database_module a una base vacía en `tmp_path`, con su propio escritor. Retorna la ruta."""
+    import database_module
+    ruta = str(tmp_path / "analizador.db")
+    monkeypatch.setattr(database_module, "DATABASE_PATH", ruta)
+    monkeypatch.setattr(database_module, "_escritor", None)
+    database_module._lectura_local.__dict__.pop("conexion", None)
+    yield ruta
+    if database_module._escritor is not None:
+        database_module._escritor.cerrar()
+    conexion = database_module._lectura_local.__dict__.pop("conexion", None)
+    if conexion is not None:
+        conexion.close()
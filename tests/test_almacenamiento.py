@@ -0,0 +1,36 @@
+# test_almacenamiento.py
+import os
+from datetime import datetime, timedelta
+
+import almacenamiento_module
+import database_module
+import replay_module
+from config import DISPOSITIVO
+
+
+def crear_captura(directorio, momento):
+    ruta = os.path.join(directorio, f"screenshot_{DISPOSITIVO}_{momento.strftime('%Y%m%d_%H%M%S')}_000.png")
+    with open(ruta, "wb") as archivo:
+        archivo.write(os.urandom(64))
+    return ruta
+
+
+def test_solo_se_empaquetan_frames_analizados(base_temporal, tmp_path):
+    database_module.crear_tablas()
+    directorio = str(tmp_path / "capturas")
+    os.makedirs(directorio)
+    momento = datetime(2026, 1, 1, 12, 0, 0)
+    analizada, sin_analizar, con_error = (crear_captura(directorio, momento + timedelta(minutes=i)) for i in range(3))
+    contenido = open(analizada, "rb").read()
+    database_module.guardar_batch_db([analizada], [momento], '{"analisis_conjunto": "Editor."}', momento, momento)
+    database_module.guardar_batch_db([con_error], [momento], "Error en el análisis de IA.", momento, momento)
+
+    gestor = almacenamiento_module.GestorAlmacenamiento(directorio, os.path.join(directorio, "archivo"), empaquetar_horas=1,
+                                                        formato="original", cuota_bytes=0, libre_minimo_bytes=0)
+    resultado = gestor.ejecutar_una_vez(ahora=momento + timedelta(days=2))
+
+    assert resultado["empaquetados"] == 1
+    assert not os.path.exists(analizada)
+    assert almacenamiento_module.leer_captura(analizada) == contenido # Sin recodificar
+    pendientes = [ruta for _, ruta in replay_module.escanear_capturas(directorio)]
+    assert pendientes == [sin_analizar, con_error] # --reprocesar sigue encontrándolas
@@ -0,0 +1,39 @@
+# test_cache.py
+import sqlite3
+
+import cache_module
+import database_module
+
+
+def test_escrituras_por_el_escritor_compartido(base_temporal, monkeypatch):
+    escritor = database_module.obtener_escritor()
+    cache = cache_module.CacheResultados(escritor, max_entradas=2)
+    operaciones = []
+    enviar = escritor.enviar
+    monkeypatch.setattr(escritor, "enviar", lambda operacion: operaciones.append(operacion) or enviar(operacion))
+    try:
+        cache.guardar("a", "resultado a").result(5)
+        assert cache.obtener("a") == "resultado a"
+        assert cache.obtener("b") is None
+        for clave in ("b", "c"):
+            cache.guardar(clave, f"resultado {clave}")
+        assert len(operaciones) == 3 # Solo los guardar: un acierto reciente no reescribe ultimo_acceso
+        enviar(lambda conexion: None).result(5) # Espera a que se confirmen las escrituras encoladas
+        assert cache.estadisticas() == {"aciertos": 1, "fallos": 1, "tasa_aciertos": 0.5, "entradas": 2}
+    finally:
+        cache.cerrar()
+
+
+def test_acierto_no_abre_una_transaccion_propia(base_temporal, monkeypatch):
+    escritor = database_module.obtener_escritor()
+    cache = cache_module.CacheResultados(escritor)
+    cache.guardar("a", "resultado a").result(5)
+    monkeypatch.setattr(cache, "ACTUALIZAR_ACCESO_SEGUNDOS", 0)
+    conexion = sqlite3.connect(base_temporal)
+    conexion.execute("BEGIN IMMEDIATE") # Otro proceso con el lock de escritura: la lectura no debe esperarlo
+    try:
+        assert cache.obtener("a") == "resultado a"
+    finally:
+        conexion.rollback()
+        conexion.close()
+        cache.cerrar()
@@ -0,0 +1,89 @@
+# test_captura.py
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database_module
+import main
+import screenshot_module
+
+
+def crear_frame(segundos=0):
+    return screenshot_module.Frame(b"\x00" * 16, 2, 2, datetime(2026, 1, 1, 12, 0, 0) + timedelta(seconds=segundos))
+
+
+def test_escritor_lleno_no_asigna_ruta(monkeypatch, tmp_path):
+    tomado, liberar = threading.Event(), threading.Event()
+    guardar_frame = screenshot_module.guardar_frame
+    def escritura_lenta(frame, ruta):
+        tomado.set()
+        liberar.wait(5)
+        return guardar_frame(frame, ruta)
+    monkeypatch.setattr(screenshot_module, "guardar_frame", escritura_lenta)
+    escritor = screenshot_module.EscritorFrames(capacidad=1)
+    frames = [crear_frame(i) for i in range(3)]
+    try:
+        aceptado = escritor.guardar(frames[0], str(tmp_path / "a.png"))
+        assert tomado.wait(5) # El hilo toma el primero y queda bloqueado escribiéndolo
+        escritor.guardar(frames[1], str(tmp_path / "b.png"))
+        descartado = escritor.guardar(frames[2], str(tmp_path / "c.png"))
+        assert frames[0].ruta is None # Encolado, pero todavía sin escribir
+    finally:
+        liberar.set()
+    escritor.esperar()
+    assert aceptado == frames[0].ruta and os.path.exists(aceptado)
+    assert descartado is None and frames[2].ruta is None
+
+
+def test_escritura_fallida_no_asigna_ruta(tmp_path):
+    (tmp_path / "archivo").write_text("no es un directorio")
+    escritor = screenshot_module.EscritorFrames()
+    escrito, fallido = crear_frame(0), crear_frame(1)
+    assert escritor.guardar(escrito, str(tmp_path / "a.png"))
+    assert escritor.guardar(fallido, str(tmp_path / "archivo" / "b.png")) # Aceptado, pero la escritura falla
+    escritor.esperar()
+    assert escrito.ruta == str(tmp_path / "a.png")
+    assert fallido.ruta is None
+
+
+def test_capturar_pantalla_no_inventa_ruta(monkeypatch):
+    class Capturador:
+        def capturar(self):
+            return crear_frame()
+    monkeypatch.setattr(screenshot_module, "obtener_capturador", lambda: Capturador())
+    frame = main.capturar_pantalla()
+    assert frame.ruta is None
+    assert screenshot_module.parsear_nombre_captura(main.ruta_prevista(frame))["timestamp"] == frame.timestamp
+
+
+def test_guardar_lote_solo_registra_frames_en_disco(base_temporal, monkeypatch, tmp_path):
+    database_module.crear_tablas()
+    guardar_frame = screenshot_module.guardar_frame
+    def escritura_lenta(frame, ruta):
+        time.sleep(0.2) # guardar_lote debe esperar a la escritura, no leer frame.ruta antes de tiempo
+        return guardar_frame(frame, ruta)
+    monkeypatch.setattr(screenshot_module, "guardar_frame", escritura_lenta)
+    monkeypatch.setattr(main, "_escritor_frames", screenshot_module.EscritorFrames())
+    (tmp_path / "archivo").write_text("no es un directorio")
+
+    frames = [crear_frame(i) for i in range(3)]
+    main.obtener_escritor_frames().guardar(frames[0], str(tmp_path / "escrito.png"))
+    main.obtener_escritor_frames().guardar(frames[1], str(tmp_path / "archivo" / "fallido.png")) # La escritura falla
+    # frames[2]: no persistido (CAPTURE_PERSIST=false o cola llena); el cuarto es una ruta que ya no existe
+    inicio = datetime(2026, 1, 1, 12, 0, 0)
+    lote = {
+        "frames": [{"frame": fuente, "ruta": main.ruta_de(fuente), "inicio": inicio + timedelta(seconds=2 * i),
+                    "duracion_segundos": 2, "repeticiones": 1}
+                   for i, fuente in enumerate(frames + [str(tmp_path / "borrado.png")])],
+        "inicio": inicio, "fin": inicio + timedelta(seconds=8), "resumen": "resumen", "campos": None,
+    }
+    lote["rutas"] = [frame["ruta"] for frame in lote["frames"]]
+    lote = main.guardar_lote(lote)
+
+    conexion = sqlite3.connect(base_temporal)
+    assert [fila[0] for fila in conexion.execute("SELECT filepath FROM screenshots")] == [str(tmp_path / "escrito.png")]
+    assert conexion.execute("SELECT COUNT(*) FROM firebase_outbox WHERE ruta LIKE '/resumenes_globales/%'").fetchone()[0] == 1
+    conexion.close()
+    assert lote["batch_id"] and len(lote["screenshot_ids"]) == 1
@@ -0,0 +1,121 @@
+# test_colector.py
+import gzip
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import urllib.error
+import urllib.request
+
+import pytest
+
+import colector_module
+
+
+def crear_lote(id_agente, inicio, resumen="Usuario navegando en youtube.com."):
+    return {"id": id_agente, "inicio": inicio, "fin": inicio + 60, "timestamp": inicio + 60, "num_screenshots": 1,
+            "resumen": resumen, "campos": {"analisis_conjunto": resumen},
+            "screenshots": [{"timestamp": inicio, "filepath": f"capturas/{inicio}.png"}]}
+
+
+@pytest.fixture
+def colector(tmp_path):
+    almacen = colector_module.AlmacenColector(str(tmp_path / "colector"))
+    servidor = colector_module.ServidorColector(almacen, "127.0.0.1", 0, token="")
+    yield almacen, f"http://127.0.0.1:{servidor.puerto}"
+    servidor.cerrar()
+    almacen.cerrar()
+
+
+def enviar(url, envio):
+    """POST de un envío (dict o texto JSON) comprimido, como lo hace SubidorColector."""
+    datos = envio if isinstance(envio, str) else json.dumps(envio)
+    solicitud = urllib.request.Request(url + colector_module.RUTA_LOTES, data=gzip.compress(datos.encode("utf-8")),
+                                       method="POST", headers={"Content-Encoding": "gzip"})
+    try:
+        with urllib.request.urlopen(solicitud, timeout=10) as respuesta:
+            return respuesta.status, json.loads(respuesta.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def obtener(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as respuesta:
+            return respuesta.status, json.loads(respuesta.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_base_recreada_no_se_descarta_como_duplicada(colector):
+    almacen, _ = colector
+    primero = almacen.ingerir({"dispositivo": "pc1", "lotes": [crear_lote(1, 1000), crear_lote(2, 2000)]})
+    reenvio = almacen.ingerir({"dispositivo": "pc1", "lotes": [crear_lote(2, 2000)]})
+    recreada = almacen.ingerir({"dispositivo": "pc1", "lotes": [crear_lote(1, 3000), crear_lote(2, 4000)]}) # IDs reiniciados
+    assert (primero["nuevos"], reenvio["duplicados"], recreada["nuevos"]) == (2, 1, 2)
+    assert sorted(f["inicio"] for f in almacen.consultar()) == [1000, 2000, 3000, 4000]
+
+
+def test_busqueda_con_texto_libre(colector):
+    almacen, url = colector
+    almacen.ingerir({"dispositivo": "pc1", "lotes": [crear_lote(1, 1000), crear_lote(2, 2000, "Editor de texto.")]})
+    codigo, cuerpo = obtener(f"{url}{colector_module.RUTA_RESUMENES}?q=youtube.com")
+    assert codigo == 200
+    assert [f["inicio"] for f in cuerpo["resumenes"]] == [1000]
+    codigo, cuerpo = obtener(f"{url}{colector_module.RUTA_RESUMENES}?q=editor%20OR%20youtube&fts=1")
+    assert codigo == 200 and len(cuerpo["resumenes"]) == 2
+
+
+@pytest.mark.parametrize("lote", [
+    dict(crear_lote(1, 1000), campos=["analisis_conjunto"]),
+    dict(crear_lote(1, 1000), resumen={"analisis_conjunto": "x"}),
+    dict(crear_lote(1, 1000), screenshots=[{"timestamp": 1000}]),
+    dict(crear_lote(1, 1000), screenshots=["capturas/1000.png"]),
+    dict(crear_lote(1, 1000), num_screenshots="1"),
+    {"inicio": 1000},
+])
+def test_lote_mal_formado_responde_400(colector, lote):
+    almacen, url = colector
+    codigo, cuerpo = enviar(url, {"dispositivo": "pc1", "lotes": [crear_lote(1, 500), lote]})
+    assert codigo == 400 and "error" in cuerpo
+    assert almacen.consultar() == [] # El envío se rechaza entero
+    assert enviar(url, {"dispositivo": "pc1", "lotes": [crear_lote(1, 500)]}) == (200, {"recibidos": 1, "nuevos": 1, "duplicados": 0})
+
+
+def test_envio_que_no_es_objeto_responde_400(colector):
+    _, url = colector
+    assert enviar(url, "[1, 2]")[0] == 400
+
+
+AGENTE = textwrap.dedent("""
+    from datetime import datetime, timedelta
+    import colector_module, database_module
+    database_module.crear_tablas()
+    base = datetime(2026, 1, 1, 12, 0, 0)
+    for i in range(3):
+        inicio = base + timedelta(minutes=i)
+        database_module.guardar_batch_db([f"capturas/{i}.png"], [inicio], '{"analisis_conjunto": "Editor de texto."}',
+                                         inicio, inicio + timedelta(seconds=59))
+    subidor = colector_module.SubidorColector()
+    assert subidor.vaciar() == 3
+    assert subidor.vaciar() == 0
+    database_module.obtener_escritor().cerrar()
+""")
+
+
+def test_varios_agentes_y_un_colector(colector, tmp_path):
+    almacen, url = colector
+    procesos = []
+    for numero in range(3): # Cada agente es un proceso con su propia base, como en un mismo equipo
+        directorio = tmp_path / f"agente{numero}"
+        directorio.mkdir()
+        entorno = dict(os.environ, DISPOSITIVO=f"pc{numero}", DATABASE_NAME="agente.db", COLLECTOR_URL=url,
+                       COLLECTOR_TOKEN="", PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        procesos.append(subprocess.Popen([sys.executable, "-c", AGENTE], cwd=directorio, env=entorno,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+    for proceso in procesos:
+        salida = proceso.communicate(timeout=60)[0]
+        assert proceso.returncode == 0, salida.decode("utf-8", "replace")
+    assert sorted((d["dispositivo"], d["lotes"]) for d in almacen.dispositivos()) == [("pc0", 3), ("pc1", 3), ("pc2", 3)]
+    assert len(almacen.consultar(consulta="editor")) == 9
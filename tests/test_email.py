@@ -0,0 +1,195 @@
+# test_email.py
+import socketserver
+import threading
+import time
+from email.mime.text import MIMEText
+
+import pytest
+
+import email_module
+
+
+class ServidorSMTPLocal(socketserver.ThreadingTCPServer):
+    """Servidor SMTP mínimo en 127.0.0.1 (sin TLS ni autenticación) que registra lo que recibe."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ManejadorSMTP)
+        self.puerto = self.server_address[1]
+        self.conexiones = 0
+        self.noops = 0
+        self.mensajes = []
+        self.rechazos_pendientes = 0 # Próximos DATA que se responden con 451 (error transitorio)
+        self.sockets = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def cortar_conexiones(self):
+        """Cierra del lado del servidor las conexiones abiertas (como un timeout de inactividad)."""
+        with self._lock:
+            sockets, self.sockets = self.sockets, []
+        for conexion in sockets:
+            try:
+                conexion.shutdown(2)
+            except OSError:
+                pass
+
+    def cerrar(self):
+        self.cortar_conexiones()
+        self.shutdown()
+        self.server_close()
+
+
+class ManejadorSMTP(socketserver.StreamRequestHandler):
+    def responder(self, linea):
+        self.wfile.write((linea + "\r\n").encode())
+
+    def handle(self):
+        servidor = self.server
+        with servidor._lock:
+            servidor.conexiones += 1
+            servidor.sockets.append(self.request)
+        self.responder("220 local ESMTP")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode().strip().upper()
+            if comando.startswith(("EHLO", "HELO")):
+                self.responder("250 local")
+            elif comando == "NOOP":
+                servidor.noops += 1
+                self.responder("250 OK")
+            elif comando == "DATA":
+                self.responder("354 Fin con <CRLF>.<CRLF>")
+                datos = []
+                for linea in iter(self.rfile.readline, b""):
+                    if linea in (b".\r\n", b".\n"):
+                        break
+                    datos.append(linea.decode())
+                with servidor._lock:
+                    rechazar = servidor.rechazos_pendientes > 0
+                    servidor.rechazos_pendientes -= rechazar
+                if rechazar:
+                    self.responder("451 Intente más tarde")
+                else:
+                    servidor.mensajes.append("".join(datos))
+                    self.responder("250 Aceptado")
+            elif comando == "QUIT":
+                self.responder("221 Adiós")
+                return
+            else: # MAIL, RCPT, RSET
+                self.responder("250 OK")
+
+
+@pytest.fixture
+def servidor_smtp():
+    servidor = ServidorSMTPLocal()
+    yield servidor
+    servidor.cerrar()
+
+
+def crear_mensaje(asunto):
+    mensaje = MIMEText("resumen", "plain")
+    mensaje["Subject"], mensaje["From"], mensaje["To"] = asunto, "agente@local", "destino@local"
+    return mensaje
+
+
+def crear_remitente(servidor, **opciones):
+    return email_module.RemitenteSMTP("127.0.0.1", servidor.puerto, usuario=None, contrasena=None, starttls=False,
+                                      **dict({"keepalive_segundos": 60, "capacidad": 10, "max_reintentos": 3}, **opciones))
+
+
+def esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "La condición no se cumplió a tiempo"
+        time.sleep(0.01)
+
+
+def test_una_conexion_para_varios_correos_y_reconexion(servidor_smtp):
+    remitente = crear_remitente(servidor_smtp, keepalive_segundos=0.2)
+    try:
+        for numero in range(3):
+            remitente.encolar(crear_mensaje(f"correo {numero}"))
+        esperar(lambda: remitente.enviados == 3)
+        assert servidor_smtp.conexiones == 1
+
+        esperar(lambda: servidor_smtp.noops >= 1) # Inactivo: NOOP para mantener la sesión
+        servidor_smtp.cortar_conexiones()
+        remitente.encolar(crear_mensaje("correo tras el corte"))
+        esperar(lambda: remitente.enviados == 4)
+        assert servidor_smtp.conexiones == 2 and remitente.descartados == 0
+    finally:
+        remitente.detener(5)
+
+
+def test_cola_llena_descarta_el_mas_antiguo(servidor_smtp):
+    remitente = crear_remitente(servidor_smtp, capacidad=2)
+    try:
+        with remitente._condicion: # El hilo no puede tomar mensajes mientras se encolan
+            for numero in range(3):
+                remitente.encolar(crear_mensaje(f"correo {numero}"))
+            assert remitente.descartados == 1
+        esperar(lambda: remitente.enviados == 2)
+    finally:
+        remitente.detener(5)
+    asuntos = [linea for mensaje in servidor_smtp.mensajes for linea in mensaje.splitlines() if linea.startswith("Subject")]
+    assert asuntos == ["Subject: correo 1", "Subject: correo 2"]
+
+
+def test_reintentos_con_backoff(servidor_smtp, monkeypatch):
+    topes = []
+    monkeypatch.setattr(email_module.random, "uniform", lambda minimo, maximo: topes.append(maximo) or 0.0)
+    servidor_smtp.rechazos_pendientes = 2
+    remitente = crear_remitente(servidor_smtp)
+    try:
+        remitente.encolar(crear_mensaje("con reintentos"))
+        esperar(lambda: remitente.enviados == 1)
+    finally:
+        remitente.detener(5)
+    assert topes == [5, 10] # Backoff exponencial: 5 * 2^intento
+    assert len(servidor_smtp.mensajes) == 1
+
+
+def test_descarta_tras_agotar_los_reintentos(servidor_smtp, monkeypatch):
+    monkeypatch.setattr(email_module.random, "uniform", lambda minimo, maximo: 0.0)
+    servidor_smtp.rechazos_pendientes = 10
+    remitente = crear_remitente(servidor_smtp, max_reintentos=1)
+    try:
+        remitente.encolar(crear_mensaje("rechazado"))
+        esperar(lambda: remitente.descartados == 1)
+        assert remitente.enviados == 0 and remitente.pendientes() == 0
+    finally:
+        remitente.detener(5)
+
+
+class RemitenteFalso:
+    def __init__(self):
+        self.mensajes = []
+
+    def encolar(self, mensaje):
+        self.mensajes.append(mensaje)
+
+
+def test_digest_se_envia_al_completarse():
+    remitente = RemitenteFalso()
+    digest = email_module.DigestEmail(remitente, ventana_segundos=60, max_resumenes=3)
+    for numero in range(3):
+        digest.agregar(f"resumen {numero}")
+    assert len(remitente.mensajes) == 1
+    assert remitente.mensajes[0]["Subject"].endswith("(3 ciclos)")
+    cuerpo = remitente.mensajes[0].get_payload(decode=True).decode("utf-8")
+    assert all(f"resumen {numero}" in cuerpo for numero in range(3))
+    digest.vaciar()
+    assert len(remitente.mensajes) == 1 # Nada pendiente: no se envía un digest vacío
+
+
+def test_digest_se_envia_al_cumplirse_la_ventana():
+    remitente = RemitenteFalso()
+    digest = email_module.DigestEmail(remitente, ventana_segundos=0.1, max_resumenes=10)
+    digest.agregar("resumen único")
+    esperar(lambda: len(remitente.mensajes) == 1)
+    assert remitente.mensajes[0]["Subject"].endswith("(1 ciclos)")
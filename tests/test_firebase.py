@@ -0,0 +1,85 @@
+# test_firebase.py
+import sqlite3
+
+import pytest
+
+import database_module
+
+
+class ErrorFirebase(Exception):
+    """Como firebase_admin.exceptions.FirebaseError: el tipo de error va en `code`."""
+
+    def __init__(self, code, mensaje):
+        super().__init__(mensaje)
+        self.code = code
+
+
+class ReferenciaFalsa:
+    """Rechaza las claves con '.' (como Firebase) y puede fallar por red un número de veces."""
+
+    def __init__(self, fallos_de_red=0):
+        self.datos = {}
+        self.llamadas = 0
+        self.fallos_de_red = fallos_de_red
+
+    def update(self, actualizacion):
+        self.llamadas += 1
+        if self.fallos_de_red:
+            self.fallos_de_red -= 1
+            raise ErrorFirebase("UNAVAILABLE", "Servicio no disponible")
+        if any("." in ruta for ruta in actualizacion):
+            raise ErrorFirebase("INVALID_ARGUMENT", "Invalid key: keys must not contain '.'")
+        self.datos.update(actualizacion)
+
+
+def filas(ruta_db, tabla):
+    conexion = sqlite3.connect(ruta_db)
+    try:
+        return conexion.execute(f"SELECT ruta FROM {tabla} ORDER BY id").fetchall()
+    finally:
+        conexion.close()
+
+
+def test_entrada_rechazada_no_bloquea_la_outbox(base_temporal):
+    database_module.crear_tablas()
+    database_module.encolar_firebase({"/a/1": "x", "/pc.local/2": "y", "/a/3": "z"})
+    referencia = ReferenciaFalsa()
+    subidor = database_module.SubidorFirebase(lambda: referencia)
+    assert subidor.vaciar() == 2
+    assert referencia.datos == {"a/1": "x", "a/3": "z"}
+    assert filas(base_temporal, "firebase_outbox") == []
+    assert filas(base_temporal, "firebase_rechazos") == [("/pc.local/2",)]
+
+    database_module.encolar_firebase({"/a/4": "w"})
+    assert subidor.vaciar() == 1 # La entrada rechazada no vuelve a enviarse
+
+
+def test_error_transitorio_conserva_las_entradas(base_temporal):
+    database_module.crear_tablas()
+    database_module.encolar_firebase({"/a/1": "x"})
+    subidor = database_module.SubidorFirebase(lambda: ReferenciaFalsa(fallos_de_red=1))
+    with pytest.raises(ErrorFirebase):
+        subidor.vaciar()
+    assert filas(base_temporal, "firebase_outbox") == [("/a/1",)]
+    assert subidor.vaciar() == 1
+    assert filas(base_temporal, "firebase_rechazos") == []
+
+
+def test_outbox_en_otra_base(base_temporal, tmp_path):
+    database_module.crear_tablas()
+    ruta = str(tmp_path / "otra.db")
+    escritor = database_module.EscritorSQLite(ruta)
+    try:
+        def crear(conexion):
+            for sentencia in database_module.ESQUEMA:
+                conexion.execute(sentencia)
+            conexion.executemany("INSERT INTO firebase_outbox (ruta, valor, creado) VALUES (?, ?, 0)",
+                                 [("/a/1", '"x"'), ("/pc.local/2", '"y"')])
+        escritor.ejecutar(crear)
+        subidor = database_module.SubidorFirebase(lambda: ReferenciaFalsa(), escritor)
+        assert subidor.vaciar() == 1
+        assert subidor.vaciar() == 0 # Las confirmadas se borraron de esta base, no de la compartida
+        assert filas(ruta, "firebase_outbox") == []
+        assert filas(ruta, "firebase_rechazos") == [("/pc.local/2",)]
+    finally:
+        escritor.cerrar()
@@ -0,0 +1,119 @@
+# test_migraciones.py
+import sqlite3
+
+import database_module
+
+ESQUEMA_V0 = [ # Tablas tal como las creaba la primera versión de crear_tablas
+    """
+    CREATE TABLE screenshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        filepath TEXT UNIQUE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE analysis_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        screenshot_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        summary TEXT,
+        dispositivo TEXT,
+        FOREIGN KEY (screenshot_id) REFERENCES screenshots(id)
+    )
+    """,
+]
+
+
+def crear_base_v0(ruta):
+    conexion = sqlite3.connect(ruta)
+    for sentencia in ESQUEMA_V0:
+        conexion.execute(sentencia)
+    conexion.executemany("INSERT INTO screenshots (id, timestamp, filepath) VALUES (?, ?, ?)", [
+        (1, "2024-05-01 10:00:00", "screenshots/a.png"),
+        (2, "fecha rota", "screenshots/b.png"), # No se puede interpretar: no debe frenar la migración
+        (3, "2024-05-01 10:02:00", "screenshots/c.png"),
+    ])
+    conexion.executemany("INSERT INTO analysis_summaries (id, screenshot_id, timestamp, summary, dispositivo) VALUES (?, ?, ?, ?, ?)", [
+        (1, 1, "2024-05-01 10:01:00", '```json\n{"analisis_conjunto": "Mira YouTube", "comportamiento_global": "ok"}\n```', "PC"),
+        (2, 2, "tampoco", "resumen en texto libre", "PC"),
+    ])
+    conexion.commit()
+    conexion.close()
+
+
+def tablas(ruta):
+    conexion = sqlite3.connect(ruta)
+    try:
+        return {fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conexion.close()
+
+
+def version(ruta):
+    conexion = sqlite3.connect(ruta)
+    try:
+        return conexion.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conexion.close()
+
+
+def test_migra_base_original_a_la_version_actual(base_temporal):
+    crear_base_v0(base_temporal)
+    database_module.crear_tablas()
+
+    assert version(base_temporal) == database_module.ESQUEMA_VERSION
+    assert not {"screenshots_v0", "analysis_summaries_v0"} & tablas(base_temporal)
+    conexion = sqlite3.connect(base_temporal)
+    capturas = dict(conexion.execute("SELECT filepath, timestamp FROM screenshots"))
+    assert set(capturas) == {"screenshots/a.png", "screenshots/b.png", "screenshots/c.png"}
+    assert all(isinstance(ts, int) for ts in capturas.values())
+    assert conexion.execute("SELECT COUNT(*) FROM analysis_batches").fetchone()[0] == 2
+    conexion.close()
+
+    resumenes = {r["id"]: r for r in database_module.consultar_resumenes(limite=10)[0]}
+    assert resumenes[1]["analisis_conjunto"] == "Mira YouTube"
+    assert resumenes[2]["analisis_conjunto"] is None
+    assert [r["id"] for r in database_module.buscar_resumenes("youtube")] == [1]
+
+
+def test_migracion_fallida_no_deja_la_base_a_medias(base_temporal, monkeypatch):
+    crear_base_v0(base_temporal)
+
+    def fallar(cursor):
+        raise sqlite3.OperationalError("falla simulada")
+    monkeypatch.setitem(database_module.MIGRACIONES, 2, fallar) # Falla después de que v1 renombró las tablas
+    database_module.crear_tablas()
+
+    assert version(base_temporal) == 0
+    assert tablas(base_temporal) >= {"screenshots", "analysis_summaries"}
+    assert not {"screenshots_v0", "analysis_summaries_v0", "analysis_batches"} & tablas(base_temporal)
+    conexion = sqlite3.connect(base_temporal)
+    assert conexion.execute("SELECT timestamp FROM screenshots WHERE id = 1").fetchone()[0] == "2024-05-01 10:00:00"
+    conexion.close()
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database_module, "DATABASE_PATH", base_temporal)
+    database_module.crear_tablas() # El siguiente arranque completa la migración
+    assert version(base_temporal) == database_module.ESQUEMA_VERSION
+    assert not {"screenshots_v0", "analysis_summaries_v0"} & tablas(base_temporal)
+
+
+def test_crear_tablas_es_idempotente(base_temporal):
+    database_module.crear_tablas()
+    database_module.crear_tablas()
+    assert version(base_temporal) == database_module.ESQUEMA_VERSION
+
+
+def test_migra_v5_a_columnas_estructuradas(base_temporal):
+    database_module.crear_tablas()
+    conexion = sqlite3.connect(base_temporal)
+    conexion.execute("INSERT INTO analysis_summaries (id, timestamp, summary) VALUES (1, 0, ?)",
+                     ('{"analisis_conjunto": "editor", "uso_tiempo_global": "bien"}',))
+    database_module._indexar_resumenes(conexion, [(1, '{"analisis_conjunto": "editor", "uso_tiempo_global": "bien"}')])
+    conexion.execute("PRAGMA user_version = 5") # Columnas sin llenar, como antes de v6
+    conexion.commit()
+    conexion.close()
+
+    database_module.crear_tablas()
+    fila = database_module.consultar_resumenes()[0][0]
+    assert (fila["analisis_conjunto"], fila["uso_tiempo_global"]) == ("editor", "bien")
@@ -0,0 +1,98 @@
+# test_parser.py
+from datetime import datetime
+
+import ai_analysis_module
+import database_module
+import main
+import metricas_module
+import motor_analisis_module
+from ai_analysis_module import ParserJSONIncremental
+
+
+def alimentar_por_partes(parser, texto, tamano):
+    for inicio in range(0, len(texto), tamano):
+        parser.alimentar(texto[inicio:inicio + tamano])
+
+
+def test_campos_en_orden_y_tolera_bloque_de_codigo():
+    publicados = []
+    parser = ParserJSONIncremental(lambda clave, valor: publicados.append((clave, valor)))
+    texto = '```json\n{"a": "x, {y}", "b": {"c": [1, 2]}, "d": 3, "e": "\\"z\\""}\n```'
+    alimentar_por_partes(parser, texto, 3)
+    assert publicados == [("a", "x, {y}"), ("b", {"c": [1, 2]}), ("d", 3), ("e", '"z"')]
+    assert parser.terminado
+    assert parser.resultado() == {"a": "x, {y}", "b": {"c": [1, 2]}, "d": 3, "e": '"z"'}
+
+
+def test_respuesta_truncada_conserva_los_campos_completos():
+    parser = ParserJSONIncremental()
+    parser.alimentar('{"a": "x", "b": "sin cer')
+    assert not parser.terminado
+    assert parser.resultado() == {"a": "x"}
+
+
+def test_texto_sin_json():
+    parser = ParserJSONIncremental()
+    parser.alimentar("No hay objeto en esta respuesta.")
+    assert parser.resultado() is None
+
+
+def test_reinicio_descarta_campos_y_avisa():
+    publicados = []
+    parser = ParserJSONIncremental(lambda clave, valor: publicados.append((clave, valor)))
+    parser.alimentar('{"a": "x"')
+    parser.alimentar('  ,')
+    parser.alimentar(None)
+    parser.alimentar('{"b": "y"}')
+    assert parser.resultado() == {"b": "y"}
+    assert publicados == [("a", "x"), (None, None), ("b", "y")]
+
+
+def test_reintento_del_motor_reinicia_el_parser():
+    class BackendQueFallaAMitad:
+        llamadas = 0
+        def generar_stream(self, modelo, system_instruction, contenidos, max_output_tokens, timeout=None):
+            self.llamadas += 1
+            if self.llamadas == 1:
+                yield '{"a": "x", '
+                raise motor_analisis_module.ErrorReintentable("503 simulado")
+            yield '{"b": "y"}'
+    motor = motor_analisis_module.MotorAnalisis(BackendQueFallaAMitad(), espera_base=0, espera_maxima=0)
+    parser = ParserJSONIncremental()
+    try:
+        texto = motor.generar_stream("modelo", "", [], 10, parser.alimentar)
+    finally:
+        motor.cerrar()
+    assert texto == '{"b": "y"}'
+    assert parser.resultado() == {"b": "y"}
+
+
+def test_primer_campo_solo_se_mide_en_streaming(monkeypatch):
+    observados = []
+    monkeypatch.setattr(metricas_module, "observar", lambda nombre, valor, **etiquetas: observados.append(nombre))
+    monkeypatch.setattr(ai_analysis_module, "obtener_motor",
+                        lambda: motor_analisis_module.MotorAnalisis(motor_analisis_module.BackendFalso()))
+    monkeypatch.setattr(ai_analysis_module, "cargar_imagen", lambda fuente: fuente)
+    monkeypatch.setattr(ai_analysis_module, "tamano_solicitud", lambda prompt, fuentes: 0)
+
+    monkeypatch.setattr(ai_analysis_module, "AI_STREAMING", False)
+    ai_analysis_module.generar_respuesta("", "", [], ParserJSONIncremental())
+    assert "primer_campo_ia_segundos" not in observados
+
+    monkeypatch.setattr(ai_analysis_module, "AI_STREAMING", True)
+    ai_analysis_module.generar_respuesta("", "", [], ParserJSONIncremental())
+    assert observados.count("primer_campo_ia_segundos") == 1
+
+
+def test_reinicio_borra_los_campos_parciales(base_temporal, monkeypatch):
+    monkeypatch.setattr(main, "AI_STREAMING", True)
+    monkeypatch.setattr(database_module, "encolar_firebase", lambda actualizaciones: True)
+    database_module.crear_tablas()
+    lote, campos = {"inicio": datetime(2026, 1, 1, 12, 0, 0)}, {}
+    parser = ParserJSONIncremental(main.publicar_campo(lote, campos))
+    parser.alimentar('{"a": "x", ')
+    parser.alimentar(None)
+    parser.alimentar('{"b": "y"}')
+    database_module.obtener_escritor().ejecutar(lambda conexion: None) # Espera a que se confirmen las escrituras
+    assert campos == {"b": "y"}
+    assert [ciclo["campos"] for ciclo in database_module.consultar_resumenes_parciales()] == [{"b": "y"}]
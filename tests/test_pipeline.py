@@ -0,0 +1,25 @@
+# test_pipeline.py
+import pipeline_module
+
+
+def crear_lote(numero, frames=10):
+    return {"frames": [{"inicio": numero, "indice": i} for i in range(frames)], "inicio": numero, "fin": numero + 1}
+
+
+def test_fusion_acotada_por_frames():
+    cola = pipeline_module.ColaLotes(2, pipeline_module.POLITICA_FUSIONAR, max_frames_fusion=30)
+    for numero in range(50): # Análisis detenido: nadie saca lotes de la cola
+        cola.poner(crear_lote(numero))
+    lotes = [cola.obtener(0) for _ in range(cola.profundidad())]
+    assert len(lotes) == 2
+    assert all(len(lote["frames"]) <= 30 for lote in lotes)
+    assert lotes[-1]["fin"] == 50 # El lote más reciente se conserva
+    assert cola.descartados > 0 and cola.fusionados > 0
+
+
+def test_fusion_sin_limite():
+    cola = pipeline_module.ColaLotes(1, pipeline_module.POLITICA_FUSIONAR)
+    for numero in range(5):
+        cola.poner(crear_lote(numero))
+    lote = cola.obtener(0)
+    assert len(lote["frames"]) == 50 and lote["fusionados"] == 5
@@ -0,0 +1,39 @@
+# test_replay.py
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import database_module
+import main
+import replay_module
+from config import DISPOSITIVO
+
+
+def test_ciclos_reprocesados_a_la_vez_conservan_su_fecha(base_temporal, tmp_path):
+    database_module.crear_tablas()
+    base = datetime(2025, 6, 1, 9, 0, 0)
+    capturas = []
+    for minuto in (0, 1, 10, 11): # Dos ciclos de 5 minutos con dos capturas cada uno
+        momento = base + timedelta(minutes=minuto)
+        ruta = tmp_path / f"screenshot_{DISPOSITIVO}_{momento.strftime('%Y%m%d_%H%M%S')}_000.png"
+        ruta.write_bytes(b"\x00" * 16)
+        capturas.append((momento, str(ruta)))
+    ciclos = replay_module.agrupar_en_ciclos(capturas, 300)
+
+    juntos = threading.Barrier(2) # Los dos ciclos terminan el análisis en el mismo segundo
+    def analizar(lote):
+        juntos.wait(5)
+        return dict(lote, resumen='{"analisis_conjunto": "Editor."}', campos=None)
+
+    resultado = replay_module.Reprocesador(analizar, main.guardar_lote, concurrencia=2).ejecutar(ciclos)
+    assert resultado["completados"] == 2
+
+    conexion = sqlite3.connect(base_temporal)
+    try:
+        fechas = sorted(fila[0] for fila in conexion.execute("SELECT timestamp FROM analysis_summaries"))
+        rutas = sorted(fila[0] for fila in conexion.execute(
+            "SELECT ruta FROM firebase_outbox WHERE ruta LIKE '/resumenes_globales/%'"))
+    finally:
+        conexion.close()
+    assert fechas == [database_module.a_epoch(ciclo["fin"]) for ciclo in ciclos]
+    assert rutas == [f"/resumenes_globales/{DISPOSITIVO}/{ciclo['fin'].strftime('%Y-%m-%d_%H:%M:%S')}" for ciclo in ciclos]
@@ -0,0 +1,21 @@
+# utilidades_json_module.py
+import json
+import re
+
+
+def extraer_json(texto):
+    """
+    Extrae el objeto JSON de una respuesta del modelo, tolerando bloques de código markdown
+    (```json ... ```) y texto alrededor. Retorna el dict, o None si no hay un JSON válido.
+    """
+    if not texto:
+        return None
+    texto = re.sub(r"```(?:json)?", "", texto)
+    inicio, fin = texto.find("{"), texto.rfind("}")
+    if inicio == -1 or fin <= inicio:
+        return None
+    try:
+        resultado = json.loads(texto[inicio:fin + 1])
+    except json.JSONDecodeError:
+        return None
+    return resultado if isinstance(resultado, dict) else None